@@ -0,0 +1,93 @@
+"""
+Multi-get and batch write helpers
+
+Multi-get endpoints take `?ids=1,2,3` and load every row with one IN query.
+Batch writes check that the rows they reference exist with one query per
+table, then insert all rows with a single executemany.
+"""
+
+from fastapi import HTTPException, status
+from sqlalchemy import select, insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+# Most ids (or rows) accepted in one multi-get or batch request
+MAX_BATCH_SIZE = 100
+
+
+def parse_ids(ids: str) -> list[int]:
+    """Parse a comma-separated id list, dropping repeats and keeping the order"""
+    try:
+        values = [int(value) for value in ids.split(",") if value.strip()]
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="ids must be a comma-separated list of integers"
+        )
+    
+    unique = list(dict.fromkeys(values))
+    check_batch_size(unique)
+    return unique
+
+
+def check_batch_size(items: list) -> None:
+    if not items:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Batch is empty"
+        )
+    if len(items) > MAX_BATCH_SIZE:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {MAX_BATCH_SIZE} items per request"
+        )
+
+
+def multi_get_response(rows: list, ids: list[int]) -> dict:
+    """
+    Build the response shared by every multi-get endpoint
+    
+    Items come back in the requested order; ids with no row are listed in
+    `missing` rather than failing the whole request.
+    """
+    by_id = {row.id: row for row in rows}
+    items = [by_id[row_id] for row_id in ids if row_id in by_id]
+    return {
+        "items": items,
+        "count": len(items),
+        "missing": [row_id for row_id in ids if row_id not in by_id],
+    }
+
+
+async def find_missing(db: AsyncSession, id_column, ids) -> list[int]:
+    """Ids with no row in id_column's table, found with one IN query"""
+    wanted = set(ids)
+    found = set((await db.scalars(select(id_column).where(id_column.in_(wanted)))).all())
+    return sorted(wanted - found)
+
+
+async def require_existing(db: AsyncSession, id_column, ids, label: str) -> None:
+    """Raise 404 naming every referenced id that doesn't exist"""
+    missing = await find_missing(db, id_column, ids)
+    if missing:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"{label} with ids {missing} not found"
+        )
+
+
+def insert_rows(db: Session, model, rows: list[dict]) -> list[int]:
+    """
+    Insert rows and return their ids
+    
+    Uses one executemany with RETURNING where the backend supports it (SQLite,
+    MariaDB). MySQL has no RETURNING, so there the rows go through the ORM
+    flush, which inserts them one at a time to learn each id.
+    """
+    if db.get_bind().dialect.insert_executemany_returning:
+        return list(db.execute(insert(model).returning(model.id), rows).scalars())
+    
+    instances = [model(**row) for row in rows]
+    db.add_all(instances)
+    db.flush()
+    return [instance.id for instance in instances]
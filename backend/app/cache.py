@@ -0,0 +1,223 @@
+"""
+Response cache
+
+GET routes for hot entities (posts, profiles, friend lists, feed and comment
+pages) cache their serialized JSON body. Every entry carries tags naming the
+rows it was built from, and write routes invalidate those tags after commit,
+so only the entries that could have changed are dropped.
+
+Tags used by the routes:
+    
+    post:{id}, comment:{id}, user:{id}    the entity appears in the response
+    friends:{user_id}                      the user's friend list
+    {list}:new                             a page that new rows would land on
+    {list}:offset                          a legacy ?skip= page, shifted by any insert/delete
+
+Replicas can lag the primary, so only responses read from the primary are
+stored: a replica that hasn't applied a write yet would otherwise put the old
+row back right after the write invalidated it. A client pinned to the primary
+after its own write skips the lookup too, and always gets a fresh read.
+
+The in-process LRU backend is per worker. With several workers, plug in a
+shared backend (implementing CacheBackend) so invalidations reach all of them.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Iterable, Optional
+
+from fastapi import Response
+from pydantic import TypeAdapter
+
+from app.config import settings
+from app.database import READ_FROM, READ_FROM_PINNED, READ_FROM_REPLICA
+
+
+class CacheBackend:
+    """Interface for cache storage backends"""
+    
+    def get(self, key: str) -> Optional[bytes]:
+        raise NotImplementedError
+    
+    def set(self, key: str, value: bytes, tags: Iterable[str]) -> None:
+        raise NotImplementedError
+    
+    def invalidate(self, tags: Iterable[str]) -> None:
+        raise NotImplementedError
+    
+    def stats(self) -> dict:
+        raise NotImplementedError
+
+
+class NullCacheBackend(CacheBackend):
+    """Backend that never stores anything (caching disabled)"""
+    
+    def get(self, key: str) -> Optional[bytes]:
+        return None
+    
+    def set(self, key: str, value: bytes, tags: Iterable[str]) -> None:
+        pass
+    
+    def invalidate(self, tags: Iterable[str]) -> None:
+        pass
+    
+    def stats(self) -> dict:
+        return {"backend": "none"}
+
+
+class LRUCacheBackend(CacheBackend):
+    """Bounded in-process cache with least-recently-used eviction and a TTL"""
+    
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        # key -> (expires_at, value, tags), least recently used first
+        self._entries: OrderedDict[str, tuple[float, bytes, tuple[str, ...]]] = OrderedDict()
+        self._keys_by_tag: dict[str, set[str]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+    
+    def _remove(self, key: str) -> None:
+        _, _, tags = self._entries.pop(key)
+        for tag in tags:
+            keys = self._keys_by_tag.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._keys_by_tag[tag]
+    
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            
+            expires_at, value, _ = entry
+            if expires_at <= time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+    
+    def set(self, key: str, value: bytes, tags: Iterable[str]) -> None:
+        tags = tuple(tags)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value, tags)
+            for tag in tags:
+                self._keys_by_tag.setdefault(tag, set()).add(key)
+            
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+    
+    def invalidate(self, tags: Iterable[str]) -> None:
+        with self._lock:
+            for tag in tags:
+                for key in self._keys_by_tag.pop(tag, ()):
+                    if key in self._entries:
+                        self._remove(key)
+                        self.invalidations += 1
+    
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "backend": "memory",
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+
+class ResponseCache:
+    """Caches serialized JSON responses in a CacheBackend"""
+    
+    def __init__(self, backend: CacheBackend):
+        self.backend = backend
+    
+    def get(self, key: str, db=None) -> Optional[Response]:
+        """
+        The cached response for key, unless db (the route's read session) was
+        pinned to the primary by a recent write
+        """
+        if db is not None and db.info.get(READ_FROM) == READ_FROM_PINNED:
+            return None
+        body = self.backend.get(key)
+        if body is None:
+            return None
+        return Response(body, media_type="application/json", headers={"X-Cache": "HIT"})
+    
+    def store(self, key: str, content, tags: Iterable[str], model: Any, db=None) -> Response:
+        """
+        Serialize content as the route's response model, cache it under key
+        and return it as a response
+        
+        Content that db (the session it was read with) read from a replica is
+        returned without being cached.
+        """
+        adapter = _adapter(model)
+        body = adapter.dump_json(adapter.validate_python(content, from_attributes=True))
+        if db is None or db.info.get(READ_FROM) != READ_FROM_REPLICA:
+            self.backend.set(key, body, tags)
+        return Response(body, media_type="application/json", headers={"X-Cache": "MISS"})
+    
+    def invalidate(self, *tags: str) -> None:
+        self.backend.invalidate(tags)
+    
+    def stats(self) -> dict:
+        return self.backend.stats()
+
+
+@lru_cache(maxsize=None)
+def _adapter(model: Any) -> TypeAdapter:
+    # Building the validator and serializer is the slow part; do it once per model
+    return TypeAdapter(model)
+
+
+def page_key(prefix: str, after: Optional[str], skip: int, limit: int) -> str:
+    return f"{prefix}:after={after or ''}:skip={skip}:limit={limit}"
+
+
+def page_tags(list_tag: str, page: dict, after: Optional[str], skip: int, descending: bool = True) -> list[str]:
+    """
+    Tags for the membership of a list page
+    
+    New rows go to the head of a newest-first list and the tail of an
+    oldest-first one; offset pages shift whenever any row is added or removed.
+    """
+    tags = []
+    if descending and after is None and not skip:
+        tags.append(f"{list_tag}:new")
+    if not descending and page["next_cursor"] is None:
+        tags.append(f"{list_tag}:new")
+    if skip:
+        tags.append(f"{list_tag}:offset")
+    return tags
+
+
+def create_backend() -> CacheBackend:
+    """Pick the cache backend from settings.CACHE_BACKEND (memory or none)"""
+    if settings.CACHE_BACKEND == "none":
+        return NullCacheBackend()
+    if settings.CACHE_BACKEND == "memory":
+        return LRUCacheBackend(settings.CACHE_MAX_ENTRIES, settings.CACHE_TTL_SECONDS)
+    raise ValueError(f"Unknown cache backend: {settings.CACHE_BACKEND}")
+
+
+response_cache = ResponseCache(create_backend())
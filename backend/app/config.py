@@ -3,7 +3,7 @@ Configuration settings for Social Network Backend
 """
 
 from os.path import dirname, join
-from typing import List, ClassVar
+from typing import Dict, List, ClassVar
 from pydantic_settings import BaseSettings
 
 # Use root .env file
@@ -19,6 +19,31 @@ class Settings(BaseSettings):
     # Database (SQLite for dev, MySQL for production)
     DATABASE_URL: str = "sqlite:///./database.db"
     
+    # Routes use the asyncio driver (aiosqlite/aiomysql) unless DB_ASYNC is off,
+    # in which case they run on the sync engine in the threadpool
+    DB_ASYNC: bool = True
+    ASYNC_DATABASE_URL: str = ""
+    
+    # Read replicas for GET routes; after a write, the client's reads stay on
+    # the primary for READ_YOUR_WRITES_SECONDS
+    DATABASE_REPLICA_URLS: List[str] = []
+    READ_YOUR_WRITES_SECONDS: float = 5.0
+    REPLICA_RETRY_SECONDS: float = 30.0
+    
+    # Connection pool (per engine)
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: float = 30.0
+    DB_POOL_RECYCLE: int = 1800
+    DB_POOL_PRE_PING: bool = True
+    
+    # SQLite performance profile, applied to every new connection
+    SQLITE_JOURNAL_MODE: str = "WAL"
+    SQLITE_SYNCHRONOUS: str = "NORMAL"
+    SQLITE_MMAP_SIZE: int = 256 * 1024 * 1024
+    SQLITE_CACHE_SIZE_KB: int = 64 * 1024
+    SQLITE_BUSY_TIMEOUT_MS: int = 5000
+    
     # CORS
     CORS_ORIGINS: List[str] = ["*"]
     
@@ -28,6 +53,85 @@ class Settings(BaseSettings):
     # API
     API_PREFIX: str = "/api"
     
+    # Search backend: "auto", "fts5", "mysql" or "memory"
+    SEARCH_BACKEND: str = "auto"
+    
+    # Response cache: "memory" (per-process LRU with TTL) or "none"
+    CACHE_BACKEND: str = "memory"
+    CACHE_MAX_ENTRIES: int = 10000
+    CACHE_TTL_SECONDS: float = 60.0
+    
+    # Image variants: render on upload (eager), or in a background job after upload
+    # and on first request if that hasn't run yet; 0 workers = one per CPU
+    IMAGE_VARIANTS_EAGER: bool = True
+    IMAGE_WORKERS: int = 0
+    
+    # Uploads that no post or user stores are deleted this long after they were uploaded
+    UPLOAD_UNATTACHED_HOURS: float = 24.0
+    
+    # Feed (fan-out on write); friends' timelines are filled by a background job
+    # unless FEED_FANOUT_IN_BACKGROUND is off
+    FEED_FANOUT_MAX_FRIENDS: int = 1000
+    FEED_FANOUT_IN_BACKGROUND: bool = True
+    TIMELINE_BACKFILL_LIMIT: int = 200
+    
+    # Ranked feeds (?mode=ranked): how many of the newest posts are scored, how
+    # fast recency and comment velocity decay, and the weight of each signal.
+    # Stored engagement depends on the velocity half-life; run
+    # `python -m app.ranking` after changing it
+    FEED_RANK_CANDIDATES: int = 200
+    FEED_RANK_RECENCY_HALF_LIFE_HOURS: float = 24.0
+    FEED_RANK_VELOCITY_HALF_LIFE_HOURS: float = 6.0
+    FEED_RANK_VELOCITY_WEIGHT: float = 1.0
+    FEED_RANK_AFFINITY_WEIGHT: float = 1.0
+    
+    # Friend graph index: reload interval for multi-worker deployments (0 = never)
+    FRIEND_GRAPH_REFRESH_SECONDS: float = 0
+    
+    # Most friendships accepted by one POST /friends/bulk
+    FRIEND_IMPORT_MAX_EDGES: int = 10000
+    
+    # Friend suggestions: users whose ranked lists are kept, and how long a list lives
+    SUGGESTION_CACHE_USERS: int = 20000
+    SUGGESTION_MAX_AGE_SECONDS: float = 3600.0
+    
+    # Live updates (/api/live): events queued per subscriber before it is evicted
+    # as a slow consumer, keep-alive interval, and the directory where workers bind
+    # the Unix sockets that carry events between them ("" = single worker, no bridge)
+    PUBSUB_QUEUE_SIZE: int = 100
+    PUBSUB_HEARTBEAT_SECONDS: float = 15.0
+    PUBSUB_SOCKET_DIR: str = ""
+    
+    # Background jobs (the jobs table): whether web processes run workers (else run
+    # `python -m app.jobs`), jobs of each queue run at once per process, how often
+    # idle workers poll, how long a claimed job may run before it is retried, retry
+    # backoff, and how long done jobs (and their idempotency keys) and failed jobs are kept
+    JOB_WORKERS_IN_APP: bool = True
+    JOB_QUEUES: Dict[str, int] = {"default": 2, "timeline": 4, "images": 2}
+    JOB_POLL_SECONDS: float = 1.0
+    JOB_LEASE_SECONDS: float = 300.0
+    JOB_MAX_ATTEMPTS: int = 5
+    JOB_RETRY_BASE_SECONDS: float = 1.0
+    JOB_RETRY_MAX_SECONDS: float = 300.0
+    JOB_RETENTION_HOURS: float = 24.0
+    JOB_FAILED_RETENTION_DAYS: float = 7.0
+    
+    # Request metrics (MetricsMiddleware and SQL timing); GET /metrics is served either way
+    METRICS_ENABLED: bool = True
+    
+    # Query diagnostics for development and canary builds: X-Query-Report headers,
+    # warnings for statement shapes repeated this many times in one request
+    # (likely N+1) and for statements slower than SLOW_QUERY_MS, with their plan
+    QUERY_DIAGNOSTICS: bool = False
+    QUERY_REPEAT_THRESHOLD: int = 5
+    SLOW_QUERY_MS: float = 100.0
+    
+    # Media serving: browser cache lifetime for files that can change (content-named
+    # files are cached for a year), and the in-memory cache of small files
+    MEDIA_MAX_AGE_SECONDS: int = 3600
+    MEDIA_MEMORY_CACHE_BYTES: int = 32 * 1024 * 1024
+    MEDIA_MEMORY_CACHE_MAX_FILE_BYTES: int = 256 * 1024
+    
     env_file: ClassVar[str] = dotenv_path
     case_sensitive: ClassVar[bool] = True
 
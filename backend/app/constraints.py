@@ -0,0 +1,122 @@
+"""
+Constraint-backed writes
+
+Write routes don't SELECT first to check that the rows they reference exist
+or that a unique value is free. They run the write and let the database's
+foreign keys, primary keys and unique indexes reject it, so a successful
+write costs one statement. Only a rejected write pays for a follow-up query
+to find out which reference was missing, and gets the same 400/404 response
+the up-front checks used to give.
+
+UPDATE and DELETE use RETURNING where the backend has it (SQLite; MariaDB for
+DELETE), and fall back to a separate read on MySQL.
+"""
+
+from typing import Optional
+
+from fastapi import HTTPException, status
+from sqlalchemy import delete, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.batch import find_missing
+
+
+def _constraint_names(column) -> set[str]:
+    """How SQLite (table.column) and MySQL (index name) name a unique column in errors"""
+    names = {f"{column.table.name}.{column.name}"}
+    names.update(index.name for index in column.table.indexes if index.unique and column.name in index.columns)
+    return names
+
+
+def is_foreign_key_violation(error: IntegrityError) -> bool:
+    return "foreign key constraint" in str(error.orig).lower()
+
+
+def violated_unique(error: IntegrityError, columns) -> Optional[object]:
+    """The unique column (one of columns) a rejected write collided on, if any"""
+    message = str(error.orig)
+    for column in columns:
+        if any(name in message for name in _constraint_names(column)):
+            return column
+    return None
+
+
+async def constraint_error(
+    db: AsyncSession,
+    error: IntegrityError,
+    unique: Optional[dict] = None,
+    references: tuple = (),
+    duplicate: Optional[str] = None,
+) -> HTTPException:
+    """
+    Turn a write rejected by a constraint into the route's 400/404 response
+    
+    Args:
+        unique: unique column -> detail for a value that is already taken
+        references: (id column, id or ids, label) for each table the write
+            points at, checked in order; missing ids get a 404 naming them
+        duplicate: detail for any other unique or primary key collision
+    
+    The session is rolled back first. Errors that don't match are re-raised.
+    """
+    await db.rollback()
+    
+    column = violated_unique(error, unique or {})
+    if column is not None:
+        return HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=unique[column])
+    
+    if duplicate and not is_foreign_key_violation(error):
+        return HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=duplicate)
+    
+    # SQLite doesn't say which foreign key failed, so look for the missing row
+    for id_column, ids, label in references:
+        if isinstance(ids, int):
+            if await find_missing(db, id_column, [ids]):
+                return HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail=f"{label} with id {ids} not found"
+                )
+        else:
+            missing = await find_missing(db, id_column, ids)
+            if missing:
+                return HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail=f"{label} with ids {missing} not found"
+                )
+    raise error
+
+
+def update_row(db: Session, model, row_id: int, values: dict):
+    """
+    UPDATE one row by id and return it, or None if there is no such row
+    
+    Column onupdate defaults apply. The returned instance reflects the new values.
+    """
+    if not values:
+        return db.get(model, row_id)
+    
+    statement = update(model).where(model.id == row_id).values(values)
+    if db.get_bind().dialect.update_returning:
+        return db.scalar(statement.returning(model), execution_options={"populate_existing": True})
+    
+    if not db.execute(statement).rowcount:
+        return None
+    return db.get(model, row_id, populate_existing=True)
+
+
+def delete_row(db: Session, model, row_id: int, *columns):
+    """
+    DELETE one row by id and return its columns as they were, or None if there was no row
+    
+    Only for rows nothing else references through the ORM: no cascades run.
+    """
+    statement = delete(model).where(model.id == row_id)
+    if db.get_bind().dialect.delete_returning:
+        return db.execute(statement.returning(*columns)).first()
+    
+    row = db.execute(select(*columns).where(model.id == row_id).with_for_update()).first()
+    if row is not None:
+        db.execute(statement)
+    return row
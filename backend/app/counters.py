@@ -0,0 +1,134 @@
+"""
+Denormalized counters
+
+`posts.comment_count`, `users.post_count` and `users.friend_count` are stored
+on the rows and adjusted in the same transaction as the write that changes
+them, so showing a count never needs COUNT(*) or a relationship load.
+
+`reconcile` recomputes the counters from their source tables in bulk and
+reports the rows that had drifted:
+    
+    python -m app.counters             # report and fix
+    python -m app.counters --dry-run   # report only
+"""
+
+import argparse
+import json
+
+from sqlalchemy import bindparam, func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.database import add_missing_columns
+from app.models import Comment, Post, User, friends
+
+# Counter column -> the column its source rows are grouped by
+COUNTERS = {
+    Post.comment_count: Comment.post_id,
+    User.post_count: Post.user_id,
+    User.friend_count: friends.c.user_id,
+}
+
+# Drifted rows fixed per UPDATE during reconciliation
+RECONCILE_CHUNK = 1000
+
+
+def _column(counter):
+    return counter.property.columns[0]
+
+
+async def adjust(db: AsyncSession, counter, deltas: dict[int, int]) -> None:
+    """
+    Add deltas (row id -> change) to a counter with one executemany
+    
+    Runs in the caller's transaction.
+    """
+    rows = [{"row_id": row_id, "delta": delta} for row_id, delta in deltas.items() if delta]
+    if not rows:
+        return
+    
+    column = _column(counter)
+    table = column.table
+    await db.execute(
+        update(table)
+        .where(table.c.id == bindparam("row_id"))
+        .values({column.name: column + bindparam("delta")}),
+        rows,
+    )
+
+
+def _actual_count(counter, source):
+    """Correlated COUNT(*) of a counter's source rows"""
+    table = _column(counter).table
+    return (
+        select(func.count())
+        .select_from(source.table)
+        .where(source == table.c.id)
+        .scalar_subquery()
+    )
+
+
+def reconcile(db: Session, fix: bool = True, examples: int = 10) -> dict:
+    """
+    Recompute every counter from its source table and report drift
+    
+    Drifted rows are recounted with a correlated UPDATE, so writes that commit
+    while this runs are not overwritten with a stale count.
+    
+    Returns:
+        Per counter: the number of drifted rows and a few examples
+    """
+    report = {}
+    for counter, source in COUNTERS.items():
+        column = _column(counter)
+        table = column.table
+        actual = (
+            select(source.label("row_id"), func.count().label("actual"))
+            .group_by(source)
+            .subquery()
+        )
+        expected = func.coalesce(actual.c.actual, 0)
+        drifted = db.execute(
+            select(table.c.id, column, expected)
+            .select_from(table.outerjoin(actual, actual.c.row_id == table.c.id))
+            .where(column != expected)
+            .order_by(table.c.id)
+        ).all()
+        
+        report[f"{table.name}.{column.name}"] = {
+            "drifted": len(drifted),
+            "examples": [
+                {"id": row_id, "stored": stored, "actual": count} for row_id, stored, count in drifted[:examples]
+            ],
+        }
+        
+        if fix:
+            recount = update(table).values({column.name: _actual_count(counter, source)})
+            for start in range(0, len(drifted), RECONCILE_CHUNK):
+                row_ids = [row_id for row_id, _, _ in drifted[start:start + RECONCILE_CHUNK]]
+                db.execute(recount.where(table.c.id.in_(row_ids)))
+    
+    if fix:
+        db.commit()
+    return report
+
+
+def ensure_columns(db: Session) -> None:
+    """
+    Add the counter columns to tables created before they existed, then fill them
+    """
+    if add_missing_columns(db, [_column(counter) for counter in COUNTERS]):
+        reconcile(db)
+
+
+if __name__ == "__main__":
+    from app.database import Base, SessionLocal, engine
+    
+    parser = argparse.ArgumentParser(description="Recompute denormalized counters and report drift")
+    parser.add_argument("--dry-run", action="store_true", help="report drift without fixing it")
+    args = parser.parse_args()
+    
+    Base.metadata.create_all(bind=engine)
+    with SessionLocal() as session:
+        ensure_columns(session)
+        print(json.dumps(reconcile(session, fix=not args.dry_run), indent=2))
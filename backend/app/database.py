@@ -1,18 +1,355 @@
-from sqlalchemy import create_engine
+import math
+import time
+from contextlib import asynccontextmanager, AsyncExitStack
+
+from fastapi import Request, Response
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import create_engine, event, insert, inspect, text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
 from app.config import settings
+from app.replicas import Replica, ReplicaSet
 
 SQLALCHEMY_DATABASE_URL = settings.DATABASE_URL
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+# Async drivers for the sync URLs used in DATABASE_URL
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "mysql": "mysql+aiomysql",
+}
+
+
+def to_async_url(url: str) -> str:
+    """Swap the driver of a database URL for its asyncio counterpart"""
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver configured for {backend}")
+    return parsed.set(drivername=ASYNC_DRIVERS[backend]).render_as_string(hide_password=False)
+
+
+class PoolWaitStats:
+    """Checkout counters shared by the instrumented pool classes"""
+    
+    def __init__(self):
+        self.checkouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+    
+    def record(self, seconds: float):
+        self.checkouts += 1
+        self.wait_seconds_total += seconds
+        if seconds > self.wait_seconds_max:
+            self.wait_seconds_max = seconds
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited"""
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.wait_stats = PoolWaitStats()
+    
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            self.wait_stats.record(time.perf_counter() - start)
+
+
+class TimedAsyncQueuePool(TimedQueuePool, AsyncAdaptedQueuePool):
+    """AsyncAdaptedQueuePool that records how long each checkout waited"""
+
+
+def _is_sqlite(url: str) -> bool:
+    return make_url(url).get_backend_name() == "sqlite"
+
+
+def _engine_options(url: str, poolclass) -> dict:
+    options = {
+        "poolclass": poolclass,
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+        "pool_pre_ping": settings.DB_POOL_PRE_PING,
+    }
+    # Sync sessions may hop between threadpool threads within one request
+    if _is_sqlite(url) and poolclass is TimedQueuePool:
+        options["connect_args"] = {"check_same_thread": False}
+    return options
+
+
+def _apply_sqlite_profile(dbapi_connection, connection_record):
+    """
+    Tune every new SQLite connection: WAL lets readers run alongside a writer,
+    synchronous=NORMAL is durable under WAL, and the busy timeout makes
+    writers queue instead of failing with "database is locked"
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA journal_mode={settings.SQLITE_JOURNAL_MODE}")
+    cursor.execute(f"PRAGMA synchronous={settings.SQLITE_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA mmap_size={int(settings.SQLITE_MMAP_SIZE)}")
+    cursor.execute(f"PRAGMA cache_size={-int(settings.SQLITE_CACHE_SIZE_KB)}")
+    cursor.execute(f"PRAGMA busy_timeout={int(settings.SQLITE_BUSY_TIMEOUT_MS)}")
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+
+
+def create_db_engine(url: str):
+    """Create a sync engine with the configured pool and SQLite profile"""
+    db_engine = create_engine(url, **_engine_options(url, TimedQueuePool))
+    if _is_sqlite(url):
+        event.listen(db_engine, "connect", _apply_sqlite_profile)
+    return db_engine
+
+
+def create_db_async_engine(url: str):
+    """Create an async engine with the configured pool and SQLite profile"""
+    db_engine = create_async_engine(url, **_engine_options(url, TimedAsyncQueuePool))
+    if _is_sqlite(url):
+        event.listen(db_engine.sync_engine, "connect", _apply_sqlite_profile)
+    return db_engine
+
+
+def _pool_stats(db_engine) -> dict:
+    pool = db_engine.pool
+    wait_stats = pool.wait_stats
+    return {
+        "size": pool.size(),
+        "checked_in": pool.checkedin(),
+        "checked_out": pool.checkedout(),
+        "overflow": max(pool.overflow(), 0),
+        "checkouts": wait_stats.checkouts,
+        "wait_seconds_total": round(wait_stats.wait_seconds_total, 6),
+        "wait_seconds_max": round(wait_stats.wait_seconds_max, 6),
+    }
+
+
+engine = create_db_engine(SQLALCHEMY_DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+ASYNC_DATABASE_URL = settings.ASYNC_DATABASE_URL or to_async_url(SQLALCHEMY_DATABASE_URL)
+
+async_engine = create_db_async_engine(ASYNC_DATABASE_URL)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+
+replica_set = ReplicaSet(
+    [
+        Replica(url, create_db_async_engine(to_async_url(url)), create_db_engine(url))
+        for url in settings.DATABASE_REPLICA_URLS
+    ],
+    retry_seconds=settings.REPLICA_RETRY_SECONDS,
+)
+
+# Cookie holding the time until which a client's reads go to the primary
+READ_PRIMARY_COOKIE = "read_primary_until"
+
+SAFE_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+# session.info key recording where read_session_scope sent a session: a replica,
+# the primary, or the primary because the client is in its read-your-writes window
+READ_FROM = "read_from"
+READ_FROM_REPLICA = "replica"
+READ_FROM_PRIMARY = "primary"
+READ_FROM_PINNED = "pinned"
+
+
+def sync_engines() -> list:
+    """Every engine the app uses, as sync engines (for event listeners)"""
+    engines = [engine, async_engine.sync_engine]
+    for replica in replica_set.replicas:
+        engines.extend((replica.sync_engine, replica.engine.sync_engine))
+    return engines
+
+
+def pool_stats() -> dict:
+    """Connection pool statistics for the sync and async engines"""
+    now = time.monotonic()
+    return {
+        "async": _pool_stats(async_engine.sync_engine),
+        "sync": _pool_stats(engine),
+        "replicas": [
+            {
+                "url": replica.name,
+                "healthy": replica.is_healthy(now),
+                "async": _pool_stats(replica.engine.sync_engine),
+                "sync": _pool_stats(replica.sync_engine),
+            }
+            for replica in replica_set.replicas
+        ],
+    }
+
+
 Base = declarative_base()
 
-def get_db():
-    db = SessionLocal()
+
+class SyncSessionAdapter:
+    """
+    AsyncSession-compatible wrapper around a sync Session
+    
+    Used when DB_ASYNC is off: routes keep the same awaitable API, and every
+    database call runs on the threadpool like the old sync routes did.
+    """
+    
+    def __init__(self, session):
+        self.sync_session = session
+    
+    @property
+    def info(self) -> dict:
+        return self.sync_session.info
+    
+    def add(self, instance):
+        self.sync_session.add(instance)
+    
+    def add_all(self, instances):
+        self.sync_session.add_all(instances)
+    
+    async def execute(self, *args, **kwargs):
+        return await run_in_threadpool(self.sync_session.execute, *args, **kwargs)
+    
+    async def scalar(self, *args, **kwargs):
+        return await run_in_threadpool(self.sync_session.scalar, *args, **kwargs)
+    
+    async def scalars(self, *args, **kwargs):
+        return await run_in_threadpool(self.sync_session.scalars, *args, **kwargs)
+    
+    async def get(self, *args, **kwargs):
+        return await run_in_threadpool(self.sync_session.get, *args, **kwargs)
+    
+    async def delete(self, instance):
+        await run_in_threadpool(self.sync_session.delete, instance)
+    
+    async def flush(self):
+        await run_in_threadpool(self.sync_session.flush)
+    
+    async def refresh(self, instance, attribute_names=None):
+        await run_in_threadpool(self.sync_session.refresh, instance, attribute_names)
+    
+    async def commit(self):
+        await run_in_threadpool(self.sync_session.commit)
+    
+    async def rollback(self):
+        await run_in_threadpool(self.sync_session.rollback)
+    
+    async def run_sync(self, fn, *args, **kwargs):
+        return await run_in_threadpool(fn, self.sync_session, *args, **kwargs)
+    
+    async def connection(self):
+        return await run_in_threadpool(self.sync_session.connection)
+    
+    async def close(self):
+        await run_in_threadpool(self.sync_session.close)
+
+
+@asynccontextmanager
+async def session_scope(replica: Replica = None):
+    """
+    Open a session on the async stack, or on the sync stack when DB_ASYNC is off
+    
+    Sessions are bound to the primary unless a replica is given.
+    """
+    if settings.DB_ASYNC:
+        factory = replica.session_factory if replica else AsyncSessionLocal
+        async with factory() as db:
+            yield db
+    else:
+        factory = replica.sync_session_factory if replica else SessionLocal
+        db = SyncSessionAdapter(factory(expire_on_commit=False))
+        try:
+            yield db
+        finally:
+            await db.close()
+
+
+def _pinned_to_primary(request: Request) -> bool:
     try:
+        return float(request.cookies.get(READ_PRIMARY_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+@asynccontextmanager
+async def read_session_scope(request: Request):
+    """
+    Open a session for read-only work on a healthy replica
+    
+    Falls back to the primary when no replicas are configured or reachable,
+    and while the client is inside its read-your-writes window. Which of these
+    happened is kept in db.info[READ_FROM] for the response cache.
+    """
+    async with AsyncExitStack() as stack:
+        db = None
+        pinned = _pinned_to_primary(request)
+        if not pinned:
+            for replica in replica_set.candidates():
+                candidate = await stack.enter_async_context(session_scope(replica))
+                try:
+                    # Connect now so a dead replica is skipped instead of failing the request
+                    await candidate.connection()
+                except (DBAPIError, OSError):
+                    replica_set.mark_unhealthy(replica)
+                    continue
+                db = candidate
+                db.info[READ_FROM] = READ_FROM_REPLICA
+                break
+        
+        if db is None:
+            db = await stack.enter_async_context(session_scope())
+            db.info[READ_FROM] = READ_FROM_PINNED if pinned else READ_FROM_PRIMARY
         yield db
-    finally:
-        db.close()
+
+
+async def get_db(request: Request, response: Response):
+    # Writes pin the client's subsequent reads to the primary for a while
+    if request.method not in SAFE_METHODS and replica_set.replicas:
+        window = settings.READ_YOUR_WRITES_SECONDS
+        response.set_cookie(
+            READ_PRIMARY_COOKIE,
+            str(time.time() + window),
+            max_age=math.ceil(window),
+            httponly=True,
+            samesite="lax",
+        )
+    
+    async with session_scope() as db:
+        yield db
+
+
+async def get_read_db(request: Request):
+    async with read_session_scope(request) as db:
+        yield db
+
+
+def insert_ignore(table):
+    """
+    INSERT that silently skips rows violating a unique/primary key
+    """
+    return insert(table).prefix_with("OR IGNORE", dialect="sqlite").prefix_with("IGNORE", dialect="mysql")
+
+
+def add_missing_columns(db, columns) -> bool:
+    """
+    Add model columns that tables created by an older version don't have yet
+    
+    Columns are added NOT NULL with their server default. Returns True if any
+    column was added, so the caller can backfill it.
+    """
+    inspector = inspect(db.get_bind())
+    dialect = db.get_bind().dialect
+    added = False
+    for column in columns:
+        existing = {info["name"] for info in inspector.get_columns(column.table.name)}
+        if column.name not in existing:
+            db.execute(text(
+                f"ALTER TABLE {column.table.name} ADD COLUMN {column.name} "
+                f"{column.type.compile(dialect=dialect)} NOT NULL DEFAULT {column.server_default.arg}"
+            ))
+            added = True
+    return added
@@ -0,0 +1,235 @@
+"""
+In-memory friend graph
+
+The `friends` table is loaded once at startup into a CSR (compressed sparse
+row) adjacency index: `neighbors` holds every user's friend IDs back to back,
+sorted per user, and `offsets[user_id]:offsets[user_id + 1]` is that user's
+slice. Degree, membership (binary search), friend lists and intersections are
+answered from these arrays without touching the database.
+
+Friend writes replace the affected users' rows in a small overlay of sorted
+arrays; once the overlay holds COMPACT_OVERLAY_ROWS users it is folded back
+into a fresh CSR on a background thread. The rebuild sorts every edge, so it
+runs without the lock and the new arrays are swapped in at the end; reads and
+writes carry on against the old arrays and overlay meanwhile.
+
+Memory: 4 bytes per directed edge (int32 friend ID) plus 8 bytes per user ID
+slot (int64 offset). The `friends` table stores both directions of every
+friendship, so 10M rows for 1M users come to about 48 MB; see
+`python -m benchmarks.friend_graph`.
+
+The index is per process and is only updated by this process's writes, which
+matches the single uvicorn worker the Dockerfile runs. Deployments with
+several workers should set FRIEND_GRAPH_REFRESH_SECONDS so each worker
+reloads it periodically. Because another worker's copy can lag, the index only
+serves reads; writes such as adding a friend are decided by the database.
+"""
+
+import asyncio
+import logging
+import threading
+from collections import defaultdict
+
+import numpy as np
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app.database import SessionLocal
+from app.models import friends
+
+logger = logging.getLogger(__name__)
+
+# Overlay size (in users) at which it is merged back into the CSR arrays
+COMPACT_OVERLAY_ROWS = 10_000
+
+# Rows fetched per round trip when loading the friends table
+LOAD_BATCH_SIZE = 100_000
+
+EMPTY = np.empty(0, dtype=np.int32)
+EMPTY.flags.writeable = False
+
+
+def _build_csr(sources: np.ndarray, targets: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Build (offsets, neighbors) from directed edges"""
+    order = np.lexsort((targets, sources))
+    sources = sources[order]
+    neighbors = targets[order].astype(np.int32)
+    
+    size = int(sources[-1]) + 1 if len(sources) else 0
+    offsets = np.zeros(size + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources, minlength=size), out=offsets[1:])
+    
+    neighbors.flags.writeable = False
+    offsets.flags.writeable = False
+    return offsets, neighbors
+
+
+class FriendGraph:
+    """CSR adjacency index over the friends table with a copy-on-write overlay"""
+    
+    def __init__(self, sources: np.ndarray = EMPTY, targets: np.ndarray = EMPTY):
+        offsets, neighbors = _build_csr(np.asarray(sources, dtype=np.int64), np.asarray(targets))
+        # Swapped as one tuple so readers never pair old offsets with new neighbors
+        self._state = (offsets, neighbors, {})
+        self._lock = threading.Lock()
+        self._compacting = False
+    
+    def friend_ids(self, user_id: int) -> np.ndarray:
+        """Sorted, read-only array of a user's friend IDs"""
+        offsets, neighbors, overlay = self._state
+        row = overlay.get(user_id)
+        if row is not None:
+            return row
+        if 0 <= user_id < len(offsets) - 1:
+            return neighbors[offsets[user_id]:offsets[user_id + 1]]
+        return EMPTY
+    
+    def degree(self, user_id: int) -> int:
+        return len(self.friend_ids(user_id))
+    
+    def are_friends(self, user_id: int, friend_id: int) -> bool:
+        row = self.friend_ids(user_id)
+        i = np.searchsorted(row, friend_id)
+        return i < len(row) and row[i] == friend_id
+    
+    def mutual_friend_ids(self, user_id: int, other_id: int) -> np.ndarray:
+        return np.intersect1d(self.friend_ids(user_id), self.friend_ids(other_id), assume_unique=True)
+    
+    def stats(self) -> dict:
+        """Directed edge count (two per friendship) and memory use of the arrays"""
+        with self._lock:
+            offsets, neighbors, overlay = self._state
+            replaced = sum(
+                int(offsets[user_id + 1] - offsets[user_id])
+                for user_id in overlay
+                if user_id < len(offsets) - 1
+            )
+            return {
+                "edges": len(neighbors) - replaced + sum(len(row) for row in overlay.values()),
+                "overlay_rows": len(overlay),
+                "memory_bytes": offsets.nbytes + neighbors.nbytes + sum(row.nbytes for row in overlay.values()),
+            }
+    
+    def _set_row(self, user_id: int, row: np.ndarray) -> None:
+        row.flags.writeable = False
+        self._state[2][user_id] = row
+    
+    def _insert(self, user_id: int, friend_id: int) -> None:
+        row = self.friend_ids(user_id)
+        i = np.searchsorted(row, friend_id)
+        if i < len(row) and row[i] == friend_id:
+            return
+        self._set_row(user_id, np.insert(row, i, friend_id))
+    
+    def _remove(self, user_id: int, friend_id: int) -> None:
+        row = self.friend_ids(user_id)
+        i = np.searchsorted(row, friend_id)
+        if i < len(row) and row[i] == friend_id:
+            self._set_row(user_id, np.delete(row, i))
+    
+    def add_friendship(self, user_id: int, friend_id: int) -> None:
+        with self._lock:
+            self._insert(user_id, friend_id)
+            self._insert(friend_id, user_id)
+            self._maybe_compact()
+    
+    def add_friendships(self, pairs) -> None:
+        """Add many friendships, rewriting each affected user's row once"""
+        added = defaultdict(list)
+        for user_id, friend_id in pairs:
+            added[user_id].append(friend_id)
+            added[friend_id].append(user_id)
+        with self._lock:
+            for user_id, friend_ids in added.items():
+                row = np.union1d(self.friend_ids(user_id), np.array(friend_ids, dtype=np.int32))
+                self._set_row(user_id, row.astype(np.int32, copy=False))
+            self._maybe_compact()
+    
+    def remove_friendship(self, user_id: int, friend_id: int) -> None:
+        with self._lock:
+            self._remove(user_id, friend_id)
+            self._remove(friend_id, user_id)
+            self._maybe_compact()
+    
+    def remove_user(self, user_id: int) -> None:
+        with self._lock:
+            for friend_id in self.friend_ids(user_id).tolist():
+                self._remove(friend_id, user_id)
+            self._set_row(user_id, EMPTY)
+            self._maybe_compact()
+    
+    def _maybe_compact(self) -> None:
+        # Called with the lock held
+        if len(self._state[2]) >= COMPACT_OVERLAY_ROWS and not self._compacting:
+            self._compacting = True
+            threading.Thread(target=self._compact, name="friend-graph-compact", daemon=True).start()
+    
+    def _compact(self) -> None:
+        """Fold the overlay into fresh CSR arrays, keeping rows written while they were built"""
+        try:
+            with self._lock:
+                offsets, neighbors, overlay = self._state
+                folded = dict(overlay)
+            compacted = _build_csr(*_edges(offsets, neighbors, folded))
+            with self._lock:
+                # Rows are replaced, never changed in place, so identity tells which were rewritten since
+                pending = {user_id: row for user_id, row in self._state[2].items() if folded.get(user_id) is not row}
+                self._state = (*compacted, pending)
+        except Exception:
+            logger.exception("Failed to compact the friend graph")
+        finally:
+            with self._lock:
+                self._compacting = False
+
+
+def _edges(offsets: np.ndarray, neighbors: np.ndarray, overlay: dict) -> tuple[np.ndarray, np.ndarray]:
+    """All directed edges as (sources, targets) arrays, overlay applied"""
+    sources = np.repeat(np.arange(len(offsets) - 1, dtype=np.int64), np.diff(offsets))
+    targets = neighbors
+    if overlay:
+        keep = ~np.isin(sources, np.fromiter(overlay.keys(), dtype=np.int64))
+        rows = [(user_id, row) for user_id, row in overlay.items() if len(row)]
+        sources = np.concatenate(
+            [sources[keep]] + [np.full(len(row), user_id, dtype=np.int64) for user_id, row in rows]
+        )
+        targets = np.concatenate([targets[keep]] + [row for _, row in rows])
+    return sources, targets
+
+
+def load_friend_graph(db: Session) -> FriendGraph:
+    """Read the friends table into a new FriendGraph"""
+    chunks = []
+    result = db.execute(
+        select(friends.c.user_id, friends.c.friend_id).execution_options(yield_per=LOAD_BATCH_SIZE)
+    )
+    for partition in result.partitions():
+        chunks.append(np.array(partition, dtype=np.int64).reshape(-1, 2))
+    
+    edges = np.concatenate(chunks) if chunks else np.empty((0, 2), dtype=np.int64)
+    return FriendGraph(edges[:, 0], edges[:, 1])
+
+
+# Process-wide index, loaded by init_friend_graph at startup
+graph = FriendGraph()
+
+
+def init_friend_graph(db: Session) -> FriendGraph:
+    global graph
+    graph = load_friend_graph(db)
+    return graph
+
+
+def _reload() -> None:
+    with SessionLocal() as db:
+        init_friend_graph(db)
+
+
+async def refresh_periodically(interval: float) -> None:
+    """Reload the index every `interval` seconds to pick up other workers' writes"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await run_in_threadpool(_reload)
+        except Exception:
+            logger.exception("Failed to reload the friend graph")
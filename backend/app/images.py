@@ -0,0 +1,175 @@
+"""
+Image variants
+
+Uploaded images get fixed-size WebP variants:
+    
+    thumb  square crop for avatars and small previews
+    feed   fits within a box for feed cards
+    full   fits within a box for full-screen viewing
+
+Variants drop all metadata (EXIF, GPS, ICC) after applying the EXIF
+orientation, and are cached on disk at
+
+    uploads/variants/<variant>/<upload dir>/<stem>.webp
+
+Animated images keep their first frame. Decoding and encoding run in a
+process pool so the event loop never blocks. With IMAGE_VARIANTS_EAGER the
+variants are written during upload; otherwise an "images.render_variants"
+job renders them after upload, and a request that comes first renders the
+variant it asked for.
+"""
+
+import asyncio
+import multiprocessing
+import os
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+from PIL import Image, ImageOps
+from sqlalchemy.orm import Session
+
+from app import jobs
+from app.config import settings
+
+UPLOAD_DIR = Path(__file__).parent.parent / "uploads"
+VARIANTS_DIR = UPLOAD_DIR / "variants"
+
+# Variant name -> (max width, max height, crop to fill)
+VARIANTS = {
+    "thumb": (160, 160, True),
+    "feed": (720, 720, False),
+    "full": (1600, 1600, False),
+}
+
+VARIANT_FORMAT = "WEBP"
+VARIANT_EXTENSION = ".webp"
+VARIANT_QUALITY = 80
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+# Lazy renders in progress, by target path
+_rendering: dict[Path, asyncio.Future] = {}
+
+
+def variant_path(source: Path, variant: str) -> Path:
+    """Where a variant of an uploaded file is cached"""
+    relative = source.relative_to(UPLOAD_DIR)
+    return VARIANTS_DIR / variant / relative.parent / f"{relative.stem}{VARIANT_EXTENSION}"
+
+
+def variant_url(source: Path, variant: str) -> str:
+    return "/uploads/" + variant_path(source, variant).relative_to(UPLOAD_DIR).as_posix()
+
+
+def variant_urls(source: Path) -> dict[str, str]:
+    return {variant: variant_url(source, variant) for variant in VARIANTS}
+
+
+def _save_atomic(image: Image.Image, target: Path) -> None:
+    target.parent.mkdir(parents=True, exist_ok=True)
+    temp = target.with_name(f".{target.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        # No exif/icc_profile arguments, so no metadata is written
+        image.save(temp, VARIANT_FORMAT, quality=VARIANT_QUALITY, method=4)
+        os.replace(temp, target)
+    finally:
+        temp.unlink(missing_ok=True)
+
+
+def render_variants(source: Path, variants: list[str]) -> None:
+    """
+    Decode an image once and write the requested variants
+    
+    Runs in a worker process.
+    """
+    with Image.open(source) as image:
+        # Let the JPEG decoder downscale while decoding when the largest
+        # variant is much smaller than the original
+        largest = max(max(VARIANTS[variant][:2]) for variant in variants)
+        image.draft("RGB", (largest, largest))
+        image = ImageOps.exif_transpose(image)
+        image = image.convert("RGBA" if image.has_transparency_data else "RGB")
+        
+        for variant in variants:
+            width, height, crop = VARIANTS[variant]
+            if crop:
+                resized = ImageOps.fit(image, (width, height), Image.Resampling.LANCZOS)
+            else:
+                resized = image.copy()
+                resized.thumbnail((width, height), Image.Resampling.LANCZOS)
+            _save_atomic(resized, variant_path(source, variant))
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # Spawned rather than forked: the server process holds threads and DB connections
+        _pool = ProcessPoolExecutor(
+            max_workers=settings.IMAGE_WORKERS or None,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _pool
+
+
+async def ensure_variant(source: Path, variant: str) -> Path:
+    """
+    Render a single variant unless it is already cached on disk
+    
+    Concurrent requests for the same missing variant share one render.
+    """
+    target = variant_path(source, variant)
+    if target.exists():
+        return target
+    
+    render = _rendering.get(target)
+    if render is None:
+        render = asyncio.ensure_future(create_variants(source, [variant]))
+        _rendering[target] = render
+        render.add_done_callback(lambda _: _rendering.pop(target, None))
+    await asyncio.shield(render)
+    return target
+
+
+async def create_variants(source: Path, variants: Optional[list[str]] = None) -> dict[str, str]:
+    """
+    Render variants of an uploaded image in the process pool
+    
+    Variants already on disk are kept; uploads are content-addressed, so a
+    repeat upload of the same image renders nothing. Returns the URLs of all
+    variants. Raises OSError (e.g. PIL.UnidentifiedImageError) if the file is
+    not a readable image.
+    """
+    missing = [variant for variant in variants or VARIANTS if not variant_path(source, variant).exists()]
+    if missing:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(_get_pool(), render_variants, source, missing)
+    return variant_urls(source)
+
+
+@jobs.handler("images.render_variants", queue="images")
+def prerender_variants(db: Session, path: str) -> None:
+    """
+    Render the missing variants of an upload (path relative to UPLOAD_DIR)
+    
+    Runs in a job worker thread, which waits on the process pool. An upload
+    deleted in the meantime is skipped; an unreadable one fails the job.
+    """
+    source = UPLOAD_DIR / path
+    if not source.exists():
+        return
+    missing = [variant for variant in VARIANTS if not variant_path(source, variant).exists()]
+    if not missing:
+        return
+    try:
+        _get_pool().submit(render_variants, source, missing).result()
+    except (OSError, Image.DecompressionBombError) as e:
+        raise jobs.JobFailed(f"Not a readable image: {e}") from e
+
+
+def shutdown() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
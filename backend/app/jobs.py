@@ -0,0 +1,485 @@
+"""
+Background jobs
+
+A durable job queue in the application database (the `jobs` table), for side
+effects that don't need to finish before a write route responds:
+    
+    timeline.fan_out          push new posts to friends' timelines (queue "timeline")
+    images.render_variants    render the variants of a lazy-mode upload (queue "images")
+
+Handlers are registered with @handler and called as handler(db, **payload)
+with a fresh Session, which is committed together with marking the job done.
+A job's database effects therefore apply exactly once even though a job may
+run more than once; effects outside the database must be idempotent.
+
+Routes call enqueue(db, name, payload) in their own transaction, so a job
+exists if and only if the write that asked for it committed. Workers in the
+same process are woken on commit; other processes find the job on their
+next poll (JOB_POLL_SECONDS).
+
+Each process runs one dispatcher per queue, which claims up to
+JOB_QUEUES[queue] jobs at a time (the per-queue concurrency limit, per
+process) and runs them in the threadpool. A claim is a lease: a job whose
+worker died is retried once JOB_LEASE_SECONDS pass. Failures are retried with
+exponential backoff and jitter up to max_attempts; raising JobFailed fails a
+job at once. Done jobs, and with them their idempotency keys, are kept for
+JOB_RETENTION_HOURS; failed jobs are kept for JOB_FAILED_RETENTION_DAYS so
+their last_error can be looked at, then deleted by the same sweep.
+
+Queue depth and lag are served at /health/jobs and /metrics. To run the
+workers outside the web processes, set JOB_WORKERS_IN_APP=false and run
+`python -m app.jobs`; set PUBSUB_SOCKET_DIR too, so the live events its jobs
+publish reach the web workers.
+"""
+
+import asyncio
+import json
+import logging
+import random
+import signal
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Optional
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import and_, bindparam, case, delete, event, func, or_, select, update
+from sqlalchemy.orm import Session
+
+from app import pubsub
+from app.config import settings
+from app.database import SessionLocal, insert_ignore
+from app.models import Job
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# Longest error text kept on a job
+MAX_ERROR_LENGTH = 2000
+
+# How often done jobs past their retention are deleted
+CLEANUP_SECONDS = 300.0
+
+# Session.info key of the queues a transaction enqueued to
+_ENQUEUED = "jobs_enqueued"
+
+
+class JobFailed(Exception):
+    """Raised by a handler to fail its job without further retries"""
+
+
+@dataclass(frozen=True)
+class Handler:
+    function: Callable
+    queue: str
+    max_attempts: int
+
+
+_handlers: dict[str, Handler] = {}
+
+
+def handler(name: str, queue: str = "default", max_attempts: Optional[int] = None):
+    """Register a function as the handler of a job name"""
+    def register(function: Callable) -> Callable:
+        _handlers[name] = Handler(function, queue, max_attempts or settings.JOB_MAX_ATTEMPTS)
+        return function
+    return register
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _as_utc(value: datetime) -> datetime:
+    # SQLite hands back naive datetimes; every stored time is UTC
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value
+
+
+# Built once: enqueueing sits on the write path of the routes
+_INSERT_JOB = insert_ignore(Job.__table__)
+
+
+def enqueue(db: Session, name: str, payload: dict, key: Optional[str] = None, delay: float = 0) -> None:
+    """
+    Add a job in the caller's transaction
+    
+    It becomes visible to workers when the caller commits. If `key` is
+    given and a job with that key exists (within the retention window),
+    nothing is added.
+    """
+    spec = _handlers[name]
+    now = _now()
+    db.execute(_INSERT_JOB, {
+        "queue": spec.queue,
+        "name": name,
+        "payload": json.dumps(payload),
+        "idempotency_key": key,
+        "status": QUEUED,
+        "attempts": 0,
+        "max_attempts": spec.max_attempts,
+        "run_at": now + timedelta(seconds=delay),
+        "created_at": now,
+    })
+    db.info.setdefault(_ENQUEUED, set()).add(spec.queue)
+
+
+@event.listens_for(Session, "after_commit")
+def _wake_on_commit(session: Session) -> None:
+    queues = session.info.pop(_ENQUEUED, None)
+    if queues:
+        workers.wake(queues)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_on_rollback(session: Session) -> None:
+    session.info.pop(_ENQUEUED, None)
+
+
+def backoff_seconds(attempts: int) -> float:
+    """Delay before retrying after `attempts` failed runs: exponential, capped, with jitter"""
+    delay = min(settings.JOB_RETRY_MAX_SECONDS, settings.JOB_RETRY_BASE_SECONDS * 2 ** (attempts - 1))
+    return delay * random.uniform(0.5, 1.0)
+
+
+# Statements built once, as they run for every job; parameters are bound per call
+_table = Job.__table__
+
+_claimable = and_(
+    _table.c.queue == bindparam("in_queue"),
+    or_(
+        and_(_table.c.status == QUEUED, _table.c.run_at <= bindparam("now")),
+        # Running past its lease: the worker died or hung
+        and_(_table.c.status == RUNNING, _table.c.locked_until < bindparam("now")),
+    ),
+)
+
+_SELECT_DUE = (
+    select(_table.c.id)
+    .where(_claimable)
+    .order_by(_table.c.run_at, _table.c.id)
+    .limit(bindparam("limit"))
+)
+
+_CLAIM = (
+    update(_table)
+    .where(_table.c.id.in_(bindparam("ids", expanding=True)), _claimable)
+    .values(
+        status=RUNNING,
+        claimed_by=bindparam("token"),
+        locked_until=bindparam("lease_until"),
+        started_at=bindparam("now"),
+        attempts=_table.c.attempts + 1,
+    )
+)
+
+_SELECT_CLAIMED = (
+    select(_table.c.id, _table.c.name, _table.c.payload, _table.c.attempts, _table.c.max_attempts, _table.c.run_at)
+    .where(_table.c.id.in_(bindparam("ids", expanding=True)), _table.c.claimed_by == bindparam("token"))
+)
+
+# Only while the claim is still ours: a job that outlived its lease may have been claimed again
+_FINISH = (
+    update(_table)
+    .where(_table.c.id == bindparam("job_id"), _table.c.claimed_by == bindparam("token"))
+    .values(
+        status=bindparam("new_status"),
+        run_at=bindparam("new_run_at"),
+        finished_at=bindparam("finished"),
+        last_error=bindparam("error"),
+        claimed_by=None,
+        locked_until=None,
+    )
+)
+
+
+def claim(queue: str, limit: int, lease_seconds: float) -> tuple[str, list]:
+    """
+    Lease up to `limit` due jobs of a queue
+    
+    The UPDATE re-checks each job's state, so when workers race for the same
+    rows each job goes to one of them. Returns the claim token and the rows.
+    """
+    now = _now()
+    token = uuid.uuid4().hex
+    with SessionLocal() as db:
+        ids = db.scalars(_SELECT_DUE, {"in_queue": queue, "now": now, "limit": limit}).all()
+        if not ids:
+            return token, []
+        db.execute(_CLAIM, {
+            "ids": ids,
+            "in_queue": queue,
+            "now": now,
+            "token": token,
+            "lease_until": now + timedelta(seconds=lease_seconds),
+        })
+        rows = db.execute(_SELECT_CLAIMED, {"ids": ids, "token": token}).all()
+        db.commit()
+    return token, rows
+
+
+def _finish(db: Session, job, token: str, status: str, run_at=None, error: Optional[str] = None) -> bool:
+    """Record a job's outcome; False if the lease was lost to another worker"""
+    result = db.execute(_FINISH, {
+        "job_id": job.id,
+        "token": token,
+        "new_status": status,
+        "new_run_at": run_at or job.run_at,
+        "finished": None if status == QUEUED else _now(),
+        "error": error,
+    })
+    return result.rowcount == 1
+
+
+def execute(job, token: str) -> str:
+    """
+    Run one claimed job and record the outcome: "done", "retried" or "failed"
+    """
+    spec = _handlers.get(job.name)
+    with SessionLocal() as db:
+        try:
+            if spec is None:
+                raise JobFailed(f"No handler registered for {job.name}")
+            spec.function(db, **json.loads(job.payload))
+            if not _finish(db, job, token, DONE):
+                db.rollback()
+                logger.warning("Job %s (%s) outlived its lease; its work was rolled back", job.id, job.name)
+                return "retried"
+            db.commit()
+            return "done"
+        except Exception as e:
+            db.rollback()
+            error = f"{type(e).__name__}: {e}"[:MAX_ERROR_LENGTH]
+            if isinstance(e, JobFailed) or job.attempts >= job.max_attempts:
+                logger.error("Job %s (%s) failed after %d attempts: %s", job.id, job.name, job.attempts, error)
+                _finish(db, job, token, FAILED, error=error)
+                outcome = "failed"
+            else:
+                delay = backoff_seconds(job.attempts)
+                logger.warning("Job %s (%s) failed, retrying in %.1fs: %s", job.id, job.name, delay, error)
+                _finish(db, job, token, QUEUED, _now() + timedelta(seconds=delay), error)
+                outcome = "retried"
+            db.commit()
+            return outcome
+
+
+def purge_finished(retention_hours: float, failed_retention_days: float) -> int:
+    """Delete done jobs finished more than retention_hours ago, and failed ones after failed_retention_days"""
+    now = _now()
+    with SessionLocal() as db:
+        result = db.execute(
+            delete(Job).where(or_(
+                and_(Job.status == DONE, Job.finished_at < now - timedelta(hours=retention_hours)),
+                and_(Job.status == FAILED, Job.finished_at < now - timedelta(days=failed_retention_days)),
+            ))
+        )
+        db.commit()
+    return result.rowcount
+
+
+def queue_stats() -> dict:
+    """
+    Depth and lag of every queue, from the jobs table
+    
+    ready: due and waiting for a worker; scheduled: waiting for a retry or
+    delay; lag_seconds: how long the oldest ready job has been due.
+    """
+    now = _now()
+    due = Job.run_at <= now
+    with SessionLocal() as db:
+        rows = db.execute(
+            select(Job.queue, Job.status, func.count(), func.sum(case((due, 1), else_=0)), func.min(case((due, Job.run_at))))
+            .where(Job.status != DONE)
+            .group_by(Job.queue, Job.status)
+        ).all()
+    
+    queues = {
+        queue: {"ready": 0, "scheduled": 0, "running": 0, "failed": 0, "lag_seconds": 0.0}
+        for queue in sorted({spec.queue for spec in _handlers.values()})
+    }
+    for queue, status, count, ready, oldest in rows:
+        stats = queues.setdefault(queue, {"ready": 0, "scheduled": 0, "running": 0, "failed": 0, "lag_seconds": 0.0})
+        if status == QUEUED:
+            stats["ready"] = int(ready or 0)
+            stats["scheduled"] = count - stats["ready"]
+            if oldest is not None:
+                stats["lag_seconds"] = round((now - _as_utc(oldest)).total_seconds(), 3)
+        elif status in (RUNNING, FAILED):
+            stats[status] = count
+    return queues
+
+
+class QueueCounters:
+    """What this process's dispatcher of one queue has done"""
+    
+    __slots__ = ("running", "done", "retried", "failed", "start_lag_total", "start_lag_max")
+    
+    def __init__(self):
+        self.running = 0
+        self.done = 0
+        self.retried = 0
+        self.failed = 0
+        # Seconds from due to started, over every run
+        self.start_lag_total = 0.0
+        self.start_lag_max = 0.0
+
+
+class JobWorkers:
+    """Dispatchers that claim and run jobs, one per queue"""
+    
+    def __init__(self):
+        self._dispatchers: list[asyncio.Task] = []
+        self._purger: Optional[asyncio.Task] = None
+        self._stopping = False
+        self._wakeups: dict[str, asyncio.Event] = {}
+        self._counters: dict[str, QueueCounters] = {}
+        self._running: set[asyncio.Task] = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+    
+    def queues(self) -> dict[str, int]:
+        """Every queue with a handler, and how many of its jobs may run at once in this process"""
+        return {
+            queue: settings.JOB_QUEUES.get(queue, 1)
+            for queue in sorted({spec.queue for spec in _handlers.values()} | set(settings.JOB_QUEUES))
+        }
+    
+    def start(self) -> None:
+        if self._dispatchers:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._stopping = False
+        for queue, limit in self.queues().items():
+            self._wakeups[queue] = asyncio.Event()
+            self._counters[queue] = QueueCounters()
+            self._dispatchers.append(asyncio.create_task(self._dispatch(queue, limit)))
+        self._purger = asyncio.create_task(self._purge_periodically())
+    
+    async def stop(self, timeout: float = 10.0) -> None:
+        """Stop claiming, and give running jobs `timeout` seconds to finish (their leases cover the rest)"""
+        if not self._dispatchers:
+            return
+        # Dispatchers finish the claim in flight rather than being cancelled,
+        # which would leave its jobs claimed but never run until their lease ran out
+        self._stopping = True
+        for wakeup in self._wakeups.values():
+            wakeup.set()
+        self._purger.cancel()
+        await asyncio.gather(*self._dispatchers, self._purger, return_exceptions=True)
+        self._dispatchers = []
+        self._purger = None
+        if self._running:
+            await asyncio.wait(self._running, timeout=timeout)
+        self._loop = None
+    
+    def wake(self, queues) -> None:
+        """Have the dispatchers of these queues claim now rather than at their next poll (any thread)"""
+        loop = self._loop
+        if loop is None:
+            return
+        for queue in queues:
+            wakeup = self._wakeups.get(queue)
+            if wakeup is not None:
+                loop.call_soon_threadsafe(wakeup.set)
+    
+    async def _dispatch(self, queue: str, limit: int) -> None:
+        wakeup = self._wakeups[queue]
+        counters = self._counters[queue]
+        while not self._stopping:
+            wakeup.clear()
+            free = limit - counters.running
+            if free > 0:
+                try:
+                    token, jobs = await run_in_threadpool(claim, queue, free, settings.JOB_LEASE_SECONDS)
+                except Exception:
+                    logger.exception("Failed to claim jobs from queue %s", queue)
+                    jobs = []
+                for job in jobs:
+                    counters.running += 1
+                    lag = max(0.0, (_now() - _as_utc(job.run_at)).total_seconds())
+                    counters.start_lag_total += lag
+                    counters.start_lag_max = max(counters.start_lag_max, lag)
+                    task = asyncio.create_task(self._run(queue, job, token))
+                    self._running.add(task)
+                    task.add_done_callback(self._running.discard)
+                # A full batch may mean more are due
+                if jobs and len(jobs) == free and not self._stopping:
+                    continue
+            try:
+                await asyncio.wait_for(wakeup.wait(), settings.JOB_POLL_SECONDS)
+            except TimeoutError:
+                pass
+    
+    async def _run(self, queue: str, job, token: str) -> None:
+        counters = self._counters[queue]
+        try:
+            outcome = await run_in_threadpool(execute, job, token)
+        except Exception:
+            logger.exception("Failed to record the outcome of job %s", job.id)
+            outcome = "retried"
+        finally:
+            counters.running -= 1
+            # A slot is free
+            self._wakeups[queue].set()
+        setattr(counters, outcome, getattr(counters, outcome) + 1)
+    
+    async def _purge_periodically(self) -> None:
+        while True:
+            try:
+                purged = await run_in_threadpool(
+                    purge_finished, settings.JOB_RETENTION_HOURS, settings.JOB_FAILED_RETENTION_DAYS
+                )
+                if purged:
+                    logger.info("Deleted %d finished jobs", purged)
+            except Exception:
+                logger.exception("Failed to delete finished jobs")
+            await asyncio.sleep(CLEANUP_SECONDS)
+    
+    def stats(self) -> dict:
+        """This process's dispatchers: concurrency, jobs running now and outcomes so far"""
+        limits = self.queues()
+        return {
+            queue: {
+                "concurrency": limits.get(queue, 1),
+                "running": counters.running,
+                "done": counters.done,
+                "retried": counters.retried,
+                "failed": counters.failed,
+                "start_lag_seconds_avg": round(
+                    counters.start_lag_total / max(1, counters.done + counters.retried + counters.failed + counters.running), 3
+                ),
+                "start_lag_seconds_max": round(counters.start_lag_max, 3),
+            }
+            for queue, counters in self._counters.items()
+        }
+
+
+# Process-wide workers; the app starts them in its lifespan unless JOB_WORKERS_IN_APP is off
+workers = JobWorkers()
+
+
+async def run_workers() -> None:
+    """Run the workers until SIGINT or SIGTERM, for a process of its own"""
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stopping.set)
+    # Bridges the live events handlers publish to the web workers, with PUBSUB_SOCKET_DIR
+    pubsub.broker.start()
+    workers.start()
+    await stopping.wait()
+    await workers.stop()
+    pubsub.broker.stop()
+
+
+if __name__ == "__main__":
+    # Importing the app registers every handler (in app.jobs, not this __main__
+    # copy of the module) and creates the tables
+    import app.main  # noqa: F401
+    from app import jobs
+    
+    logging.basicConfig(level=logging.INFO)
+    logger.info("Running job workers for %s", jobs.workers.queues())
+    asyncio.run(jobs.run_workers())
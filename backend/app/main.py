@@ -2,24 +2,59 @@
 FastAPI main application
 """
 
+import asyncio
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from pathlib import Path
+from fastapi.responses import PlainTextResponse
 import uvicorn
 
-from app.database import Base, engine
+from app import counters, friend_graph, images, jobs, metrics, pubsub, query_diagnostics, ranking, timeline
+from app.media import media_server
+from app.cache import response_cache
+from app.database import Base, engine, SessionLocal, pool_stats, sync_engines
 from app.routes.router import router
+from app.routes.media import router as media_router
 from app.config import settings
+from app.search_index import init_search
 
 # Create database tables
 Base.metadata.create_all(bind=engine)
 
+# Add counter and engagement columns to older databases, seed their
+# timelines, set up the full-text search backend and load the friend graph
+with SessionLocal() as db:
+    counters.ensure_columns(db)
+    ranking.ensure_columns(db)
+    timeline.ensure_seeded(db)
+    init_search(db)
+    friend_graph.init_friend_graph(db)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    refresh = None
+    if settings.FRIEND_GRAPH_REFRESH_SECONDS > 0:
+        refresh = asyncio.create_task(friend_graph.refresh_periodically(settings.FRIEND_GRAPH_REFRESH_SECONDS))
+    pubsub.broker.start()
+    if settings.JOB_WORKERS_IN_APP:
+        jobs.workers.start()
+    yield
+    await jobs.workers.stop()
+    pubsub.broker.stop()
+    if refresh:
+        refresh.cancel()
+    images.shutdown()
+
+
 app = FastAPI(
     title=settings.APP_NAME,
     debug=settings.DEBUG,
     description="A simple social networking application backend",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
 )
 
 # Configure CORS
@@ -31,9 +66,20 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Mount static files for uploads
-UPLOAD_DIR = Path(__file__).parent.parent / "uploads"
-app.mount("/uploads", StaticFiles(directory=str(UPLOAD_DIR)), name="uploads")
+# Per-route latency, response size and SQL statements/time, served at /metrics
+if settings.METRICS_ENABLED:
+    for db_engine in sync_engines():
+        metrics.instrument_engine(db_engine)
+    app.add_middleware(metrics.MetricsMiddleware)
+
+# Opt-in N+1 and slow-query reporting for development and canary builds
+if settings.QUERY_DIAGNOSTICS:
+    for db_engine in sync_engines():
+        query_diagnostics.instrument_engine(db_engine)
+    app.add_middleware(query_diagnostics.QueryDiagnosticsMiddleware)
+
+# Uploaded files and image variants, with cache validators and range support
+app.include_router(media_router, prefix="/uploads", tags=["media"])
 
 # Include API router
 app.include_router(router, prefix=settings.API_PREFIX)
@@ -57,5 +103,62 @@ def health_check():
     """
     return {"status": "healthy"}
 
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    """
+    Request metrics, connection pool statistics and job queue depth in the Prometheus text format
+    """
+    queues = await run_in_threadpool(jobs.queue_stats)
+    return PlainTextResponse(metrics.registry.render(pool_stats(), queues), media_type=metrics.CONTENT_TYPE)
+
+
+@app.get("/health/pool")
+def pool_health():
+    """
+    Database connection pool statistics
+    """
+    return pool_stats()
+
+
+@app.get("/health/cache")
+def cache_health():
+    """
+    Response cache hit, miss and eviction counters
+    """
+    return response_cache.stats()
+
+
+@app.get("/health/friend-graph")
+def friend_graph_health():
+    """
+    Size of the in-memory friend graph index
+    """
+    return friend_graph.graph.stats()
+
+
+@app.get("/health/pubsub")
+def pubsub_health():
+    """
+    Live update subscriptions and event counters of this worker
+    """
+    return pubsub.broker.stats()
+
+
+@app.get("/health/jobs")
+def jobs_health():
+    """
+    Depth and lag of each job queue, and what this worker's job dispatchers have done
+    """
+    return {"queues": jobs.queue_stats(), "workers": jobs.workers.stats()}
+
+
+@app.get("/health/media")
+def media_health():
+    """
+    In-memory media cache hit, miss and eviction counters
+    """
+    return media_server.stats()
+
 if __name__ == "__main__":
     uvicorn.run(app, host="localhost", port=8000)
\ No newline at end of file
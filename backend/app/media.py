@@ -0,0 +1,241 @@
+"""
+Media serving
+
+Files under uploads/ are served by a MediaServer rather than a bare static
+mount, so browsers and CDNs can cache them:
+    
+    - strong ETags and Last-Modified, with 304 on revalidation
+    - Cache-Control: immutable for content-named files (sha256 and uuid
+      names are never rewritten, and neither are their variants)
+    - single byte ranges answered with 206, or 416 when unsatisfiable
+    - small files (default avatars, thumbnails) kept in a byte-bounded LRU
+
+Larger files are streamed from disk by FileResponse, which also handles
+their ranges and uses the server's path-send extension when available.
+"""
+
+import os
+import re
+import stat
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_tz, mktime_tz
+from mimetypes import guess_type
+from pathlib import Path
+from typing import Optional
+
+from fastapi import Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse
+
+from app.config import settings
+
+# File stems that name their content, or are random and never reused
+CONTENT_DIGEST = re.compile(r"[0-9a-f]{64}")
+RANDOM_NAME = re.compile(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}")
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range(header: str, size: int) -> Optional[tuple[int, int]]:
+    """
+    Parse a single byte range into inclusive (first, last) offsets
+    
+    Returns None when the whole file should be sent instead: the header is
+    malformed or asks for several ranges (both may be ignored per RFC 9110).
+    Raises RangeNotSatisfiable if the range starts past the end of the file.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    
+    first, dash, last = spec.strip().partition("-")
+    if not dash:
+        return None
+    try:
+        if not first:
+            suffix = int(last)
+            if suffix <= 0 or size == 0:
+                raise RangeNotSatisfiable
+            return max(size - suffix, 0), size - 1
+        first, last = int(first), int(last) if last else None
+    except ValueError:
+        return None
+    
+    if first < 0 or (last is not None and last < first):
+        return None
+    if first >= size:
+        raise RangeNotSatisfiable
+    return first, size - 1 if last is None else min(last, size - 1)
+
+
+class MemoryCache:
+    """
+    Byte-bounded LRU of small file contents
+    
+    Entries are checked against the file's mtime and size on every hit, so a
+    replaced file is never served stale. Only touched from the event loop.
+    """
+    
+    def __init__(self, max_bytes: int, max_file_bytes: int):
+        self.max_bytes = max_bytes
+        self.max_file_bytes = max_file_bytes
+        # path -> ((mtime_ns, size), contents), least recently used first
+        self._entries: OrderedDict[Path, tuple[tuple[int, int], bytes]] = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def accepts(self, stat_result: os.stat_result) -> bool:
+        return stat_result.st_size <= min(self.max_file_bytes, self.max_bytes)
+    
+    def get(self, path: Path, stat_result: os.stat_result) -> Optional[bytes]:
+        entry = self._entries.get(path)
+        if entry is None or entry[0] != (stat_result.st_mtime_ns, stat_result.st_size):
+            self.misses += 1
+            return None
+        self._entries.move_to_end(path)
+        self.hits += 1
+        return entry[1]
+    
+    def put(self, path: Path, stat_result: os.stat_result, contents: bytes) -> None:
+        previous = self._entries.pop(path, None)
+        if previous is not None:
+            self.size -= len(previous[1])
+        self._entries[path] = ((stat_result.st_mtime_ns, stat_result.st_size), contents)
+        self.size += len(contents)
+        while self.size > self.max_bytes:
+            _, (_, evicted) = self._entries.popitem(last=False)
+            self.size -= len(evicted)
+            self.evictions += 1
+    
+    def discard(self, path: Path) -> None:
+        previous = self._entries.pop(path, None)
+        if previous is not None:
+            self.size -= len(previous[1])
+    
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class MediaServer:
+    """Serves files from a directory with HTTP caching and range support"""
+    
+    def __init__(self, directory: Path, memory_cache: MemoryCache, max_age_seconds: int):
+        self.directory = directory
+        self.memory_cache = memory_cache
+        self.max_age_seconds = max_age_seconds
+    
+    def resolve(self, relative_path: str) -> Optional[Path]:
+        """
+        Map a URL path to a file path inside the directory
+        
+        Rejects '.', '..' and hidden names (including in-progress uploads).
+        """
+        parts = relative_path.split("/")
+        if not all(part and not part.startswith(".") and "\\" not in part and "\0" not in part for part in parts):
+            return None
+        return self.directory.joinpath(*parts)
+    
+    def lookup(self, path: Path) -> Optional[os.stat_result]:
+        """Stat a file, or None if it isn't a regular file"""
+        # A local stat is cheaper than a thread hop, so it runs on the loop
+        try:
+            stat_result = os.stat(path)
+        except (FileNotFoundError, NotADirectoryError):
+            self.memory_cache.discard(path)
+            return None
+        return stat_result if stat.S_ISREG(stat_result.st_mode) else None
+    
+    def headers(self, path: Path, stat_result: os.stat_result) -> dict[str, str]:
+        stem = path.stem
+        in_variants = path.relative_to(self.directory).parts[0] == "variants"
+        if CONTENT_DIGEST.fullmatch(stem) and not in_variants:
+            etag = f'"{stem}"'
+        else:
+            etag = f'"{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"'
+        
+        if CONTENT_DIGEST.fullmatch(stem) or RANDOM_NAME.fullmatch(stem):
+            cache_control = IMMUTABLE_CACHE_CONTROL
+        else:
+            cache_control = f"public, max-age={self.max_age_seconds}"
+        
+        return {
+            "etag": etag,
+            "last-modified": formatdate(stat_result.st_mtime, usegmt=True),
+            "cache-control": cache_control,
+            "accept-ranges": "bytes",
+            "x-content-type-options": "nosniff",
+        }
+    
+    @staticmethod
+    def not_modified(request: Request, headers: dict[str, str], stat_result: os.stat_result) -> bool:
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match is not None:
+            if if_none_match.strip() == "*":
+                return True
+            return headers["etag"] in (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+        
+        if_modified_since = parsedate_tz(request.headers.get("if-modified-since", ""))
+        return if_modified_since is not None and int(stat_result.st_mtime) <= mktime_tz(if_modified_since)
+    
+    @staticmethod
+    def range_applies(request: Request, headers: dict[str, str]) -> bool:
+        """False when If-Range names an older version, so the whole file is sent"""
+        if_range = request.headers.get("if-range")
+        return if_range is None or if_range.strip() in (headers["etag"], headers["last-modified"])
+    
+    async def serve(self, request: Request, path: Path, stat_result: os.stat_result) -> Response:
+        headers = self.headers(path, stat_result)
+        if self.not_modified(request, headers, stat_result):
+            return Response(status_code=304, headers=headers)
+        
+        media_type = guess_type(path.name)[0] or "application/octet-stream"
+        if not self.memory_cache.accepts(stat_result):
+            return FileResponse(path, headers=headers, media_type=media_type, stat_result=stat_result)
+        
+        contents = self.memory_cache.get(path, stat_result)
+        if contents is None:
+            contents = await run_in_threadpool(path.read_bytes)
+            if len(contents) != stat_result.st_size:
+                # Replaced between stat and read: send it without the old validators
+                return Response(contents, headers={"cache-control": "no-cache"}, media_type=media_type)
+            self.memory_cache.put(path, stat_result, contents)
+        
+        range_header = request.headers.get("range")
+        if range_header is None or not self.range_applies(request, headers):
+            return Response(contents, headers=headers, media_type=media_type)
+        
+        try:
+            byte_range = parse_range(range_header, len(contents))
+        except RangeNotSatisfiable:
+            return Response(status_code=416, headers={"content-range": f"bytes */{len(contents)}"})
+        if byte_range is None:
+            return Response(contents, headers=headers, media_type=media_type)
+        
+        first, last = byte_range
+        headers["content-range"] = f"bytes {first}-{last}/{len(contents)}"
+        return Response(contents[first:last + 1], status_code=206, headers=headers, media_type=media_type)
+    
+    def stats(self) -> dict:
+        return self.memory_cache.stats()
+
+
+UPLOAD_DIR = Path(__file__).parent.parent / "uploads"
+
+media_server = MediaServer(
+    UPLOAD_DIR,
+    MemoryCache(settings.MEDIA_MEMORY_CACHE_BYTES, settings.MEDIA_MEMORY_CACHE_MAX_FILE_BYTES),
+    settings.MEDIA_MAX_AGE_SECONDS,
+)
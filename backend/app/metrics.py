@@ -0,0 +1,270 @@
+"""
+Request metrics
+
+MetricsMiddleware records, per route template (/api/feed/{user_id}, not the
+concrete path) and method: requests by status, a latency histogram, a
+response size histogram, a histogram of SQL statements per request and the
+total time spent in the database. SQL is attributed to the request whose
+context ran it, through before/after_cursor_execute listeners on every
+engine. GET /metrics renders everything in the Prometheus text format,
+together with the connection pool statistics.
+
+The per-request path does no string formatting: the route template is
+computed once per route, and a request costs a few small objects and some
+integer increments. Metrics are per process; with several workers each one
+reports its own.
+"""
+
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Optional
+
+from sqlalchemy import event
+
+# Upper bounds of the histogram buckets (a final +Inf bucket is implied)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (128, 512, 2048, 8192, 32768, 131072, 524288, 2097152)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+# Route label for requests that matched no route, so unknown paths don't add series
+UNMATCHED = "unmatched"
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class RequestSQL:
+    """Statements and database seconds of the request being handled"""
+    
+    __slots__ = ("statements", "seconds")
+    
+    def __init__(self):
+        self.statements = 0
+        self.seconds = 0.0
+
+
+# Set by the middleware for the duration of a request. Threadpool calls and
+# greenlets run in a copy of the request's context, so they see the same object
+_request_sql: ContextVar[Optional[RequestSQL]] = ContextVar("request_sql", default=None)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._metrics_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    sql = _request_sql.get()
+    if sql is not None:
+        sql.statements += 1
+        sql.seconds += time.perf_counter() - context._metrics_started
+
+
+def instrument_engine(db_engine) -> None:
+    """Attribute an engine's statements to requests (pass sync engines; for async ones, .sync_engine)"""
+    if not event.contains(db_engine, "after_cursor_execute", _after_cursor_execute):
+        event.listen(db_engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(db_engine, "after_cursor_execute", _after_cursor_execute)
+
+
+class RouteMetrics:
+    """Counters and histograms of one (method, route template)"""
+    
+    __slots__ = (
+        "statuses", "latency", "latency_sum", "size", "size_sum", "statements", "statements_sum", "db_seconds"
+    )
+    
+    def __init__(self):
+        self.statuses: dict[int, int] = {}
+        # Non-cumulative bucket counts; the last one is +Inf
+        self.latency = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.latency_sum = 0.0
+        self.size = [0] * (len(SIZE_BUCKETS) + 1)
+        self.size_sum = 0
+        self.statements = [0] * (len(STATEMENT_BUCKETS) + 1)
+        self.statements_sum = 0
+        self.db_seconds = 0.0
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _histogram(lines: list, name: str, labels: str, bounds, counts: list, total) -> None:
+    cumulative = 0
+    for bound, count in zip(bounds, counts):
+        cumulative += count
+        lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+    cumulative += counts[-1]
+    lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {cumulative}')
+    lines.append(f"{name}_sum{{{labels}}} {total}")
+    lines.append(f"{name}_count{{{labels}}} {cumulative}")
+
+
+class MetricsRegistry:
+    """Metrics of every route this process has served"""
+    
+    def __init__(self):
+        self._routes: dict[tuple[str, str], RouteMetrics] = {}
+        # id(route) -> full path template (routes live as long as the app and aren't hashable)
+        self._templates: dict[int, str] = {}
+    
+    def route_template(self, scope) -> str:
+        """
+        The path template of the route that handled a request
+        
+        Routes of included routers carry their own path without the prefix,
+        so the prefix is recovered once per route from the first concrete path.
+        """
+        route = scope.get("route")
+        if route is None:
+            return UNMATCHED
+        template = self._templates.get(id(route))
+        if template is None:
+            path_format = getattr(route, "path_format", None) or getattr(route, "path", None)
+            if path_format is None:
+                return UNMATCHED
+            try:
+                suffix = path_format.format(**scope.get("path_params", {}))
+            except (KeyError, IndexError, ValueError):
+                return UNMATCHED
+            path = scope["path"]
+            prefix = path[:-len(suffix)] if suffix and path.endswith(suffix) else ""
+            template = self._templates[id(route)] = prefix + path_format
+        return template
+    
+    def record(self, method: str, route: str, status: int, seconds: float, size: int, sql: RequestSQL) -> None:
+        key = (method, route)
+        metrics = self._routes.get(key)
+        if metrics is None:
+            metrics = self._routes[key] = RouteMetrics()
+        metrics.statuses[status] = metrics.statuses.get(status, 0) + 1
+        metrics.latency[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        metrics.latency_sum += seconds
+        metrics.size[bisect_left(SIZE_BUCKETS, size)] += 1
+        metrics.size_sum += size
+        metrics.statements[bisect_left(STATEMENT_BUCKETS, sql.statements)] += 1
+        metrics.statements_sum += sql.statements
+        metrics.db_seconds += sql.seconds
+    
+    def reset(self) -> None:
+        self._routes.clear()
+    
+    def render(self, pools: Optional[dict] = None, queues: Optional[dict] = None) -> str:
+        """All metrics in the Prometheus text exposition format"""
+        routes = sorted(self._routes.items())
+        lines = [
+            "# HELP http_requests_total Requests handled, by route template and status",
+            "# TYPE http_requests_total counter",
+        ]
+        labels = {key: f'method="{key[0]}",route="{_escape(key[1])}"' for key, _ in routes}
+        for key, metrics in routes:
+            for status, count in sorted(metrics.statuses.items()):
+                lines.append(f'http_requests_total{{{labels[key]},status="{status}"}} {count}')
+        
+        histograms = (
+            ("http_request_duration_seconds", "Time to handle a request", LATENCY_BUCKETS, "latency", "latency_sum"),
+            ("http_response_size_bytes", "Response body size", SIZE_BUCKETS, "size", "size_sum"),
+            ("http_request_db_statements", "SQL statements run per request", STATEMENT_BUCKETS, "statements", "statements_sum"),
+        )
+        for name, description, bounds, counts, total in histograms:
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} histogram")
+            for key, metrics in routes:
+                _histogram(lines, name, labels[key], bounds, getattr(metrics, counts), getattr(metrics, total))
+        
+        lines.append("# HELP http_request_db_seconds_total Time spent executing SQL statements for requests")
+        lines.append("# TYPE http_request_db_seconds_total counter")
+        for key, metrics in routes:
+            lines.append(f"http_request_db_seconds_total{{{labels[key]}}} {metrics.db_seconds}")
+        
+        if pools is not None:
+            lines.extend(_pool_lines(pools))
+        if queues is not None:
+            lines.extend(_queue_lines(queues))
+        return "\n".join(lines) + "\n"
+
+
+# (metric, pool_stats key, type, help)
+POOL_METRICS = (
+    ("db_pool_size", "size", "gauge", "Configured pool size"),
+    ("db_pool_checked_out", "checked_out", "gauge", "Connections in use"),
+    ("db_pool_checked_in", "checked_in", "gauge", "Idle connections in the pool"),
+    ("db_pool_overflow", "overflow", "gauge", "Connections open beyond the pool size"),
+    ("db_pool_checkouts_total", "checkouts", "counter", "Connection checkouts"),
+    ("db_pool_wait_seconds_total", "wait_seconds_total", "counter", "Time spent waiting for a connection"),
+    ("db_pool_wait_seconds_max", "wait_seconds_max", "gauge", "Longest wait for a connection"),
+)
+
+
+def _pool_lines(pools: dict) -> list[str]:
+    """Pool statistics (app.database.pool_stats()) as gauges and counters"""
+    series = [("primary", kind, pools[kind]) for kind in ("async", "sync")]
+    for replica in pools["replicas"]:
+        series.extend((replica["url"], kind, replica[kind]) for kind in ("async", "sync"))
+    
+    lines = []
+    for name, key, kind, description in POOL_METRICS:
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {kind}")
+        for database, engine_kind, stats in series:
+            lines.append(f'{name}{{database="{_escape(database)}",engine="{engine_kind}"}} {stats[key]}')
+    return lines
+
+
+# (metric, queue_stats key, help)
+QUEUE_METRICS = (
+    ("jobs_ready", "ready", "Jobs due and waiting for a worker"),
+    ("jobs_scheduled", "scheduled", "Jobs waiting for a retry or delay"),
+    ("jobs_running", "running", "Jobs claimed by a worker"),
+    ("jobs_failed", "failed", "Jobs that failed for good"),
+    ("jobs_lag_seconds", "lag_seconds", "How long the oldest ready job has been due"),
+)
+
+
+def _queue_lines(queues: dict) -> list[str]:
+    """Job queue depth and lag (app.jobs.queue_stats()) as gauges"""
+    lines = []
+    for name, key, description in QUEUE_METRICS:
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} gauge")
+        for queue, stats in sorted(queues.items()):
+            lines.append(f'{name}{{queue="{_escape(queue)}"}} {stats[key]}')
+    return lines
+
+
+registry = MetricsRegistry()
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording every HTTP request into a MetricsRegistry"""
+    
+    def __init__(self, app, registry: MetricsRegistry = registry):
+        self.app = app
+        self.registry = registry
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        start = time.perf_counter()
+        sql = RequestSQL()
+        token = _request_sql.set(sql)
+        status = 500
+        size = 0
+        
+        async def send_and_measure(message):
+            nonlocal status, size
+            if message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            elif message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+        
+        try:
+            await self.app(scope, receive, send_and_measure)
+        finally:
+            _request_sql.reset(token)
+            self.registry.record(
+                scope["method"], self.registry.route_template(scope), status, time.perf_counter() - start, size, sql
+            )
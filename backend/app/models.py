@@ -1,6 +1,6 @@
 from datetime import datetime, timezone
-from sqlalchemy.orm import Mapped, mapped_column, relationship
-from sqlalchemy import Integer, String, Text, DateTime, ForeignKey, Table
+from sqlalchemy.orm import Mapped, joinedload, mapped_column, relationship
+from sqlalchemy import Integer, Double, String, Text, DateTime, ForeignKey, Table, Index
 from sqlalchemy import Column
 
 from app.database import Base
@@ -20,7 +20,10 @@ friends = Table(
 class User(Base):
     """User model"""
     __tablename__ = "users"
-
+    __table_args__ = (
+        Index("ix_users_created_at_id", "created_at", "id"),
+    )
+    
     id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
     username: Mapped[str] = mapped_column(String(50), unique=True, index=True, nullable=False)
     email: Mapped[str] = mapped_column(String(255), unique=True, index=True, nullable=False)
@@ -29,13 +32,17 @@ class User(Base):
     profile_picture: Mapped[str | None] = mapped_column(String(255), nullable=True)
     is_admin: Mapped[bool] = mapped_column(Integer, default=False, nullable=False)
     
+    # Denormalized counts, kept current by the write routes (see app.counters)
+    post_count: Mapped[int] = mapped_column(Integer, default=0, server_default="0", nullable=False)
+    friend_count: Mapped[int] = mapped_column(Integer, default=0, server_default="0", nullable=False)
+    
     created_at: Mapped[datetime] = mapped_column(
         DateTime(timezone=True),
         default=lambda: datetime.now(timezone.utc),
         nullable=False,
         index=True,
     )
-
+    
     # Relationships
     posts = relationship("Post", back_populates="author", cascade="all, delete-orphan")
     comments = relationship("Comment", back_populates="author", cascade="all, delete-orphan")
@@ -48,7 +55,7 @@ class User(Base):
         secondaryjoin=id == friends.c.friend_id,
         backref="friend_of"
     )
-
+    
     def __repr__(self):
         return f"<User(id={self.id}, username={self.username})>"
 
@@ -56,11 +63,21 @@ class User(Base):
 class Post(Base):
     """Post model"""
     __tablename__ = "posts"
-
+    __table_args__ = (
+        Index("ix_posts_created_at_id", "created_at", "id"),
+        Index("ix_posts_user_id_created_at_id", "user_id", "created_at", "id"),
+    )
+    
     id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
     content: Mapped[str] = mapped_column(Text, nullable=False)
     image_url: Mapped[str | None] = mapped_column(String(255), nullable=True)
     
+    # Denormalized count, kept current by the write routes (see app.counters)
+    comment_count: Mapped[int] = mapped_column(Integer, default=0, server_default="0", nullable=False)
+    
+    # Time-weighted comment activity for ranked feeds (see app.ranking)
+    engagement: Mapped[float] = mapped_column(Double, default=0, server_default="0", nullable=False)
+    
     created_at: Mapped[datetime] = mapped_column(
         DateTime(timezone=True),
         default=lambda: datetime.now(timezone.utc),
@@ -81,11 +98,11 @@ class Post(Base):
         nullable=False,
         index=True
     )
-
+    
     # Relationships
     author = relationship("User", back_populates="posts")
     comments = relationship("Comment", back_populates="post", cascade="all, delete-orphan")
-
+    
     def __repr__(self):
         return f"<Post(id={self.id}, user_id={self.user_id})>"
 
@@ -93,7 +110,10 @@ class Post(Base):
 class Comment(Base):
     """Comment model"""
     __tablename__ = "comments"
-
+    __table_args__ = (
+        Index("ix_comments_post_id_created_at_id", "post_id", "created_at", "id"),
+    )
+    
     id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
     content: Mapped[str] = mapped_column(Text, nullable=False)
     
@@ -117,10 +137,155 @@ class Comment(Base):
         nullable=False,
         index=True
     )
-
+    
     # Relationships
     author = relationship("User", back_populates="comments")
     post = relationship("Post", back_populates="comments")
-
+    
     def __repr__(self):
         return f"<Comment(id={self.id}, post_id={self.post_id})>"
+
+
+class TimelineEntry(Base):
+    """Materialized feed entry (a post pushed into a user's timeline)"""
+    __tablename__ = "timeline_entries"
+    __table_args__ = (
+        Index("ix_timeline_entries_user_created", "user_id", "created_at", "post_id"),
+        Index("ix_timeline_entries_user_author", "user_id", "author_id"),
+    )
+    
+    user_id: Mapped[int] = mapped_column(
+        Integer,
+        ForeignKey("users.id", ondelete="CASCADE"),
+        primary_key=True
+    )
+    post_id: Mapped[int] = mapped_column(
+        Integer,
+        ForeignKey("posts.id", ondelete="CASCADE"),
+        primary_key=True,
+        index=True
+    )
+    author_id: Mapped[int] = mapped_column(
+        Integer,
+        ForeignKey("users.id", ondelete="CASCADE"),
+        nullable=False
+    )
+    
+    # Copied from the post so the feed can be read from this table alone
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+    
+    def __repr__(self):
+        return f"<TimelineEntry(user_id={self.user_id}, post_id={self.post_id})>"
+
+
+class HighDegreeAuthor(Base):
+    """Author whose posts are pulled at read time instead of fanned out"""
+    __tablename__ = "high_degree_authors"
+    
+    user_id: Mapped[int] = mapped_column(
+        Integer,
+        ForeignKey("users.id", ondelete="CASCADE"),
+        primary_key=True
+    )
+    
+    def __repr__(self):
+        return f"<HighDegreeAuthor(user_id={self.user_id})>"
+
+
+class AuthorAffinity(Base):
+    """How many comments a user has left on another user's posts (see app.ranking)"""
+    __tablename__ = "author_affinity"
+    
+    viewer_id: Mapped[int] = mapped_column(
+        Integer,
+        ForeignKey("users.id", ondelete="CASCADE"),
+        primary_key=True
+    )
+    author_id: Mapped[int] = mapped_column(
+        Integer,
+        ForeignKey("users.id", ondelete="CASCADE"),
+        primary_key=True
+    )
+    comments: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f"<AuthorAffinity(viewer_id={self.viewer_id}, author_id={self.author_id})>"
+
+
+class MediaBlob(Base):
+    """Reference count for a content-addressed upload"""
+    __tablename__ = "media_blobs"
+    
+    # Path under uploads/, e.g. post_images/ab/cd/<sha256>.jpg
+    path: Mapped[str] = mapped_column(String(255), primary_key=True)
+    size: Mapped[int] = mapped_column(Integer, nullable=False)
+    # Posts and users storing a URL of the file
+    refcount: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        default=lambda: datetime.now(timezone.utc),
+        nullable=False,
+    )
+    # Unreferenced files are collected UPLOAD_UNATTACHED_HOURS after this
+    uploaded_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        default=lambda: datetime.now(timezone.utc),
+        nullable=False,
+    )
+    
+    def __repr__(self):
+        return f"<MediaBlob(path={self.path}, refcount={self.refcount})>"
+
+
+class Job(Base):
+    """A queued background job (see app.jobs)"""
+    __tablename__ = "jobs"
+    __table_args__ = (
+        Index("ix_jobs_queue_status_run_at", "queue", "status", "run_at"),
+    )
+    
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    queue: Mapped[str] = mapped_column(String(50), nullable=False)
+    name: Mapped[str] = mapped_column(String(100), nullable=False)
+    # JSON keyword arguments for the handler
+    payload: Mapped[str] = mapped_column(Text, nullable=False)
+    # Enqueueing a key that is already taken is a no-op
+    idempotency_key: Mapped[str | None] = mapped_column(String(255), unique=True, nullable=True)
+    
+    # queued, running, done or failed
+    status: Mapped[str] = mapped_column(String(20), nullable=False, default="queued")
+    attempts: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    max_attempts: Mapped[int] = mapped_column(Integer, nullable=False)
+    last_error: Mapped[str | None] = mapped_column(Text, nullable=True)
+    
+    # Earliest time the job may (next) run
+    run_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+    # Claim held by a worker while running; once locked_until passes another worker may retry it
+    claimed_by: Mapped[str | None] = mapped_column(String(64), nullable=True)
+    locked_until: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
+    
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        default=lambda: datetime.now(timezone.utc),
+        nullable=False,
+    )
+    started_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
+    finished_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
+    
+    def __repr__(self):
+        return f"<Job(id={self.id}, name={self.name}, status={self.status})>"
+
+
+# Author columns embedded in post and comment responses (schemas.AuthorSummary)
+AUTHOR_SUMMARY_COLUMNS = (User.id, User.username, User.full_name, User.profile_picture)
+
+
+def load_author(relationship_attribute):
+    """
+    Loader option that joins a row's author with only the summary columns
+    
+    Keeps wide columns such as bio and email in the database when a page of
+    posts or comments is loaded.
+    """
+    return joinedload(relationship_attribute).load_only(*AUTHOR_SUMMARY_COLUMNS)
@@ -0,0 +1,132 @@
+"""
+Keyset (cursor) pagination helpers
+
+List endpoints page on (created_at, id) instead of OFFSET, so every page is an
+index range scan no matter how deep the client scrolls, and rows inserted
+between requests can't shift items across page boundaries. Cursors are opaque
+to clients; `skip` is still accepted as a legacy mode.
+"""
+
+import base64
+import json
+from datetime import datetime
+from typing import Any, Callable, Optional
+
+from fastapi import HTTPException, status
+from sqlalchemy import and_, or_
+
+
+def _encode(values: list) -> str:
+    payload = json.dumps(values, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def _decode(cursor: str) -> list:
+    padded = cursor + "=" * (-len(cursor) % 4)
+    return json.loads(base64.urlsafe_b64decode(padded))
+
+
+def _invalid_cursor() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail="Invalid cursor"
+    )
+
+
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    """Encode a (created_at, id) position as an opaque cursor"""
+    return _encode([created_at.isoformat(), row_id])
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    """Decode a cursor produced by encode_cursor"""
+    try:
+        created_at, row_id = _decode(cursor)
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (ValueError, TypeError):
+        raise _invalid_cursor()
+
+
+def encode_rank_cursor(score: float, row_id: int) -> str:
+    """Encode a (relevance score, id) position as an opaque cursor"""
+    return _encode([score, row_id])
+
+
+def decode_rank_cursor(cursor: str) -> tuple[float, int]:
+    """Decode a cursor produced by encode_rank_cursor"""
+    try:
+        score, row_id = _decode(cursor)
+        return float(score), int(row_id)
+    except (ValueError, TypeError):
+        raise _invalid_cursor()
+
+
+def encode_feed_rank_cursor(as_of: datetime, score: float, row_id: int) -> str:
+    """Encode a ranked feed position together with the time its scores were computed"""
+    return _encode([as_of.isoformat(), score, row_id])
+
+
+def decode_feed_rank_cursor(cursor: str) -> tuple[datetime, float, int]:
+    """Decode a cursor produced by encode_feed_rank_cursor"""
+    try:
+        as_of, score, row_id = _decode(cursor)
+        return datetime.fromisoformat(as_of), float(score), int(row_id)
+    except (ValueError, TypeError):
+        raise _invalid_cursor()
+
+
+def keyset_after(created_col, id_col, position: tuple[datetime, int], descending: bool = True):
+    """
+    Filter clause for rows strictly after a (created_at, id) position
+    """
+    created_at, row_id = position
+    if descending:
+        return or_(created_col < created_at, and_(created_col == created_at, id_col < row_id))
+    return or_(created_col > created_at, and_(created_col == created_at, id_col > row_id))
+
+
+def paginate(
+    query,
+    created_col,
+    id_col,
+    after: Optional[str] = None,
+    skip: int = 0,
+    limit: int = 100,
+    descending: bool = True,
+):
+    """
+    Apply cursor (or legacy offset) pagination to a query
+
+    One extra row is fetched so page_response can tell whether a next page exists.
+    """
+    if after:
+        query = query.where(keyset_after(created_col, id_col, decode_cursor(after), descending))
+    elif skip:
+        query = query.offset(skip)
+
+    if descending:
+        query = query.order_by(created_col.desc(), id_col.desc())
+    else:
+        query = query.order_by(created_col.asc(), id_col.asc())
+
+    return query.limit(limit + 1)
+
+
+def page_response(
+    rows: list,
+    limit: int,
+    position: Callable[[Any], tuple[datetime, int]] = lambda row: (row.created_at, row.id),
+) -> dict:
+    """
+    Build the list response shared by every paginated endpoint
+    """
+    items = rows[:limit]
+    next_cursor = None
+    if len(rows) > limit:
+        next_cursor = encode_cursor(*position(items[-1]))
+
+    return {
+        "items": items,
+        "count": len(items),
+        "next_cursor": next_cursor,
+    }
@@ -0,0 +1,447 @@
+"""
+Live updates (pub/sub)
+
+Clients holding a feed or a post open subscribe over SSE or a WebSocket
+(/api/live) instead of polling for new rows. Write routes publish after
+commit, on these topics:
+    
+    feed:{user_id}      post.created, for posts by the user or their friends;
+                        friendship.changed, when the user's friends changed
+    author:{user_id}    post.created, for posts by an author in pull mode
+    post:{post_id}      comment.created, for comments on the post
+
+Authors in the timeline's pull mode (timeline.pulled_author_ids) publish
+once to their author topic instead of to every friend's feed, and feed
+subscriptions listen on the author topics of their pulled friends. A
+subscription's author topics are re-read from the database whenever a
+friendship.changed event reaches it, so friends added, removed or switching
+modes while a stream is open are followed.
+
+With FEED_FANOUT_IN_BACKGROUND, a post.created event reaches the author's
+friends' feeds only from the timeline.fan_out job, once the post is in their
+timelines, so a client that reloads its feed on the event finds the post. The
+author's own feed and author topic are told right after the post commits.
+Job handlers, which run off the event loop, publish with
+publish_after_commit; in a `python -m app.jobs` process those events reach
+the web workers over the PUBSUB_SOCKET_DIR bridge.
+
+An event is serialized once and the same string is queued to every matching
+subscription. Each queue holds at most PUBSUB_QUEUE_SIZE events; a subscriber
+that falls that far behind is evicted (its stream ends with a `closed`
+event, so the client refetches and reconnects) instead of buffering without
+bound or slowing publishers down.
+
+The broker is per process. With several workers, set PUBSUB_SOCKET_DIR: each
+worker binds a Unix datagram socket there and forwards the events it
+publishes to the other workers' sockets, which deliver them to their own
+subscribers. A peer whose socket buffer is full misses the event (counted as
+dropped) rather than blocking the publisher. Who sees a post comes from the
+in-memory friend graph, so with several workers it is as fresh as
+FRIEND_GRAPH_REFRESH_SECONDS keeps it. See `python -m benchmarks.pubsub`.
+"""
+
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import socket
+import time
+from collections import deque
+from typing import Iterable, Optional
+
+from sqlalchemy import event as orm_event, select
+from sqlalchemy.orm import Session
+
+from app import friend_graph
+from app.config import settings
+from app.models import friends
+from app.schemas import PostResponse, CommentResponse
+
+logger = logging.getLogger(__name__)
+
+# Largest datagram accepted from another worker
+MAX_DATAGRAM = 256 * 1024
+
+# How long the list of other workers' sockets is reused before rescanning the directory
+PEER_REFRESH_SECONDS = 1.0
+
+SOCKET_SUFFIX = ".sock"
+
+# Session.info key of the events a transaction publishes once it commits
+_ON_COMMIT = "pubsub_on_commit"
+
+
+class SubscriptionClosed(Exception):
+    """Raised by Subscription.get once the subscription has ended"""
+    
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class Subscription:
+    """A bounded queue of serialized events for a set of topics"""
+    
+    __slots__ = ("topics", "reason", "_events", "_ready", "_maxsize")
+    
+    def __init__(self, maxsize: int):
+        self.topics: set[str] = set()
+        # Why the subscription ended; None while it is open
+        self.reason: Optional[str] = None
+        self._events: deque[str] = deque()
+        self._ready = asyncio.Event()
+        self._maxsize = maxsize
+    
+    def _put(self, event: str) -> bool:
+        if len(self._events) >= self._maxsize:
+            return False
+        self._events.append(event)
+        self._ready.set()
+        return True
+    
+    def _close(self, reason: str) -> None:
+        if self.reason is None:
+            self.reason = reason
+            self._events.clear()
+            self._ready.set()
+    
+    async def get(self, timeout: Optional[float] = None) -> list[str]:
+        """
+        Every queued event, waiting up to `timeout` seconds for at least one
+        (an empty list if none came)
+        
+        Raises SubscriptionClosed once the subscription has ended.
+        """
+        while not self._events:
+            if self.reason is not None:
+                raise SubscriptionClosed(self.reason)
+            self._ready.clear()
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout)
+            except TimeoutError:
+                return []
+        events = list(self._events)
+        self._events.clear()
+        return events
+
+
+class Broker:
+    """Topic-based fan-out to this process's subscriptions, optionally bridged to other workers"""
+    
+    def __init__(self, queue_size: int, socket_dir: str = "", name: Optional[str] = None):
+        self.queue_size = queue_size
+        self.socket_dir = socket_dir
+        # The socket's file name in socket_dir; the pid unless given
+        self.name = name or str(os.getpid())
+        self._topics: dict[str, set[Subscription]] = {}
+        self._open: set[Subscription] = set()
+        self._socket: Optional[socket.socket] = None
+        self._path: Optional[str] = None
+        self._buffer = bytearray(MAX_DATAGRAM)
+        self._peers: list[str] = []
+        self._peers_checked = 0.0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.published = 0
+        self.delivered = 0
+        self.evicted = 0
+        self.forwarded = 0
+        self.received = 0
+        self.dropped = 0
+    
+    @property
+    def active(self) -> bool:
+        """Whether publishing can reach anyone: local subscribers or other workers"""
+        return bool(self._topics) or self._socket is not None
+    
+    def subscribe(self, topics: Iterable[str] = ()) -> Subscription:
+        subscription = Subscription(self.queue_size)
+        self._open.add(subscription)
+        self.update(subscription, add=topics)
+        return subscription
+    
+    def update(self, subscription: Subscription, add: Iterable[str] = (), remove: Iterable[str] = ()) -> None:
+        """Add topics to and remove topics from an open subscription"""
+        if subscription.reason is not None:
+            return
+        for topic in remove:
+            if topic in subscription.topics:
+                subscription.topics.discard(topic)
+                self._discard(topic, subscription)
+        for topic in add:
+            if topic not in subscription.topics:
+                subscription.topics.add(topic)
+                self._topics.setdefault(topic, set()).add(subscription)
+    
+    def unsubscribe(self, subscription: Subscription, reason: str = "unsubscribed") -> None:
+        if subscription.reason is not None:
+            return
+        for topic in subscription.topics:
+            self._discard(topic, subscription)
+        self._open.discard(subscription)
+        subscription._close(reason)
+    
+    def _discard(self, topic: str, subscription: Subscription) -> None:
+        subscribers = self._topics.get(topic)
+        if subscribers is not None:
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._topics[topic]
+    
+    def publish(self, topics: list[str], event: str) -> int:
+        """
+        Queue a serialized event to every subscription of any of the topics
+        
+        Call from the event loop. Also forwards the event to the other workers
+        when the bridge is on. Returns the local deliveries.
+        """
+        self.published += 1
+        if self._socket is not None:
+            self._forward(topics, event)
+        return self._deliver(topics, event)
+    
+    def publish_threadsafe(self, events: list[tuple[list[str], str]]) -> None:
+        """Publish (topics, event) pairs from any thread; dropped unless the broker is started"""
+        loop = self._loop
+        if loop is None:
+            return
+        loop.call_soon_threadsafe(self._publish_all, events)
+    
+    def _publish_all(self, events: list[tuple[list[str], str]]) -> None:
+        for topics, event in events:
+            self.publish(topics, event)
+    
+    def _deliver(self, topics: list[str], event: str) -> int:
+        # Walk whichever side is smaller: the event's topics or the subscribed ones
+        if len(topics) > len(self._topics):
+            wanted = set(topics)
+            groups = [subscribers for topic, subscribers in self._topics.items() if topic in wanted]
+        else:
+            groups = [subscribers for subscribers in map(self._topics.get, topics) if subscribers]
+        
+        seen = set() if len(groups) > 1 else None
+        delivered = 0
+        slow = []
+        for subscribers in groups:
+            for subscription in subscribers:
+                if seen is not None:
+                    if subscription in seen:
+                        continue
+                    seen.add(subscription)
+                if subscription._put(event):
+                    delivered += 1
+                else:
+                    slow.append(subscription)
+        
+        for subscription in slow:
+            self.unsubscribe(subscription, "slow consumer")
+        self.evicted += len(slow)
+        self.delivered += delivered
+        return delivered
+    
+    def start(self) -> None:
+        """Accept publish_threadsafe, and bind this worker's socket in PUBSUB_SOCKET_DIR and start receiving"""
+        self._loop = asyncio.get_running_loop()
+        if not self.socket_dir or self._socket is not None:
+            return
+        os.makedirs(self.socket_dir, exist_ok=True)
+        self._path = os.path.join(self.socket_dir, f"{self.name}{SOCKET_SUFFIX}")
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(self._path)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sock.setblocking(False)
+        sock.bind(self._path)
+        self._socket = sock
+        asyncio.get_running_loop().add_reader(sock.fileno(), self._receive)
+    
+    def stop(self) -> None:
+        """End every subscription and close the socket"""
+        self._loop = None
+        for subscription in list(self._open):
+            self.unsubscribe(subscription, "shutdown")
+        if self._socket is not None:
+            asyncio.get_running_loop().remove_reader(self._socket.fileno())
+            self._socket.close()
+            self._socket = None
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(self._path)
+    
+    def _peer_paths(self) -> list[str]:
+        now = time.monotonic()
+        if now - self._peers_checked > PEER_REFRESH_SECONDS:
+            self._peers = [
+                entry.path for entry in os.scandir(self.socket_dir)
+                if entry.name.endswith(SOCKET_SUFFIX) and entry.path != self._path
+            ]
+            self._peers_checked = now
+        return self._peers
+    
+    def _forward(self, topics: list[str], event: str) -> None:
+        # One datagram: the topics on the first line, the event after it
+        data = (" ".join(topics) + "\n" + event).encode()
+        if len(data) > MAX_DATAGRAM:
+            logger.warning("Event for %d topics is too large to forward (%d bytes)", len(topics), len(data))
+            return
+        for path in list(self._peer_paths()):
+            try:
+                self._socket.sendto(data, path)
+                self.forwarded += 1
+            except BlockingIOError:
+                self.dropped += 1
+            except (ConnectionRefusedError, FileNotFoundError) as e:
+                # A worker that exited without removing its socket
+                if isinstance(e, ConnectionRefusedError):
+                    with contextlib.suppress(FileNotFoundError):
+                        os.unlink(path)
+                self._peers.remove(path)
+            except OSError:
+                self.dropped += 1
+                logger.exception("Failed to forward an event to %s", path)
+    
+    def _receive(self) -> None:
+        while True:
+            try:
+                size = self._socket.recv_into(self._buffer)
+            except BlockingIOError:
+                return
+            header, _, event = bytes(self._buffer[:size]).decode().partition("\n")
+            self.received += 1
+            self._deliver(header.split(" "), event)
+    
+    def stats(self) -> dict:
+        return {
+            "subscriptions": len(self._open),
+            "topics": len(self._topics),
+            "published": self.published,
+            "delivered": self.delivered,
+            "evicted": self.evicted,
+            "workers_bridged": len(self._peers) if self._socket is not None else 0,
+            "forwarded": self.forwarded,
+            "received": self.received,
+            "dropped": self.dropped,
+        }
+
+
+def _event(kind: str, data: str) -> str:
+    # data is already JSON, so it is spliced in rather than parsed and dumped again
+    return f'{{"type":"{kind}","data":{data}}}'
+
+
+def closed_event(reason: str) -> str:
+    """The last event of a stream that the server ended"""
+    return json.dumps({"type": "closed", "reason": reason})
+
+
+# Sent to the feeds whose friends (or whose friends' publishing topics) changed
+FRIENDSHIP_CHANGED = _event("friendship.changed", "{}")
+
+# Users whose feed topics go in one friendship.changed event, keeping it under MAX_DATAGRAM
+FRIENDSHIP_CHANGED_CHUNK = 1000
+
+
+def feed_topics(user_id: int, pulled_friend_ids) -> list[str]:
+    """Topics a subscription to a user's feed listens on, given timeline.pulled_friend_ids"""
+    return [f"feed:{user_id}"] + [f"author:{friend_id}" for friend_id in pulled_friend_ids]
+
+
+def refresh_feed_topics(subscription: Subscription, pulled_friend_ids) -> None:
+    """Bring a feed subscription's author topics in line with its user's pulled friends"""
+    current = {topic for topic in subscription.topics if topic.startswith("author:")}
+    wanted = {f"author:{friend_id}" for friend_id in pulled_friend_ids}
+    broker.update(subscription, add=wanted - current, remove=current - wanted)
+
+
+def publish_friendships_changed(pairs, switched=()) -> None:
+    """
+    Send friendship.changed to the feeds of both users of each friendship
+    
+    Must run after the friend graph has been updated. `switched` are the users
+    that moved between push and pull mode (timeline.update_fanout_modes), so
+    between publishing to friends' feeds and to their author topic; all their
+    friends are told.
+    """
+    if not broker.active:
+        return
+    graph = friend_graph.graph
+    user_ids = {user_id for pair in pairs for user_id in pair}
+    for user_id in switched:
+        user_ids.update(graph.friend_ids(user_id).tolist())
+    
+    user_ids = sorted(user_ids)
+    for start in range(0, len(user_ids), FRIENDSHIP_CHANGED_CHUNK):
+        chunk = user_ids[start:start + FRIENDSHIP_CHANGED_CHUNK]
+        broker.publish([f"feed:{user_id}" for user_id in chunk], FRIENDSHIP_CHANGED)
+
+
+def _post_created(post) -> str:
+    return _event("post.created", PostResponse.model_validate(post).model_dump_json())
+
+
+def publish_posts(posts, pulled_author_ids) -> None:
+    """
+    Send post.created to the feeds that show each post (posts need their author loaded)
+    
+    pulled_author_ids is timeline.pulled_author_ids of the posts' authors. With
+    FEED_FANOUT_IN_BACKGROUND the friends' feeds are left to
+    publish_pushed_posts, which the fan-out job calls.
+    """
+    if not broker.active:
+        return
+    graph = friend_graph.graph
+    for post in posts:
+        topics = [f"feed:{post.user_id}"]
+        if post.user_id in pulled_author_ids:
+            topics.append(f"author:{post.user_id}")
+        elif not settings.FEED_FANOUT_IN_BACKGROUND:
+            topics += [f"feed:{friend_id}" for friend_id in graph.friend_ids(post.user_id).tolist()]
+        broker.publish(topics, _post_created(post))
+
+
+def publish_after_commit(db: Session, topics: list[str], event: str) -> None:
+    """Publish once db's transaction commits, from any thread; nothing is sent if it rolls back"""
+    db.info.setdefault(_ON_COMMIT, []).append((topics, event))
+
+
+@orm_event.listens_for(Session, "after_commit")
+def _publish_on_commit(session: Session) -> None:
+    events = session.info.pop(_ON_COMMIT, None)
+    if events:
+        broker.publish_threadsafe(events)
+
+
+@orm_event.listens_for(Session, "after_rollback")
+def _forget_on_rollback(session: Session) -> None:
+    session.info.pop(_ON_COMMIT, None)
+
+
+def publish_pushed_posts(db: Session, posts) -> None:
+    """
+    Send post.created to the friends' feeds that posts were just pushed to, once db commits
+    
+    For the timeline.fan_out job, with the posts it pushed (authors loaded).
+    The friends are read from the database, as the push read them, since the
+    job may run where the friend graph is stale.
+    """
+    if not broker.active or not posts:
+        return
+    followers: dict[int, list[str]] = {}
+    for user_id, friend_id in db.execute(
+        select(friends.c.user_id, friends.c.friend_id).where(friends.c.user_id.in_({post.user_id for post in posts}))
+    ):
+        followers.setdefault(user_id, []).append(f"feed:{friend_id}")
+    for post in posts:
+        if post.user_id in followers:
+            publish_after_commit(db, followers[post.user_id], _post_created(post))
+
+
+def publish_comments(comments) -> None:
+    """Send comment.created to the subscribers of each comment's post (comments need their author loaded)"""
+    if not broker.active:
+        return
+    for comment in comments:
+        event = _event("comment.created", CommentResponse.model_validate(comment).model_dump_json())
+        broker.publish([f"post:{comment.post_id}"], event)
+
+
+# Process-wide broker; the app starts and stops it in its lifespan
+broker = Broker(settings.PUBSUB_QUEUE_SIZE, settings.PUBSUB_SOCKET_DIR)
@@ -0,0 +1,192 @@
+"""
+Query diagnostics
+
+An opt-in mode (QUERY_DIAGNOSTICS) for development and canary builds that
+watches the SQL each request runs:
+
+- every statement is fingerprinted (literals, placeholders and IN lists
+  normalized away), and a request that runs one shape QUERY_REPEAT_THRESHOLD
+  or more times is reported as a likely N+1
+- statements slower than SLOW_QUERY_MS are logged with their EXPLAIN plan,
+  fetched on the same connection right after they ran
+- every response gets an X-Query-Report header (statements, database time,
+  repeated shapes, slow statements), and requests with findings get a
+  warning log record naming the route and the offending SQL
+
+It costs a regex pass per new statement text and an EXPLAIN per slow one,
+so it is off by default.
+"""
+
+import logging
+import re
+import time
+from contextvars import ContextVar
+from functools import lru_cache
+from typing import Optional
+
+from sqlalchemy import event
+
+from app import metrics
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+HEADER = b"x-query-report"
+
+# Shapes reported per request, most repeated first
+REPORTED_SHAPES = 5
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER = r"(?:\?|%s|%\(\w+\)s|:\w+)"
+_IN_LIST = re.compile(rf"\bIN\s*\(\s*{_PLACEHOLDER}(?:\s*,\s*{_PLACEHOLDER})*\s*\)", re.IGNORECASE)
+_VALUES_ROWS = re.compile(r"(\([^()]*\))(?:\s*,\s*\1)+")
+_SPACE = re.compile(r"\s+")
+
+# Statements EXPLAIN can describe on both SQLite and MySQL
+_EXPLAINABLE = ("SELECT", "WITH")
+
+
+@lru_cache(maxsize=2048)
+def fingerprint(statement: str) -> str:
+    """
+    Normalize a statement so repeats of the same query compare equal
+    
+    Literals become ?, IN lists and multi-row VALUES collapse to one item,
+    whitespace is squeezed.
+    """
+    shape = _STRING.sub("?", statement)
+    shape = _NUMBER.sub("?", shape)
+    shape = _IN_LIST.sub("IN (...)", shape)
+    shape = _VALUES_ROWS.sub(r"\1", shape)
+    return _SPACE.sub(" ", shape).strip()
+
+
+class QueryLog:
+    """The statements one request ran, by fingerprint"""
+    
+    __slots__ = ("shapes", "statements", "seconds", "slow")
+    
+    def __init__(self):
+        # fingerprint -> [count, seconds]
+        self.shapes: dict[str, list] = {}
+        self.statements = 0
+        self.seconds = 0.0
+        self.slow = 0
+    
+    def record(self, statement: str, seconds: float) -> None:
+        key = fingerprint(statement)
+        shape = self.shapes.get(key)
+        if shape is None:
+            self.shapes[key] = [1, seconds]
+        else:
+            shape[0] += 1
+            shape[1] += seconds
+        self.statements += 1
+        self.seconds += seconds
+    
+    def repeated(self, threshold: int) -> list[tuple[str, int, float]]:
+        """(fingerprint, count, seconds) of shapes run at least `threshold` times, most first"""
+        shapes = [(sql, count, seconds) for sql, (count, seconds) in self.shapes.items() if count >= threshold]
+        return sorted(shapes, key=lambda shape: -shape[1])
+    
+    def header(self, threshold: int) -> str:
+        return (
+            f"statements={self.statements}; db_ms={self.seconds * 1e3:.2f}; "
+            f"repeated={len(self.repeated(threshold))}; slow={self.slow}"
+        )
+
+
+_query_log: ContextVar[Optional[QueryLog]] = ContextVar("query_log", default=None)
+
+
+def explain(conn, statement: str, parameters) -> list:
+    """
+    The plan of a statement, run on the connection that just executed it
+    
+    Goes through a raw DBAPI cursor so it doesn't pass through these listeners.
+    """
+    if not statement.lstrip().upper().startswith(_EXPLAINABLE):
+        return []
+    prefix = "EXPLAIN QUERY PLAN " if conn.dialect.name == "sqlite" else "EXPLAIN "
+    cursor = conn.connection.cursor()
+    try:
+        cursor.execute(prefix + statement, parameters)
+        return [tuple(row) for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._diagnostics_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    seconds = time.perf_counter() - context._diagnostics_started
+    log = _query_log.get()
+    if log is not None:
+        log.record(statement, seconds)
+    
+    if seconds * 1e3 < settings.SLOW_QUERY_MS:
+        return
+    if log is not None:
+        log.slow += 1
+    try:
+        plan = [] if executemany else explain(conn, statement, parameters)
+    except Exception as e:
+        plan = [f"EXPLAIN failed: {e}"]
+    logger.warning(
+        "Slow query (%.1f ms): %s\nparameters: %r\nplan:\n%s",
+        seconds * 1e3, statement, parameters, "\n".join(map(str, plan)) or "(none)",
+    )
+
+
+def instrument_engine(db_engine) -> None:
+    """Fingerprint and time an engine's statements (pass sync engines; for async ones, .sync_engine)"""
+    if not event.contains(db_engine, "after_cursor_execute", _after_cursor_execute):
+        event.listen(db_engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(db_engine, "after_cursor_execute", _after_cursor_execute)
+
+
+class QueryDiagnosticsMiddleware:
+    """ASGI middleware giving each HTTP request a QueryLog and reporting on it"""
+    
+    def __init__(self, app, repeat_threshold: Optional[int] = None):
+        self.app = app
+        self.repeat_threshold = repeat_threshold or settings.QUERY_REPEAT_THRESHOLD
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        log = QueryLog()
+        token = _query_log.set(log)
+        
+        async def send_with_report(message):
+            # The route's queries have run by the time the response starts
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((HEADER, log.header(self.repeat_threshold).encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+        
+        try:
+            await self.app(scope, receive, send_with_report)
+        finally:
+            _query_log.reset(token)
+            self.report(scope, log)
+    
+    def report(self, scope, log: QueryLog) -> None:
+        repeated = log.repeated(self.repeat_threshold)
+        route = f"{scope['method']} {metrics.registry.route_template(scope)}"
+        if not repeated and not log.slow:
+            logger.debug("%s: %s", route, log.header(self.repeat_threshold))
+            return
+        shapes = "\n".join(
+            f"  {count} x ({seconds * 1e3:.1f} ms) {sql}" for sql, count, seconds in repeated[:REPORTED_SHAPES]
+        )
+        logger.warning(
+            "%s: %s%s",
+            route, log.header(self.repeat_threshold), f"\nrepeated statements (possible N+1):\n{shapes}" if shapes else "",
+        )
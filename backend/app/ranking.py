@@ -0,0 +1,343 @@
+"""
+Ranked feeds
+
+`?mode=ranked` orders a feed by a score that combines three signals:
+
+- recency: halves every FEED_RANK_RECENCY_HALF_LIFE_HOURS
+- comment velocity: comments weighted by how recent they are, halving every
+  FEED_RANK_VELOCITY_HALF_LIFE_HOURS
+- author affinity: how many comments the viewer has left on the author's posts
+
+The per-post and per-pair parts are stored and kept current by the comment
+routes. `posts.engagement` is the sum of 2^((commented_at - created_at) / half_life)
+over the post's comments, so a new comment is one additive UPDATE and the
+velocity at any later time is engagement * 2^(-age / half_life).
+`author_affinity` counts comments per (viewer, author).
+
+A ranked request reads the newest FEED_RANK_CANDIDATES posts of the feed
+with their stored values and scores them in one vectorized pass; only the
+posts on the page are loaded. Cursors carry the time the first page was
+scored, so later pages score posts the same way and leave out posts written
+since.
+
+    python -m app.ranking    # recompute engagement and affinity from comments
+"""
+
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+from typing import Optional
+
+import numpy as np
+from sqlalchemy import bindparam, delete, func, insert, select, update
+from sqlalchemy.orm import Session
+
+from app import timeline
+from app.config import settings
+from app.database import add_missing_columns, insert_ignore
+from app.models import AuthorAffinity, Comment, Post, TimelineEntry
+
+HOUR = 3600.0
+EPOCH = datetime(1970, 1, 1)
+
+# Caps a comment's weight so comments on very old posts can't overflow the sum
+MAX_WEIGHT_EXPONENT = 512.0
+
+# Engagement deltas written per executemany during a rebuild
+REBUILD_CHUNK = 1000
+
+# (score, post_id)
+RankPosition = tuple[float, int]
+
+
+def _as_utc(value: datetime) -> datetime:
+    # SQLite hands back naive datetimes; every stored time is UTC
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value
+
+
+def _naive_utc(value: datetime) -> datetime:
+    return value if value.tzinfo is None else value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _epoch_seconds(values) -> np.ndarray:
+    """UTC datetimes as float seconds since the epoch"""
+    return np.fromiter(
+        ((_naive_utc(value) - EPOCH).total_seconds() for value in values), dtype=np.float64, count=len(values)
+    )
+
+
+def comment_weight(post_created_at: datetime, commented_at: datetime) -> float:
+    """A comment's contribution to its post's stored engagement"""
+    half_life = settings.FEED_RANK_VELOCITY_HALF_LIFE_HOURS * HOUR
+    exponent = (_as_utc(commented_at) - _as_utc(post_created_at)).total_seconds() / half_life
+    return 2.0 ** min(max(exponent, 0.0), MAX_WEIGHT_EXPONENT)
+
+
+def _add_engagement(db: Session, deltas: dict[int, float]) -> None:
+    rows = [{"row_id": post_id, "delta": delta} for post_id, delta in deltas.items() if delta]
+    if not rows:
+        return
+    
+    table = Post.__table__
+    db.execute(
+        update(table)
+        .where(table.c.id == bindparam("row_id"))
+        .values(engagement=table.c.engagement + bindparam("delta")),
+        rows,
+    )
+
+
+def _add_affinity(db: Session, deltas: dict[tuple[int, int], int]) -> None:
+    rows = [
+        {"viewer": viewer_id, "author": author_id, "delta": delta}
+        for (viewer_id, author_id), delta in deltas.items() if delta
+    ]
+    if not rows:
+        return
+    
+    table = AuthorAffinity.__table__
+    db.execute(
+        insert_ignore(table),
+        [{"viewer_id": row["viewer"], "author_id": row["author"], "comments": 0} for row in rows],
+    )
+    db.execute(
+        update(table)
+        .where(table.c.viewer_id == bindparam("viewer"), table.c.author_id == bindparam("author"))
+        .values(comments=table.c.comments + bindparam("delta")),
+        rows,
+    )
+
+
+def record_comments(db: Session, comments, sign: int = 1) -> None:
+    """
+    Add (sign=1) or remove (sign=-1) comments' share of engagement and affinity
+    
+    `comments` are rows with post_id, user_id and created_at. Runs in the
+    caller's transaction.
+    """
+    if not comments:
+        return
+    
+    posts = {
+        row.id: row
+        for row in db.execute(
+            select(Post.id, Post.user_id, Post.created_at)
+            .where(Post.id.in_({comment.post_id for comment in comments}))
+        ).all()
+    }
+    engagement = defaultdict(float)
+    affinity = Counter()
+    for comment in comments:
+        post = posts.get(comment.post_id)
+        if post is None:
+            continue
+        engagement[post.id] += sign * comment_weight(post.created_at, comment.created_at)
+        if comment.user_id != post.user_id:
+            affinity[(comment.user_id, post.user_id)] += sign
+    
+    _add_engagement(db, engagement)
+    _add_affinity(db, affinity)
+
+
+def retract_post(db: Session, post_id: int) -> None:
+    """Take back the affinity earned by comments on a post that is being deleted"""
+    comments = db.execute(
+        select(Comment.post_id, Comment.user_id, Comment.created_at).where(Comment.post_id == post_id)
+    ).all()
+    record_comments(db, comments, sign=-1)
+
+
+def purge_user(db: Session, user_id: int) -> None:
+    """
+    Take back a deleted user's comments on other users' posts and drop their affinity rows
+    """
+    comments = db.execute(
+        select(Comment.post_id, Comment.user_id, Comment.created_at)
+        .join(Post, Post.id == Comment.post_id)
+        .where(Comment.user_id == user_id, Post.user_id != user_id)
+    ).all()
+    record_comments(db, comments, sign=-1)
+    db.execute(
+        delete(AuthorAffinity).where(
+            (AuthorAffinity.viewer_id == user_id) | (AuthorAffinity.author_id == user_id)
+        )
+    )
+
+
+def score(
+    as_of: float,
+    created_at: np.ndarray,
+    engagement: np.ndarray,
+    affinity: np.ndarray,
+) -> np.ndarray:
+    """
+    Score candidate posts at as_of (epoch seconds); arrays are aligned per post
+    """
+    age = np.maximum(as_of - created_at, 0.0)
+    recency = np.exp2(-age / (settings.FEED_RANK_RECENCY_HALF_LIFE_HOURS * HOUR))
+    velocity = np.maximum(engagement, 0.0) * np.exp2(-age / (settings.FEED_RANK_VELOCITY_HALF_LIFE_HOURS * HOUR))
+    return (
+        recency
+        * (1.0 + settings.FEED_RANK_VELOCITY_WEIGHT * np.log1p(velocity))
+        * (1.0 + settings.FEED_RANK_AFFINITY_WEIGHT * np.log1p(np.maximum(affinity, 0.0)))
+    )
+
+
+def _candidate_columns():
+    return select(Post.id, Post.user_id, Post.created_at, Post.engagement)
+
+
+def _rank(
+    db: Session,
+    candidates: list,
+    viewer_id: Optional[int],
+    as_of: datetime,
+    after: Optional[RankPosition],
+    skip: int,
+    limit: int,
+) -> tuple[list[int], Optional[RankPosition]]:
+    if not candidates:
+        return [], None
+    
+    post_ids, author_ids, created_at, engagement = zip(*candidates)
+    post_ids = np.array(post_ids, dtype=np.int64)
+    author_ids = np.array(author_ids, dtype=np.int64)
+    created_at = _epoch_seconds(created_at)
+    engagement = np.array(engagement, dtype=np.float64)
+    
+    # A post can be both pushed and pulled while its author changes fan-out mode
+    _, first = np.unique(post_ids, return_index=True)
+    keep = np.zeros(len(post_ids), dtype=bool)
+    keep[first] = True
+    post_ids, author_ids, created_at, engagement = (
+        post_ids[keep], author_ids[keep], created_at[keep], engagement[keep]
+    )
+    as_of_seconds = _as_utc(as_of).timestamp()
+    
+    affinity = np.zeros(len(post_ids))
+    if viewer_id is not None:
+        # One range scan of the viewer's rows; cheaper than an IN list of every candidate author
+        counts = dict(db.execute(
+            select(AuthorAffinity.author_id, AuthorAffinity.comments)
+            .where(AuthorAffinity.viewer_id == viewer_id, AuthorAffinity.comments > 0)
+        ).all())
+        if counts:
+            affinity = np.array([counts.get(author_id, 0) for author_id in author_ids.tolist()], dtype=np.float64)
+    
+    scores = score(as_of_seconds, created_at, engagement, affinity)
+    
+    # Highest score first, newer post first on ties
+    order = np.lexsort((-post_ids, -scores))
+    scores, post_ids = scores[order], post_ids[order]
+    
+    if after:
+        after_score, after_id = after
+        keep = (scores < after_score) | ((scores == after_score) & (post_ids < after_id))
+        scores, post_ids = scores[keep], post_ids[keep]
+    elif skip:
+        scores, post_ids = scores[skip:], post_ids[skip:]
+    
+    next_position = None
+    if len(post_ids) > limit:
+        next_position = (float(scores[limit - 1]), int(post_ids[limit - 1]))
+    return post_ids[:limit].tolist(), next_position
+
+
+def rank_user_feed(
+    db: Session,
+    user_id: int,
+    as_of: datetime,
+    after: Optional[RankPosition] = None,
+    skip: int = 0,
+    limit: int = 50,
+) -> tuple[list[int], Optional[RankPosition]]:
+    """
+    Rank the newest timeline posts at or before as_of for a user
+    
+    Returns the page's post ids in rank order and the position of the next page.
+    Only the newest FEED_RANK_CANDIDATES posts (as of the first page) are
+    ranked, so paging stops after that many posts.
+    """
+    pushed = (
+        _candidate_columns()
+        .join(TimelineEntry, TimelineEntry.post_id == Post.id)
+        .where(TimelineEntry.user_id == user_id, TimelineEntry.created_at <= as_of)
+        .order_by(TimelineEntry.created_at.desc(), TimelineEntry.post_id.desc())
+        .limit(settings.FEED_RANK_CANDIDATES)
+    )
+    pulled = (
+        _candidate_columns()
+        .where(Post.user_id.in_(timeline.pulled_authors(user_id)), Post.created_at <= as_of)
+        .order_by(Post.created_at.desc(), Post.id.desc())
+        .limit(settings.FEED_RANK_CANDIDATES)
+    )
+    candidates = db.execute(pushed).all() + db.execute(pulled).all()
+    return _rank(db, candidates, user_id, as_of, after, skip, limit)
+
+
+def rank_public_feed(
+    db: Session,
+    as_of: datetime,
+    after: Optional[RankPosition] = None,
+    skip: int = 0,
+    limit: int = 50,
+) -> tuple[list[int], Optional[RankPosition]]:
+    """
+    Rank the newest posts at or before as_of (recency and velocity only)
+    
+    Like the user feed, paging stops after FEED_RANK_CANDIDATES posts.
+    """
+    candidates = db.execute(
+        _candidate_columns()
+        .where(Post.created_at <= as_of)
+        .order_by(Post.created_at.desc(), Post.id.desc())
+        .limit(settings.FEED_RANK_CANDIDATES)
+    ).all()
+    return _rank(db, candidates, None, as_of, after, skip, limit)
+
+
+def rebuild(db: Session) -> None:
+    """
+    Recompute every post's engagement and the affinity table from the comments
+    """
+    db.execute(update(Post.__table__).values(engagement=0))
+    db.execute(delete(AuthorAffinity))
+    
+    db.execute(
+        insert(AuthorAffinity).from_select(
+            ["viewer_id", "author_id", "comments"],
+            select(Comment.user_id, Post.user_id, func.count())
+            .join(Post, Post.id == Comment.post_id)
+            .where(Comment.user_id != Post.user_id)
+            .group_by(Comment.user_id, Post.user_id)
+        )
+    )
+    
+    engagement = defaultdict(float)
+    rows = db.execute(
+        select(Comment.post_id, Post.created_at, Comment.created_at).join(Post, Post.id == Comment.post_id)
+    )
+    for post_id, created_at, commented_at in rows:
+        engagement[post_id] += comment_weight(created_at, commented_at)
+    
+    deltas = list(engagement.items())
+    for start in range(0, len(deltas), REBUILD_CHUNK):
+        _add_engagement(db, dict(deltas[start:start + REBUILD_CHUNK]))
+    db.commit()
+
+
+def ensure_columns(db: Session) -> None:
+    """
+    Add the engagement column to databases created before ranked feeds, then fill it
+    """
+    if add_missing_columns(db, [Post.__table__.c.engagement]):
+        rebuild(db)
+
+
+if __name__ == "__main__":
+    from app.database import Base, SessionLocal, engine
+    
+    Base.metadata.create_all(bind=engine)
+    with SessionLocal() as session:
+        add_missing_columns(session, [Post.__table__.c.engagement])
+        rebuild(session)
+    print("Engagement and affinity rebuilt")
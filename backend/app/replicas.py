@@ -0,0 +1,87 @@
+"""
+Read replicas
+
+Replicas are listed in DATABASE_REPLICA_URLS. Reads are spread round-robin
+across the healthy ones; a replica that fails to connect is skipped for
+REPLICA_RETRY_SECONDS before it is tried again.
+
+For local development a replica can be a periodically refreshed copy of the
+SQLite primary:
+    
+    python -m app.replicas sqlite:///./replica.db
+"""
+
+import itertools
+import sqlite3
+import threading
+import time
+
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+
+
+class Replica:
+    """One read replica with its own engines and session factories"""
+    
+    def __init__(self, url: str, engine, sync_engine):
+        self.url = url
+        self.engine = engine
+        self.sync_engine = sync_engine
+        self.session_factory = async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
+        self.sync_session_factory = sessionmaker(autocommit=False, autoflush=False, bind=sync_engine)
+        self.unhealthy_until = 0.0
+    
+    @property
+    def name(self) -> str:
+        return make_url(self.url).render_as_string(hide_password=True)
+    
+    def is_healthy(self, now: float) -> bool:
+        return now >= self.unhealthy_until
+
+
+class ReplicaSet:
+    """Round-robin selection over healthy replicas"""
+    
+    def __init__(self, replicas: list[Replica], retry_seconds: float):
+        self.replicas = replicas
+        self.retry_seconds = retry_seconds
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+    
+    def candidates(self) -> list[Replica]:
+        """Healthy replicas, rotated so successive reads start on a different one"""
+        now = time.monotonic()
+        healthy = [replica for replica in self.replicas if replica.is_healthy(now)]
+        if not healthy:
+            return []
+        with self._lock:
+            start = next(self._counter) % len(healthy)
+        return healthy[start:] + healthy[:start]
+    
+    def mark_unhealthy(self, replica: Replica) -> None:
+        replica.unhealthy_until = time.monotonic() + self.retry_seconds
+
+
+def copy_sqlite_database(source_url: str, target_url: str) -> None:
+    """Copy a SQLite database with the online backup API (readers aren't blocked)"""
+    source_path = make_url(source_url).database
+    target_path = make_url(target_url).database
+    with sqlite3.connect(source_path) as source, sqlite3.connect(target_path) as target:
+        source.backup(target)
+    # The `with` blocks only end transactions; close explicitly
+    source.close()
+    target.close()
+
+
+if __name__ == "__main__":
+    import sys
+    
+    from app.config import settings
+    
+    interval = float(sys.argv[2]) if len(sys.argv) > 2 else 1.0
+    target = sys.argv[1]
+    print(f"Copying {settings.DATABASE_URL} to {target} every {interval}s")
+    while True:
+        copy_sqlite_database(settings.DATABASE_URL, target)
+        time.sleep(interval)
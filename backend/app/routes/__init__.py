@@ -9,6 +9,7 @@ from .friends import router as friends_router
 from .upload import router as upload_router
 from .search import router as search_router
 from .feed import router as feed_router
+from .live import router as live_router
 
 __all__ = [
     "users_router",
@@ -18,4 +19,5 @@ __all__ = [
     "upload_router",
     "search_router",
     "feed_router",
+    "live_router",
 ]
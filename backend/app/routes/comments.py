@@ -2,38 +2,84 @@
 Comment routes
 """
 
+from collections import Counter
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session, joinedload
-from typing import List
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
 
-from app.database import get_db
-from app.models import Comment, Post, User
-from app.schemas import CommentCreate, CommentResponse
+from app import counters, pubsub, ranking, suggestions
+from app.batch import parse_ids, check_batch_size, multi_get_response, insert_rows
+from app.cache import response_cache, page_key, page_tags
+from app.constraints import constraint_error, delete_row
+from app.database import get_db, get_read_db
+from app.models import Comment, Post, User, load_author
+from app.schemas import CommentCreate, CommentResponse, Page, MultiGet, BatchCreated
+from app.pagination import paginate, page_response
 
 router = APIRouter()
 
 
-@router.get("/post/{post_id}")
-def get_post_comments(
+@router.get("/", response_model=MultiGet[CommentResponse])
+async def get_comments(
+    ids: str,
+    db: AsyncSession = Depends(get_read_db)
+):
+    """
+    Get the comments in ?ids=1,2,3
+    """
+    
+    try:
+        comment_ids = parse_ids(ids)
+        query = select(Comment).options(load_author(Comment.author)).where(Comment.id.in_(comment_ids))
+        return multi_get_response((await db.scalars(query)).all(), comment_ids)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error getting comments: {str(e)}"
+        )
+
+
+@router.get("/post/{post_id}", response_model=Page[CommentResponse])
+async def get_post_comments(
     post_id: int,
+    after: Optional[str] = None,
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     """
     Get all comments for a specific post
     """
     
     try:
-        post = db.query(Post).filter(Post.id == post_id).first()
+        key = page_key(f"comments:{post_id}", after, skip, limit)
+        cached = response_cache.get(key, db)
+        if cached is not None:
+            return cached
+        
+        post = await db.get(Post, post_id)
         if not post:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail=f"Post with id {post_id} not found"
             )
         
-        comments = db.query(Comment).options(joinedload(Comment.author)).filter(Comment.post_id == post_id).order_by(Comment.created_at.asc()).offset(skip).limit(limit).all()
-        return comments
+        query = select(Comment).options(load_author(Comment.author)).where(Comment.post_id == post_id)
+        query = paginate(
+            query, Comment.created_at, Comment.id, after=after, skip=skip, limit=limit, descending=False
+        )
+        comments = (await db.scalars(query)).all()
+        page = page_response(comments, limit)
+        
+        tags = page_tags(f"comments:{post_id}", page, after, skip, descending=False)
+        tags.append(f"post:{post_id}")
+        for comment in page["items"]:
+            tags += [f"comment:{comment.id}", f"user:{comment.user_id}"]
+        return response_cache.store(key, page, tags, Page[CommentResponse], db)
     except HTTPException:
         raise
     except Exception as e:
@@ -43,17 +89,17 @@ def get_post_comments(
         )
 
 
-@router.get("/{comment_id}")
-def get_comment(
+@router.get("/{comment_id}", response_model=CommentResponse)
+async def get_comment(
     comment_id: int,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     """
     Get comment by ID
     """
     
     try:
-        comment = db.query(Comment).filter(Comment.id == comment_id).first()
+        comment = await db.get(Comment, comment_id, options=[load_author(Comment.author)])
         if not comment:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -69,36 +115,35 @@ def get_comment(
         )
 
 
-@router.post("/", status_code=status.HTTP_201_CREATED)
-def create_comment(
+@router.post("/", response_model=CommentResponse, status_code=status.HTTP_201_CREATED)
+async def create_comment(
     comment: CommentCreate,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Create a new comment
     """
     
     try:
-        # Verify user exists
-        user = db.query(User).filter(User.id == comment.user_id).first()
-        if not user:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail=f"User with id {comment.user_id} not found"
-            )
-        
-        # Verify post exists
-        post = db.query(Post).filter(Post.id == comment.post_id).first()
-        if not post:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail=f"Post with id {comment.post_id} not found"
-            )
-        
+        # The user and post are checked by the foreign keys
         db_comment = Comment(**comment.model_dump())
         db.add(db_comment)
-        db.commit()
-        db.refresh(db_comment)
+        try:
+            await db.flush()
+        except IntegrityError as e:
+            raise await constraint_error(db, e, references=[
+                (User.id, comment.user_id, "User"), (Post.id, comment.post_id, "Post")
+            ])
+        await counters.adjust(db, Post.comment_count, {comment.post_id: 1})
+        await db.run_sync(ranking.record_comments, [db_comment])
+        await db.commit()
+        response_cache.invalidate(
+            f"comments:{comment.post_id}:new", f"comments:{comment.post_id}:offset", f"post:{comment.post_id}"
+        )
+        # Co-commenting feeds the commenter's suggestions; rank them afresh next time
+        suggestions.suggestion_index.discard(comment.user_id)
+        db_comment = await db.get(Comment, db_comment.id, options=[load_author(Comment.author)], populate_existing=True)
+        pubsub.publish_comments([db_comment])
         return db_comment
     except HTTPException:
         raise
@@ -109,25 +154,80 @@ def create_comment(
         )
 
 
+@router.post("/batch", response_model=BatchCreated[CommentResponse], status_code=status.HTTP_201_CREATED)
+async def create_comments(
+    comments: List[CommentCreate],
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Create several comments in one request
+    
+    Either every comment is created or none is. Created comments are returned in id order.
+    """
+    
+    try:
+        check_batch_size(comments)
+        try:
+            comment_ids = await db.run_sync(insert_rows, Comment, [comment.model_dump() for comment in comments])
+        except IntegrityError as e:
+            raise await constraint_error(db, e, references=[
+                (User.id, {comment.user_id for comment in comments}, "Users"),
+                (Post.id, {comment.post_id for comment in comments}, "Posts"),
+            ])
+        query = (
+            select(Comment).options(load_author(Comment.author))
+            .where(Comment.id.in_(comment_ids))
+            .order_by(Comment.id)
+        )
+        created = (await db.scalars(query)).all()
+        comment_counts = Counter(comment.post_id for comment in comments)
+        await counters.adjust(db, Post.comment_count, comment_counts)
+        await db.run_sync(ranking.record_comments, created)
+        await db.commit()
+        
+        response_cache.invalidate(
+            *(f"comments:{post_id}:{kind}" for post_id in comment_counts for kind in ("new", "offset")),
+            *(f"post:{post_id}" for post_id in comment_counts)
+        )
+        for user_id in {comment.user_id for comment in comments}:
+            suggestions.suggestion_index.discard(user_id)
+        pubsub.publish_comments(created)
+        
+        return {"items": created, "count": len(created)}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error creating comments: {str(e)}"
+        )
+
+
 @router.delete("/{comment_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_comment(
+async def delete_comment(
     comment_id: int,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Delete a comment
     """
     
     try:
-        db_comment = db.query(Comment).filter(Comment.id == comment_id).first()
-        if not db_comment:
+        # DELETE ... RETURNING hands back what the counters and ranking need
+        deleted = await db.run_sync(
+            delete_row, Comment, comment_id, Comment.post_id, Comment.user_id, Comment.created_at
+        )
+        if not deleted:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail=f"Comment with id {comment_id} not found"
             )
         
-        db.delete(db_comment)
-        db.commit()
+        post_id = deleted.post_id
+        await db.run_sync(ranking.record_comments, [deleted], -1)
+        await counters.adjust(db, Post.comment_count, {post_id: -1})
+        await db.commit()
+        response_cache.invalidate(f"comment:{comment_id}", f"comments:{post_id}:offset", f"post:{post_id}")
         return None
     except HTTPException:
         raise
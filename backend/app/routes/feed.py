@@ -2,79 +2,132 @@
 Feed routes
 """
 
+from datetime import datetime, timezone
 from fastapi import APIRouter, Depends, HTTPException, Query
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Literal, Optional
 
-from app.database import get_db
-from app.models import User, Post
+from app import ranking, timeline
+from app.cache import response_cache, page_key, page_tags
+from app.database import get_read_db
+from app.models import User, Post, load_author
+from app.schemas import PostResponse, Page
+from app.pagination import (
+    paginate, page_response, decode_cursor, encode_feed_rank_cursor, decode_feed_rank_cursor
+)
 
 router = APIRouter()
 
 
-@router.get("/{user_id}")
-def get_user_feed(
-    user_id: int,
+async def _load_posts(db: AsyncSession, post_ids: list[int]) -> list[Post]:
+    """Load posts by id, keeping the given order"""
+    query = select(Post).options(load_author(Post.author)).where(Post.id.in_(post_ids))
+    posts_by_id = {
+        post.id: post
+        for post in (await db.scalars(query)).all()
+    }
+    return [posts_by_id[post_id] for post_id in post_ids if post_id in posts_by_id]
+
+
+async def _ranked_page(db: AsyncSession, rank, after: Optional[str], skip: int, limit: int, *args) -> dict:
+    """
+    Rank a feed and load the page's posts
+    
+    Ranked pages aren't cached: their order moves with every comment.
+    """
+    if after:
+        as_of, score, post_id = decode_feed_rank_cursor(after)
+        position = (score, post_id)
+    else:
+        as_of, position = datetime.now(timezone.utc), None
+    
+    post_ids, next_position = await db.run_sync(rank, *args, as_of, after=position, skip=skip, limit=limit)
+    posts = await _load_posts(db, post_ids)
+    return {
+        "items": posts,
+        "count": len(posts),
+        "next_cursor": encode_feed_rank_cursor(as_of, *next_position) if next_position else None,
+    }
+
+
+@router.get("/public", response_model=Page[PostResponse])
+async def get_public_feed(
+    mode: Literal["recent", "ranked"] = "recent",
+    after: Optional[str] = None,
     skip: int = 0,
     limit: int = Query(50, ge=1, le=100),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     """
-    Get news feed for a user (posts from friends and own posts)
+    Get public feed (all posts, ordered by newest, or by score with ?mode=ranked)
     """
     
     try:
-        user = db.query(User).filter(User.id == user_id).first()
-        if not user:
-            raise HTTPException(
-                status_code=404,
-                detail=f"User with id {user_id} not found"
-            )
+        if mode == "ranked":
+            return await _ranked_page(db, ranking.rank_public_feed, after, skip, limit)
         
-        # Get friend IDs
-        friend_ids = [friend.id for friend in user.friends]
+        key = page_key("feed:public", after, skip, limit)
+        cached = response_cache.get(key, db)
+        if cached is not None:
+            return cached
         
-        # Include user's own posts
-        friend_ids.append(user_id)
+        query = paginate(select(Post).options(load_author(Post.author)), Post.created_at, Post.id, after=after, skip=skip, limit=limit)
+        posts = (await db.scalars(query)).all()
+        page = page_response(posts, limit)
         
-        # Get posts from friends and user
-        posts = db.query(Post).filter(
-            Post.user_id.in_(friend_ids)
-        ).order_by(Post.created_at.desc()).offset(skip).limit(limit).all()
-        
-        return {
-            "posts": posts,
-            "count": len(posts)
-        }
+        tags = page_tags("feed:public", page, after, skip)
+        for post in page["items"]:
+            tags += [f"post:{post.id}", f"user:{post.user_id}"]
+        return response_cache.store(key, page, tags, Page[PostResponse], db)
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(
             status_code=500,
-            detail=f"Error getting feed: {str(e)}"
+            detail=f"Error getting public feed: {str(e)}"
         )
 
 
-@router.get("/public")
-def get_public_feed(
+@router.get("/{user_id}", response_model=Page[PostResponse])
+async def get_user_feed(
+    user_id: int,
+    mode: Literal["recent", "ranked"] = "recent",
+    after: Optional[str] = None,
     skip: int = 0,
     limit: int = Query(50, ge=1, le=100),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     """
-    Get public feed (all posts, ordered by newest)
+    Get news feed for a user (posts from friends and own posts)
+    
+    ?mode=ranked orders it by recency, comment activity and how often the user
+    comments on each author, instead of newest first.
     """
     
     try:
-        posts = db.query(Post).order_by(
-            Post.created_at.desc()
-        ).offset(skip).limit(limit).all()
+        user = await db.get(User, user_id)
+        if not user:
+            raise HTTPException(
+                status_code=404,
+                detail=f"User with id {user_id} not found"
+            )
+        
+        if mode == "ranked":
+            return await _ranked_page(db, ranking.rank_user_feed, after, skip, limit, user_id)
+        
+        # Read the materialized timeline, then load the posts in feed order
+        position = decode_cursor(after) if after else None
+        entries = await db.run_sync(
+            timeline.read_timeline, user_id, after=position, skip=skip, limit=limit + 1
+        )
+        posts = await _load_posts(db, [post_id for _, post_id in entries])
         
-        return {
-            "posts": posts,
-            "count": len(posts)
-        }
+        return page_response(posts, limit)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=500,
-            detail=f"Error getting public feed: {str(e)}"
+            detail=f"Error getting feed: {str(e)}"
         )
@@ -2,35 +2,91 @@
 Friend routes
 """
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from collections import Counter
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select, delete, tuple_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from typing import List
 
-from app.database import get_db
-from app.models import User
-from app.schemas import UserResponse, FriendRequest
+from app import counters, friend_graph, pubsub, suggestions, timeline
+from app.batch import require_existing
+from app.cache import response_cache
+from app.config import settings
+from app.constraints import constraint_error
+from app.database import get_db, get_read_db, insert_ignore
+from app.models import User, friends
+from app.schemas import UserResponse, FriendRequest, FriendImportResult, FriendSuggestion, MessageResponse
 
 router = APIRouter()
 
 
-@router.get("/{user_id}")
-def get_user_friends(
+def _insert_friendships(db: Session, pairs: list[tuple[int, int]]) -> list[tuple[int, int]]:
+    """
+    Insert whichever directions of each friendship aren't stored yet
+    
+    A friendship stored in one direction only gets its missing row. Existing
+    rows are looked up one chunk per query; the missing ones go in with one
+    executemany that ignores rows a concurrent request just added.
+    Returns the (user_id, friend_id) rows inserted.
+    """
+    rows = [row for user_id, friend_id in pairs for row in ((user_id, friend_id), (friend_id, user_id))]
+    existing = set()
+    for start in range(0, len(rows), timeline.BULK_CHUNK):
+        chunk = rows[start:start + timeline.BULK_CHUNK]
+        result = db.execute(
+            select(friends.c.user_id, friends.c.friend_id)
+            .where(tuple_(friends.c.user_id, friends.c.friend_id).in_(chunk))
+        )
+        existing.update((user_id, friend_id) for user_id, friend_id in result)
+    
+    missing = [row for row in rows if row not in existing]
+    if missing:
+        db.execute(insert_ignore(friends), [{"user_id": user_id, "friend_id": friend_id} for user_id, friend_id in missing])
+    return missing
+
+
+async def _check_users_exist(db: AsyncSession, *user_ids: int) -> None:
+    found = set((await db.scalars(select(User.id).where(User.id.in_(user_ids)))).all())
+    for user_id in user_ids:
+        if user_id not in found:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"User with id {user_id} not found"
+            )
+
+
+@router.get("/{user_id}", response_model=List[UserResponse])
+async def get_user_friends(
     user_id: int,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     """
     Get all friends of a user
     """
     
     try:
-        user = db.query(User).filter(User.id == user_id).first()
+        key = f"friends:{user_id}"
+        cached = response_cache.get(key, db)
+        if cached is not None:
+            return cached
+        
+        user = await db.get(User, user_id)
         if not user:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail=f"User with id {user_id} not found"
             )
         
-        return user.friends
+        friend_ids = friend_graph.graph.friend_ids(user_id).tolist()
+        user_friends = []
+        if friend_ids:
+            query = select(User).where(User.id.in_(friend_ids)).order_by(User.id)
+            user_friends = (await db.scalars(query)).all()
+        tags = [key] + [f"user:{friend.id}" for friend in user_friends]
+        return response_cache.store(key, user_friends, tags, List[UserResponse], db)
     except HTTPException:
         raise
     except Exception as e:
@@ -40,42 +96,99 @@ def get_user_friends(
         )
 
 
-@router.post("/", status_code=status.HTTP_201_CREATED)
-def add_friend(
-    friend_request: FriendRequest,
-    db: Session = Depends(get_db)
+@router.get("/{user_id}/suggestions", response_model=List[FriendSuggestion])
+async def get_friend_suggestions(
+    user_id: int,
+    limit: int = Query(10, ge=1, le=suggestions.SUGGESTIONS_KEPT),
+    db: AsyncSession = Depends(get_read_db)
 ):
     """
-    Add a friend connection between two users
+    Suggest people a user may know, ranked by mutual friends and then by
+    posts they both commented on
     """
     
     try:
-        user = db.query(User).filter(User.id == friend_request.user_id).first()
+        user = await db.get(User, user_id)
         if not user:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
-                detail=f"User with id {friend_request.user_id} not found"
+                detail=f"User with id {user_id} not found"
             )
         
-        friend = db.query(User).filter(User.id == friend_request.friend_id).first()
-        if not friend:
+        ranked = await suggestions.suggest(db, user_id, limit)
+        candidate_ids = [candidate_id for candidate_id, _, _ in ranked]
+        users_by_id = {}
+        if candidate_ids:
+            query = select(User).where(User.id.in_(candidate_ids))
+            users_by_id = {candidate.id: candidate for candidate in (await db.scalars(query)).all()}
+        
+        return [
+            {"user": users_by_id[candidate_id], "mutual_friends": mutual_friends, "co_comments": co_comments}
+            for candidate_id, mutual_friends, co_comments in ranked
+            if candidate_id in users_by_id
+        ]
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error getting friend suggestions: {str(e)}"
+        )
+
+
+@router.post("/", response_model=MessageResponse, status_code=status.HTTP_201_CREATED)
+async def add_friend(
+    friend_request: FriendRequest,
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Add a friend connection between two users
+    """
+    
+    try:
+        user_id, friend_id = friend_request.user_id, friend_request.friend_id
+        if user_id == friend_id:
             raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail=f"User with id {friend_request.friend_id} not found"
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Users can't befriend themselves"
             )
         
-        # Check if already friends
-        if friend in user.friends:
+        # Add each direction unless the primary key says it is stored (the in-memory
+        # graph may be another worker's stale copy), so a friendship stored one way
+        # only is repaired; the foreign keys check both users exist
+        inserted = []
+        try:
+            for row in ((user_id, friend_id), (friend_id, user_id)):
+                result = await db.execute(insert_ignore(friends).values(user_id=row[0], friend_id=row[1]))
+                if result.rowcount:
+                    inserted.append(row)
+        except IntegrityError as e:
+            raise await constraint_error(
+                db, e,
+                references=[(User.id, user_id, "User"), (User.id, friend_id, "User")],
+            )
+        if not inserted:
+            # INSERT IGNORE on MySQL also skips foreign key failures
+            await db.rollback()
+            await _check_users_exist(db, user_id, friend_id)
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Users are already friends"
             )
+        await counters.adjust(db, User.friend_count, Counter(row_user_id for row_user_id, _ in inserted))
         
-        # Add bidirectional friendship
-        user.friends.append(friend)
-        friend.friends.append(user)
+        # Keep materialized timelines in sync
+        switched = await db.run_sync(timeline.update_fanout_modes, [user_id, friend_id])
+        await db.run_sync(timeline.backfill_friendship, user_id, friend_id)
         
-        db.commit()
+        await db.commit()
+        friend_graph.graph.add_friendship(user_id, friend_id)
+        pubsub.publish_friendships_changed([(user_id, friend_id)], switched)
+        stale = await run_in_threadpool(suggestions.suggestion_index.friendship_changed, user_id, friend_id)
+        suggestions.refresh_in_background(stale)
+        response_cache.invalidate(
+            f"friends:{user_id}", f"friends:{friend_id}", f"user:{user_id}", f"user:{friend_id}"
+        )
         return {"message": "Friend added successfully"}
     except HTTPException:
         raise
@@ -85,43 +198,108 @@ def add_friend(
             detail=f"Error adding friend: {str(e)}"
         )
 
+@router.post("/bulk", response_model=FriendImportResult, status_code=status.HTTP_201_CREATED)
+async def import_friends(
+    friendships: List[FriendRequest],
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Add many friendships in one transaction, e.g. from a contact sync
+    
+    Friendships that already exist, repeats and self-pairs are skipped rather
+    than failing the import.
+    """
+    
+    try:
+        if not friendships:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Batch is empty"
+            )
+        if len(friendships) > settings.FRIEND_IMPORT_MAX_EDGES:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"At most {settings.FRIEND_IMPORT_MAX_EDGES} friendships per request"
+            )
+        
+        pairs = sorted({
+            (min(edge.user_id, edge.friend_id), max(edge.user_id, edge.friend_id))
+            for edge in friendships
+            if edge.user_id != edge.friend_id
+        })
+        user_ids = {user_id for pair in pairs for user_id in pair}
+        # INSERT IGNORE on MySQL also skips foreign key failures, so check up front
+        await require_existing(db, User.id, user_ids, "Users")
+        
+        inserted = await db.run_sync(_insert_friendships, pairs)
+        added = sorted({(min(row), max(row)) for row in inserted})
+        if added:
+            await counters.adjust(db, User.friend_count, Counter(user_id for user_id, _ in inserted))
+            
+            # Keep materialized timelines in sync
+            changed = sorted({user_id for pair in added for user_id in pair})
+            switched = await db.run_sync(timeline.update_fanout_modes, changed)
+            await db.run_sync(timeline.backfill_friendships, added)
+        
+        await db.commit()
+        if added:
+            friend_graph.graph.add_friendships(added)
+            pubsub.publish_friendships_changed(added, switched)
+            stale = await run_in_threadpool(suggestions.suggestion_index.friendships_changed, added)
+            suggestions.refresh_in_background(stale)
+            response_cache.invalidate(
+                *(f"{kind}:{user_id}" for user_id in changed for kind in ("friends", "user"))
+            )
+        return {"added": len(added), "existing": len(pairs) - len(added)}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error importing friends: {str(e)}"
+        )
+
 
 @router.delete("/", status_code=status.HTTP_204_NO_CONTENT)
-def remove_friend(
+async def remove_friend(
     friend_request: FriendRequest,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Remove a friend connection between two users
     """
     
     try:
-        user = db.query(User).filter(User.id == friend_request.user_id).first()
-        if not user:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail=f"User with id {friend_request.user_id} not found"
-            )
+        user_id, friend_id = friend_request.user_id, friend_request.friend_id
         
-        friend = db.query(User).filter(User.id == friend_request.friend_id).first()
-        if not friend:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail=f"User with id {friend_request.friend_id} not found"
+        # Remove bidirectional friendship
+        removed = await db.execute(
+            delete(friends).where(
+                tuple_(friends.c.user_id, friends.c.friend_id).in_([(user_id, friend_id), (friend_id, user_id)])
             )
-        
-        # Check if they are friends
-        if friend not in user.friends:
+        )
+        if not removed.rowcount:
+            await db.rollback()
+            await _check_users_exist(db, user_id, friend_id)
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Users are not friends"
             )
         
-        # Remove bidirectional friendship
-        user.friends.remove(friend)
-        friend.friends.remove(user)
+        await counters.adjust(db, User.friend_count, {user_id: -1, friend_id: -1})
         
-        db.commit()
+        # Keep materialized timelines in sync
+        await db.run_sync(timeline.prune_friendship, user_id, friend_id)
+        switched = await db.run_sync(timeline.update_fanout_modes, [user_id, friend_id])
+        
+        await db.commit()
+        friend_graph.graph.remove_friendship(user_id, friend_id)
+        pubsub.publish_friendships_changed([(user_id, friend_id)], switched)
+        stale = await run_in_threadpool(suggestions.suggestion_index.friendship_changed, user_id, friend_id)
+        suggestions.refresh_in_background(stale)
+        response_cache.invalidate(
+            f"friends:{user_id}", f"friends:{friend_id}", f"user:{user_id}", f"user:{friend_id}"
+        )
         return None
     except HTTPException:
         raise
@@ -0,0 +1,138 @@
+"""
+Live update routes (server-sent events and WebSocket)
+"""
+
+import asyncio
+from fastapi import APIRouter, HTTPException, WebSocket, WebSocketDisconnect, status
+from fastapi.responses import StreamingResponse
+from typing import Optional
+
+from app import pubsub, timeline
+from app.batch import MAX_BATCH_SIZE, parse_ids
+from app.config import settings
+from app.database import session_scope
+
+router = APIRouter()
+
+
+async def _pulled_friend_ids(user_id: int) -> list[int]:
+    # A short session of its own: streams stay open far longer than a request
+    async with session_scope() as db:
+        return await db.run_sync(timeline.pulled_friend_ids, user_id)
+
+
+async def _topics(feed: Optional[int], posts: Optional[str]) -> list[str]:
+    topics = pubsub.feed_topics(feed, await _pulled_friend_ids(feed)) if feed is not None else []
+    if posts:
+        topics += [f"post:{post_id}" for post_id in parse_ids(posts)]
+    return topics
+
+
+async def _follow_friendships(subscription: pubsub.Subscription, feed: Optional[int], events: list[str]) -> None:
+    # A feed listens on its pulled friends' author topics, which change with its friends
+    if feed is not None and pubsub.FRIENDSHIP_CHANGED in events:
+        pubsub.refresh_feed_topics(subscription, await _pulled_friend_ids(feed))
+
+
+async def _event_stream(topics: list[str], feed: Optional[int]):
+    # Subscribed here rather than in the route, so the finally always runs
+    subscription = pubsub.broker.subscribe(topics)
+    try:
+        yield ": subscribed\n\n"
+        while True:
+            try:
+                events = await subscription.get(timeout=settings.PUBSUB_HEARTBEAT_SECONDS)
+            except pubsub.SubscriptionClosed as e:
+                yield f"data: {pubsub.closed_event(e.reason)}\n\n"
+                return
+            await _follow_friendships(subscription, feed, events)
+            # A comment line on idle keeps proxies from timing the stream out
+            yield "".join(f"data: {event}\n\n" for event in events) if events else ": ping\n\n"
+    finally:
+        pubsub.broker.unsubscribe(subscription)
+
+
+@router.get("/events")
+async def stream_events(
+    feed: Optional[int] = None,
+    posts: Optional[str] = None
+):
+    """
+    Server-sent events for a user's feed (?feed=user_id) and open posts (?posts=1,2,3)
+    
+    Each event's data is {"type": "post.created" | "comment.created" | "friendship.changed", "data": ...}.
+    A {"type": "closed"} event means the server ended the stream; refetch, then reconnect.
+    """
+    
+    topics = await _topics(feed, posts)
+    if not topics:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Subscribe to a feed (?feed=) or to posts (?posts=)"
+        )
+    return StreamingResponse(
+        _event_stream(topics, feed),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def _receive_commands(websocket: WebSocket, subscription: pubsub.Subscription) -> None:
+    """Apply {"subscribe": [post_id, ...], "unsubscribe": [...]} messages until the client goes away"""
+    try:
+        while True:
+            try:
+                message = await websocket.receive_json()
+                add = [f"post:{int(post_id)}" for post_id in message.get("subscribe", [])]
+                remove = [f"post:{int(post_id)}" for post_id in message.get("unsubscribe", [])]
+            except (ValueError, TypeError, AttributeError):
+                await websocket.send_json({"type": "error", "detail": "Expected {\"subscribe\": [...], \"unsubscribe\": [...]}"})
+                continue
+            
+            open_posts = {topic for topic in subscription.topics if topic.startswith("post:")}
+            if len((open_posts - set(remove)) | set(add)) > MAX_BATCH_SIZE:
+                await websocket.send_json({"type": "error", "detail": f"At most {MAX_BATCH_SIZE} open posts"})
+                continue
+            pubsub.broker.update(subscription, add=add, remove=remove)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        pubsub.broker.unsubscribe(subscription, "disconnected")
+
+
+@router.websocket("/ws")
+async def live_socket(
+    websocket: WebSocket,
+    feed: Optional[int] = None,
+    posts: Optional[str] = None
+):
+    """
+    The events of /live/events over a WebSocket, with open posts changed by messages
+    """
+    
+    try:
+        topics = await _topics(feed, posts)
+    except HTTPException as e:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason=e.detail)
+        return
+    
+    await websocket.accept()
+    subscription = pubsub.broker.subscribe(topics)
+    receiver = asyncio.create_task(_receive_commands(websocket, subscription))
+    try:
+        while True:
+            try:
+                events = await subscription.get()
+            except pubsub.SubscriptionClosed as e:
+                if not receiver.done():
+                    await websocket.send_text(pubsub.closed_event(e.reason))
+                    await websocket.close()
+                break
+            await _follow_friendships(subscription, feed, events)
+            for event in events:
+                await websocket.send_text(event)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        receiver.cancel()
+        pubsub.broker.unsubscribe(subscription)
@@ -0,0 +1,64 @@
+"""
+Media routes (uploaded files and image variants under /uploads)
+"""
+
+from pathlib import Path
+
+from fastapi import APIRouter, Request, HTTPException
+from PIL import Image
+
+from app import images
+from app.media import media_server
+from app.upload_utils import find_upload_file
+
+# Mounted under /uploads, outside the API prefix
+router = APIRouter()
+
+
+async def _render_variant(relative_path: str) -> bool:
+    """
+    Render a missing image variant (variants/<variant>/<directory>/<file>.webp)
+    
+    Returns False if the path doesn't name a variant of an existing upload.
+    """
+    
+    parts = relative_path.split("/")
+    if len(parts) < 4 or parts[0] != "variants" or parts[1] not in images.VARIANTS:
+        return False
+    
+    filename = Path("/".join(parts[3:]))
+    if filename.suffix != images.VARIANT_EXTENSION:
+        return False
+    source = find_upload_file(parts[2], filename.with_suffix("").as_posix())
+    if source is None:
+        return False
+    
+    try:
+        await images.ensure_variant(source, parts[1])
+    except (OSError, Image.DecompressionBombError):
+        return False
+    return True
+
+
+@router.api_route("/{relative_path:path}", methods=["GET", "HEAD"])
+async def get_media(
+    relative_path: str,
+    request: Request
+):
+    """
+    Serve an uploaded file or image variant
+    
+    Variants are rendered on first request.
+    """
+    
+    path = media_server.resolve(relative_path)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Not Found")
+    
+    stat_result = media_server.lookup(path)
+    if stat_result is None and await _render_variant(relative_path):
+        stat_result = media_server.lookup(path)
+    if stat_result is None:
+        raise HTTPException(status_code=404, detail="Not Found")
+    
+    return await media_server.serve(request, path, stat_result)
@@ -2,30 +2,50 @@
 Post routes
 """
 
+from collections import Counter
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session, joinedload
-from typing import List
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
 
-from app.database import get_db
-from app.models import Post, User
-from app.schemas import PostCreate, PostUpdate, PostResponse, PostWithComments
+from app import counters, pubsub, ranking, search_index, timeline
+from app.batch import parse_ids, check_batch_size, multi_get_response, insert_rows
+from app.cache import response_cache
+from app.constraints import constraint_error
+from app.database import get_db, get_read_db
+from app.models import Post, User, load_author
+from app.pagination import paginate, page_response
+from app.schemas import PostCreate, PostUpdate, PostResponse, Page, MultiGet, BatchCreated
+from app.upload_utils import attach_upload_urls, release_upload_urls
 
 router = APIRouter()
 
 
-@router.get("/")
-def get_all_posts(
+@router.get("/", response_model=Page[PostResponse] | MultiGet[PostResponse])
+async def get_all_posts(
+    ids: Optional[str] = None,
+    after: Optional[str] = None,
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     """
-    Get all posts with comments, ordered by newest first
+    Get all posts, ordered by newest first, or just the posts in ?ids=1,2,3
     """
     
     try:
-        posts = db.query(Post).options(joinedload(Post.author)).order_by(Post.created_at.desc()).offset(skip).limit(limit).all()
-        return posts
+        if ids is not None:
+            post_ids = parse_ids(ids)
+            query = select(Post).options(load_author(Post.author)).where(Post.id.in_(post_ids))
+            return multi_get_response((await db.scalars(query)).all(), post_ids)
+        
+        query = select(Post).options(load_author(Post.author))
+        query = paginate(query, Post.created_at, Post.id, after=after, skip=skip, limit=limit)
+        posts = (await db.scalars(query)).all()
+        return page_response(posts, limit)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -33,23 +53,28 @@ def get_all_posts(
         )
 
 
-@router.get("/{post_id}")
-def get_post(
+@router.get("/{post_id}", response_model=PostResponse)
+async def get_post(
     post_id: int,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     """
-    Get post by ID with comments
+    Get post by ID
     """
     
     try:
-        post = db.query(Post).options(joinedload(Post.author)).filter(Post.id == post_id).first()
+        key = f"post:{post_id}"
+        cached = response_cache.get(key, db)
+        if cached is not None:
+            return cached
+        
+        post = await db.get(Post, post_id, options=[load_author(Post.author)])
         if not post:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail=f"Post with id {post_id} not found"
             )
-        return post
+        return response_cache.store(key, post, [key, f"user:{post.user_id}"], PostResponse, db)
     except HTTPException:
         raise
     except Exception as e:
@@ -59,27 +84,30 @@ def get_post(
         )
 
 
-@router.get("/user/{user_id}")
-def get_user_posts(
+@router.get("/user/{user_id}", response_model=Page[PostResponse])
+async def get_user_posts(
     user_id: int,
+    after: Optional[str] = None,
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     """
     Get all posts by a specific user
     """
     
     try:
-        user = db.query(User).filter(User.id == user_id).first()
+        user = await db.get(User, user_id)
         if not user:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail=f"User with id {user_id} not found"
             )
         
-        posts = db.query(Post).options(joinedload(Post.author)).filter(Post.user_id == user_id).order_by(Post.created_at.desc()).offset(skip).limit(limit).all()
-        return posts
+        query = select(Post).options(load_author(Post.author)).where(Post.user_id == user_id)
+        query = paginate(query, Post.created_at, Post.id, after=after, skip=skip, limit=limit)
+        posts = (await db.scalars(query)).all()
+        return page_response(posts, limit)
     except HTTPException:
         raise
     except Exception as e:
@@ -89,28 +117,32 @@ def get_user_posts(
         )
 
 
-@router.post("/", status_code=status.HTTP_201_CREATED)
-def create_post(
+@router.post("/", response_model=PostResponse, status_code=status.HTTP_201_CREATED)
+async def create_post(
     post: PostCreate,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Create a new post
     """
     
     try:
-        # Verify user exists
-        user = db.query(User).filter(User.id == post.user_id).first()
-        if not user:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail=f"User with id {post.user_id} not found"
-            )
-        
+        # The author's existence is checked by the foreign key
         db_post = Post(**post.model_dump())
         db.add(db_post)
-        db.commit()
-        db.refresh(db_post)
+        try:
+            await db.flush()
+        except IntegrityError as e:
+            raise await constraint_error(db, e, references=[(User.id, post.user_id, "User")])
+        await attach_upload_urls(db, [post.image_url])
+        await counters.adjust(db, User.post_count, {post.user_id: 1})
+        await db.run_sync(timeline.fan_out_post, db_post)
+        await db.run_sync(search_index.backend.index_post, db_post)
+        await db.commit()
+        response_cache.invalidate("feed:public:new", "feed:public:offset", f"user:{post.user_id}")
+        db_post = await db.get(Post, db_post.id, options=[load_author(Post.author)], populate_existing=True)
+        if pubsub.broker.active:
+            pubsub.publish_posts([db_post], await db.run_sync(timeline.pulled_author_ids, [post.user_id]))
         return db_post
     except HTTPException:
         raise
@@ -121,30 +153,82 @@ def create_post(
         )
 
 
-@router.put("/{post_id}")
-def update_post(
+@router.post("/batch", response_model=BatchCreated[PostResponse], status_code=status.HTTP_201_CREATED)
+async def create_posts(
+    posts: List[PostCreate],
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Create several posts in one request
+    
+    Either every post is created or none is. Created posts are returned in id order.
+    """
+    
+    try:
+        check_batch_size(posts)
+        try:
+            post_ids = await db.run_sync(insert_rows, Post, [post.model_dump() for post in posts])
+        except IntegrityError as e:
+            raise await constraint_error(db, e, references=[(User.id, {post.user_id for post in posts}, "Users")])
+        query = select(Post).options(load_author(Post.author)).where(Post.id.in_(post_ids)).order_by(Post.id)
+        created = (await db.scalars(query)).all()
+        
+        await attach_upload_urls(db, [post.image_url for post in posts])
+        post_counts = Counter(post.user_id for post in posts)
+        await counters.adjust(db, User.post_count, post_counts)
+        await db.run_sync(timeline.fan_out_posts, post_ids)
+        await db.run_sync(search_index.backend.index_posts, created)
+        await db.commit()
+        response_cache.invalidate(
+            "feed:public:new", "feed:public:offset", *(f"user:{user_id}" for user_id in post_counts)
+        )
+        if pubsub.broker.active:
+            pubsub.publish_posts(created, await db.run_sync(timeline.pulled_author_ids, post_counts))
+        return {"items": created, "count": len(created)}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error creating posts: {str(e)}"
+        )
+
+
+@router.put("/{post_id}", response_model=PostResponse)
+async def update_post(
     post_id: int,
     post_update: PostUpdate,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Update a post
     """
     
     try:
-        db_post = db.query(Post).filter(Post.id == post_id).first()
+        update_data = post_update.model_dump(exclude_unset=True)
+        # A replaced image's upload reference moves to the new one
+        old_image_url = None
+        if "image_url" in update_data:
+            old_image_url = await db.scalar(select(Post.image_url).where(Post.id == post_id))
+        if update_data:
+            await db.execute(update(Post).where(Post.id == post_id).values(update_data))
+        
+        # The response embeds the author, which RETURNING can't join, so read it back with one SELECT
+        db_post = await db.get(Post, post_id, options=[load_author(Post.author)], populate_existing=True)
         if not db_post:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail=f"Post with id {post_id} not found"
             )
         
-        update_data = post_update.model_dump(exclude_unset=True)
-        for field, value in update_data.items():
-            setattr(db_post, field, value)
+        if "content" in update_data:
+            await db.run_sync(search_index.backend.index_post, db_post)
+        if old_image_url != db_post.image_url:
+            await release_upload_urls(db, [old_image_url])
+            await attach_upload_urls(db, [db_post.image_url])
         
-        db.commit()
-        db.refresh(db_post)
+        await db.commit()
+        response_cache.invalidate(f"post:{post_id}")
         return db_post
     except HTTPException:
         raise
@@ -156,39 +240,49 @@ def update_post(
 
 
 @router.delete("/{post_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_post(
+async def delete_post(
     post_id: int,
     user_id: int,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Delete a post (own post or admin can delete any post)
     """
     
     try:
-        db_post = db.query(Post).filter(Post.id == post_id).first()
-        if not db_post:
+        # The post and the acting user's admin flag in one query
+        row = (await db.execute(
+            select(Post, select(User.is_admin).where(User.id == user_id).scalar_subquery())
+            .where(Post.id == post_id)
+        )).first()
+        if not row:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail=f"Post with id {post_id} not found"
             )
         
         # Check if user is the post owner or an admin
-        user = db.query(User).filter(User.id == user_id).first()
-        if not user:
+        db_post, is_admin = row
+        if is_admin is None:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="User not found"
             )
         
-        if db_post.user_id != user_id and not user.is_admin:
+        if db_post.user_id != user_id and not is_admin:
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail="Not authorized to delete this post"
             )
         
-        db.delete(db_post)
-        db.commit()
+        await db.run_sync(timeline.retract_post, post_id)
+        await db.run_sync(ranking.retract_post, post_id)
+        await db.run_sync(search_index.backend.remove_posts, [post_id])
+        await counters.adjust(db, User.post_count, {db_post.user_id: -1})
+        await release_upload_urls(db, [db_post.image_url])
+        await db.delete(db_post)
+        await db.commit()
+        response_cache.invalidate(f"post:{post_id}", f"user:{db_post.user_id}", "feed:public:offset")
         return None
     except HTTPException:
         raise
@@ -4,7 +4,7 @@ API Router
 
 from fastapi import APIRouter
 
-from app.routes import friends, users, posts, comments, upload, search, feed
+from app.routes import friends, users, posts, comments, upload, search, feed, live
 
 router = APIRouter()
 
@@ -14,4 +14,5 @@ router.include_router(comments.router, prefix="/comments", tags=["comments"])
 router.include_router(friends.router, prefix="/friends", tags=["friends"])
 router.include_router(upload.router, prefix="/upload", tags=["upload"])
 router.include_router(search.router, prefix="/search", tags=["search"])
-router.include_router(feed.router, prefix="/feed", tags=["feed"])
\ No newline at end of file
+router.include_router(feed.router, prefix="/feed", tags=["feed"])
+router.include_router(live.router, prefix="/live", tags=["live"])
\ No newline at end of file
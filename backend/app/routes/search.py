@@ -2,36 +2,78 @@
 Search routes
 """
 
-from fastapi import APIRouter, Depends, Query, HTTPException
+import asyncio
+
+from fastapi import APIRouter, Depends, Query, HTTPException, Request
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from typing import List, Literal
+from typing import List, Literal, Optional
 
-from app.database import get_db
-from app.models import User, Post
-from app.schemas import UserResponse, PostWithComments
+from app import search_index
+from app.database import get_read_db, read_session_scope
+from app.models import User, Post, load_author
+from app.pagination import encode_rank_cursor, decode_rank_cursor
+from app.schemas import UserResponse, PostResponse, Page, SearchResults
 
 router = APIRouter()
 
 
-@router.get("/users")
-def search_users(
+def _search_page(db: Session, model, search, q: str, limit: int, after: Optional[str] = None, options=()) -> dict:
+    """
+    Run a ranked search and load the matching rows in rank order
+    """
+    position = decode_rank_cursor(after) if after else None
+    hits = search(db, q, limit + 1, position)
+    
+    page_hits = hits[:limit]
+    ids = [row_id for _, row_id in page_hits]
+    query = select(model).options(*options).where(model.id.in_(ids))
+    rows_by_id = {row.id: row for row in db.scalars(query).all()}
+    items = [rows_by_id[row_id] for row_id in ids if row_id in rows_by_id]
+    
+    next_cursor = None
+    if len(hits) > limit:
+        next_cursor = encode_rank_cursor(*page_hits[-1])
+    
+    return {
+        "items": items,
+        "count": len(items),
+        "next_cursor": next_cursor,
+    }
+
+
+def _search_users(db: Session, q: str, limit: int, after: Optional[str] = None) -> dict:
+    return _search_page(db, User, search_index.backend.search_users, q, limit, after)
+
+
+def _search_posts(db: Session, q: str, limit: int, after: Optional[str] = None) -> dict:
+    return _search_page(
+        db, Post, search_index.backend.search_posts, q, limit, after, options=[load_author(Post.author)]
+    )
+
+
+async def _search_in_own_session(request: Request, search, q: str, limit: int) -> dict:
+    # A session can't run two queries at once, so each concurrent sub-query gets its own
+    async with read_session_scope(request) as db:
+        return await db.run_sync(search, q, limit)
+
+
+@router.get("/users", response_model=Page[UserResponse])
+async def search_users(
     q: str = Query(..., min_length=1, description="Search query"),
+    after: Optional[str] = None,
     limit: int = Query(20, ge=1, le=100),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     """
     Search for users by username, full name, or bio
     """
     
     try:
-        search_term = f"%{q}%"
-        users = db.query(User).filter(
-            (User.username.ilike(search_term)) |
-            (User.full_name.ilike(search_term)) |
-            (User.bio.ilike(search_term))
-        ).limit(limit).all()
-        
-        return {"results": users, "count": len(users)}
+        return await db.run_sync(_search_users, q, limit, after)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -39,23 +81,21 @@ def search_users(
         )
 
 
-@router.get("/posts")
-def search_posts(
+@router.get("/posts", response_model=Page[PostResponse])
+async def search_posts(
     q: str = Query(..., min_length=1, description="Search query"),
+    after: Optional[str] = None,
     limit: int = Query(20, ge=1, le=100),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     """
     Search for posts by content
     """
     
     try:
-        search_term = f"%{q}%"
-        posts = db.query(Post).filter(
-            Post.content.ilike(search_term)
-        ).order_by(Post.created_at.desc()).limit(limit).all()
-        
-        return {"results": posts, "count": len(posts)}
+        return await db.run_sync(_search_posts, q, limit, after)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -63,36 +103,28 @@ def search_posts(
         )
 
 
-@router.get("/")
-def search_all(
+@router.get("/", response_model=SearchResults, response_model_exclude_unset=True)
+async def search_all(
+    request: Request,
     q: str = Query(..., min_length=1, description="Search query"),
     type: Literal["users", "posts", "all"] = Query("all", description="Type of search"),
-    limit: int = Query(20, ge=1, le=100),
-    db: Session = Depends(get_db)
+    limit: int = Query(20, ge=1, le=100)
 ):
     """
     Search for users and/or posts
+    
+    Each result set carries its own next_cursor for /search/users or /search/posts.
     """
     
     try:
-        search_term = f"%{q}%"
-        results = {}
-        
+        searches = {}
         if type in ["users", "all"]:
-            users = db.query(User).filter(
-                (User.username.ilike(search_term)) |
-                (User.full_name.ilike(search_term)) |
-                (User.bio.ilike(search_term))
-            ).limit(limit).all()
-            results["users"] = users
-        
+            searches["users"] = _search_in_own_session(request, _search_users, q, limit)
         if type in ["posts", "all"]:
-            posts = db.query(Post).filter(
-                Post.content.ilike(search_term)
-            ).order_by(Post.created_at.desc()).limit(limit).all()
-            results["posts"] = posts
+            searches["posts"] = _search_in_own_session(request, _search_posts, q, limit)
         
-        return results
+        pages = await asyncio.gather(*searches.values())
+        return dict(zip(searches.keys(), pages))
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -2,26 +2,67 @@
 File upload routes
 """
 
-from fastapi import APIRouter, UploadFile, File, HTTPException
+from pathlib import Path
 
-from app.upload_utils import save_upload_file, delete_upload_file
+from fastapi import APIRouter, Depends, UploadFile, File, HTTPException
+from PIL import Image
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import images, jobs
+from app.config import settings
+from app.database import get_db
+from app.schemas import UploadResponse
+from app.upload_utils import (
+    save_upload_file,
+    delete_upload_file,
+    PROFILE_PICTURES_DIR,
+    POST_IMAGES_DIR,
+)
 
 router = APIRouter()
 
 
-@router.post("/profile-picture")
+async def _create_variants(db: AsyncSession, filename: str, upload_type: str, file_path: Path) -> dict:
+    """
+    Render the size variants of a new upload (or queue them when lazy)
+    """
+    
+    if not settings.IMAGE_VARIANTS_EAGER:
+        path = file_path.relative_to(images.UPLOAD_DIR).as_posix()
+        await db.run_sync(jobs.enqueue, "images.render_variants", {"path": path}, key=f"variants:{path}")
+        await db.commit()
+        return images.variant_urls(file_path)
+    
+    try:
+        return await images.create_variants(file_path)
+    except (OSError, Image.DecompressionBombError):
+        # Unreadable or truncated image (PIL raises OSError subclasses for both)
+        await delete_upload_file(db, filename, upload_type=upload_type)
+        await db.commit()
+        raise HTTPException(
+            status_code=400,
+            detail="File is not a valid image"
+        )
+
+
+@router.post("/profile-picture", response_model=UploadResponse)
 async def upload_profile_picture(
-    file: UploadFile = File(...)
+    file: UploadFile = File(...),
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Upload a profile picture
+    
+    Identical files are stored once and get the same URL.
     """
     
     try:
-        filename = await save_upload_file(file, upload_type="profile")
+        filename = await save_upload_file(db, file, upload_type="profile")
+        variants = await _create_variants(db, filename, "profile", PROFILE_PICTURES_DIR / filename)
         return {
             "filename": filename,
-            "file_url": f"/uploads/profile_pictures/{filename}"
+            "file_url": f"/uploads/profile_pictures/{filename}",
+            "variants": variants
         }
     except HTTPException:
         raise
@@ -32,19 +73,24 @@ async def upload_profile_picture(
         )
 
 
-@router.post("/post-image")
+@router.post("/post-image", response_model=UploadResponse)
 async def upload_post_image(
-    file: UploadFile = File(...)
+    file: UploadFile = File(...),
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Upload a post image
+    
+    Identical files are stored once and get the same URL.
     """
     
     try:
-        filename = await save_upload_file(file, upload_type="post")
+        filename = await save_upload_file(db, file, upload_type="post")
+        variants = await _create_variants(db, filename, "post", POST_IMAGES_DIR / filename)
         return {
             "filename": filename,
-            "file_url": f"/uploads/post_images/{filename}"
+            "file_url": f"/uploads/post_images/{filename}",
+            "variants": variants
         }
     except HTTPException:
         raise
@@ -3,29 +3,55 @@ User routes
 """
 
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from typing import List
+from sqlalchemy import select, func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased, selectinload
+from typing import List, Optional
 
-from app.database import get_db
-from app.models import User
-from app.schemas import UserCreate, UserUpdate, UserResponse, UserWithFriends
+from app import counters, friend_graph, pubsub, ranking, search_index, suggestions, timeline
+from app.batch import parse_ids, multi_get_response
+from app.cache import response_cache
+from app.constraints import constraint_error, update_row
+from app.database import get_db, get_read_db
+from app.models import User, Post, Comment, friends
+from app.schemas import UserCreate, UserUpdate, UserResponse, Page, MultiGet
+from app.pagination import paginate, page_response
+from app.upload_utils import attach_upload_urls, release_upload_urls
 
 router = APIRouter()
 
+UNIQUE_MESSAGES = {
+    User.username: "Username already exists",
+    User.email: "Email already exists",
+}
 
-@router.get("/")
-def get_all_users(
+
+@router.get("/", response_model=Page[UserResponse] | MultiGet[UserResponse])
+async def get_all_users(
+    ids: Optional[str] = None,
+    after: Optional[str] = None,
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     """
-    Get all users
+    Get all users, or just the users in ?ids=1,2,3
     """
     
     try:
-        users = db.query(User).offset(skip).limit(limit).all()
-        return users
+        if ids is not None:
+            user_ids = parse_ids(ids)
+            users = (await db.scalars(select(User).where(User.id.in_(user_ids)))).all()
+            return multi_get_response(users, user_ids)
+        
+        query = paginate(
+            select(User), User.created_at, User.id, after=after, skip=skip, limit=limit, descending=False
+        )
+        users = (await db.scalars(query)).all()
+        return page_response(users, limit)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -33,23 +59,28 @@ def get_all_users(
         )
 
 
-@router.get("/{user_id}")
-def get_user(
+@router.get("/{user_id}", response_model=UserResponse)
+async def get_user(
     user_id: int,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     """
     Get user by ID with friends list
     """
     
     try:
-        user = db.query(User).filter(User.id == user_id).first()
+        key = f"user:{user_id}"
+        cached = response_cache.get(key, db)
+        if cached is not None:
+            return cached
+        
+        user = await db.get(User, user_id)
         if not user:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail=f"User with id {user_id} not found"
             )
-        return user
+        return response_cache.store(key, user, [key], UserResponse, db)
     except HTTPException:
         raise
     except Exception as e:
@@ -59,40 +90,29 @@ def get_user(
         )
 
 
-@router.post("/", status_code=status.HTTP_201_CREATED)
-def create_user(
+@router.post("/", response_model=UserResponse, status_code=status.HTTP_201_CREATED)
+async def create_user(
     user: UserCreate,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Create a new user
     """
     
     try:
-        # Check if username already exists
-        existing_user = db.query(User).filter(User.username == user.username).first()
-        if existing_user:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Username already exists"
-            )
-        
-        # Check if email already exists
-        existing_email = db.query(User).filter(User.email == user.email).first()
-        if existing_email:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Email already exists"
-            )
-        
         # Create user with default profile picture
         user_data = user.model_dump()
         user_data['profile_picture'] = "/uploads/profile_pictures/default.jpg"
         
+        # Username and email uniqueness is enforced by their unique indexes
         db_user = User(**user_data)
         db.add(db_user)
-        db.commit()
-        db.refresh(db_user)
+        try:
+            await db.flush()
+        except IntegrityError as e:
+            raise await constraint_error(db, e, unique=UNIQUE_MESSAGES)
+        await db.run_sync(search_index.backend.index_user, db_user)
+        await db.commit()
         return db_user
     except HTTPException:
         raise
@@ -103,55 +123,40 @@ def create_user(
         )
 
 
-@router.put("/{user_id}")
-def update_user(
+@router.put("/{user_id}", response_model=UserResponse)
+async def update_user(
     user_id: int,
     user_update: UserUpdate,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Update user information
     """
     
     try:
-        db_user = db.query(User).filter(User.id == user_id).first()
+        update_data = user_update.model_dump(exclude_unset=True)
+        # A replaced profile picture's upload reference moves to the new one
+        old_picture = None
+        if "profile_picture" in update_data:
+            old_picture = await db.scalar(select(User.profile_picture).where(User.id == user_id))
+        try:
+            db_user = await db.run_sync(update_row, User, user_id, update_data)
+        except IntegrityError as e:
+            raise await constraint_error(db, e, unique=UNIQUE_MESSAGES)
         if not db_user:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail=f"User with id {user_id} not found"
             )
         
-        update_data = user_update.model_dump(exclude_unset=True)
-        
-        # Check username uniqueness if being updated
-        if "username" in update_data:
-            existing = db.query(User).filter(
-                User.username == update_data["username"],
-                User.id != user_id
-            ).first()
-            if existing:
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail="Username already exists"
-                )
-        
-        # Check email uniqueness if being updated
-        if "email" in update_data:
-            existing = db.query(User).filter(
-                User.email == update_data["email"],
-                User.id != user_id
-            ).first()
-            if existing:
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail="Email already exists"
-                )
-        
-        for field, value in update_data.items():
-            setattr(db_user, field, value)
+        if update_data.keys() & search_index.USER_FIELD_WEIGHTS.keys():
+            await db.run_sync(search_index.backend.index_user, db_user)
+        if old_picture != db_user.profile_picture:
+            await release_upload_urls(db, [old_picture])
+            await attach_upload_urls(db, [db_user.profile_picture])
         
-        db.commit()
-        db.refresh(db_user)
+        await db.commit()
+        response_cache.invalidate(f"user:{user_id}")
         return db_user
     except HTTPException:
         raise
@@ -163,39 +168,76 @@ def update_user(
 
 
 @router.delete("/{user_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_user(
+async def delete_user(
     user_id: int,
     current_user_id: int,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Delete a user (own account or admin can delete any user)
     """
     
     try:
-        db_user = db.query(User).filter(User.id == user_id).first()
-        if not db_user:
+        # The user and the acting user's admin flag in one query; what the
+        # delete cascades through is loaded up front instead of per post
+        acting_user = aliased(User)
+        row = (await db.execute(
+            select(User, select(acting_user.is_admin).where(acting_user.id == current_user_id).scalar_subquery())
+            .where(User.id == user_id)
+            .options(selectinload(User.posts).selectinload(Post.comments), selectinload(User.comments))
+        )).first()
+        if not row:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail=f"User with id {user_id} not found"
             )
         
-        # Check if user is deleting their own account or is an admin
-        current_user = db.query(User).filter(User.id == current_user_id).first()
-        if not current_user:
+        db_user, is_admin = row
+        if is_admin is None:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Current user not found"
             )
         
-        if user_id != current_user_id and not current_user.is_admin:
+        if user_id != current_user_id and not is_admin:
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail="Not authorized to delete this user"
             )
         
-        db.delete(db_user)
-        db.commit()
+        await db.run_sync(timeline.purge_user, user_id)
+        await db.run_sync(ranking.purge_user, user_id)
+        post_ids = (await db.scalars(select(Post.id).where(Post.user_id == user_id))).all()
+        await db.run_sync(search_index.backend.remove_posts, post_ids)
+        await db.run_sync(search_index.backend.remove_user, user_id)
+        
+        # Their friendships and their comments on other users' posts go with them
+        friend_ids = (await db.scalars(select(friends.c.friend_id).where(friends.c.user_id == user_id))).all()
+        commented = (await db.execute(
+            select(Comment.post_id, func.count())
+            .join(Post, Post.id == Comment.post_id)
+            .where(Comment.user_id == user_id, Post.user_id != user_id)
+            .group_by(Comment.post_id)
+        )).all()
+        await counters.adjust(db, User.friend_count, {friend_id: -1 for friend_id in friend_ids})
+        await counters.adjust(db, Post.comment_count, {post_id: -count for post_id, count in commented})
+        await release_upload_urls(db, [db_user.profile_picture] + [post.image_url for post in db_user.posts])
+        
+        await db.delete(db_user)
+        # Losing them can move friends out of pull mode; their posts are then pushed to their other friends
+        await db.flush()
+        switched = await db.run_sync(timeline.update_fanout_modes, friend_ids)
+        
+        await db.commit()
+        friend_graph.graph.remove_user(user_id)
+        pubsub.publish_friendships_changed([(user_id, friend_id) for friend_id in friend_ids], switched)
+        suggestions.suggestion_index.discard(user_id)
+        # Their posts and comments are gone too, which shifts every offset page
+        response_cache.invalidate(
+            f"user:{user_id}", f"friends:{user_id}", "feed:public:offset",
+            *(f"user:{friend_id}" for friend_id in friend_ids),
+            *(f"post:{post_id}" for post_id, _ in commented)
+        )
         return None
     except HTTPException:
         raise
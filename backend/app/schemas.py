@@ -3,9 +3,11 @@ Social networking app schemas
 """
 
 from datetime import datetime
-from typing import Optional, List
+from typing import Generic, Optional, List, TypeVar
 from pydantic import BaseModel, EmailStr, ConfigDict, Field
 
+T = TypeVar("T")
+
 
 # User Schemas
 class UserBase(BaseModel):
@@ -35,15 +37,29 @@ class UserUpdate(BaseModel):
 class UserResponse(UserBase):
     """Schema for user responses"""
     id: int
+    # Checked when the user is written; re-validating every address on the way out is slow
+    email: str
+    post_count: int = 0
+    friend_count: int = 0
     created_at: datetime
+    
+    model_config = ConfigDict(from_attributes=True)
+
 
+class AuthorSummary(BaseModel):
+    """Schema for the author embedded in posts and comments"""
+    id: int
+    username: str
+    full_name: str
+    profile_picture: Optional[str] = None
+    
     model_config = ConfigDict(from_attributes=True)
 
 
 class UserWithFriends(UserResponse):
     """Schema for user with friends list"""
     friends: List['UserResponse'] = []
-
+    
     model_config = ConfigDict(from_attributes=True)
 
 
@@ -69,10 +85,11 @@ class PostResponse(PostBase):
     """Schema for post responses"""
     id: int
     user_id: int
+    comment_count: int = 0
     created_at: datetime
     updated_at: datetime
-    author: UserResponse
-
+    author: AuthorSummary
+    
     model_config = ConfigDict(from_attributes=True)
 
 
@@ -94,15 +111,15 @@ class CommentResponse(CommentBase):
     user_id: int
     post_id: int
     created_at: datetime
-    author: UserResponse
-
+    author: AuthorSummary
+    
     model_config = ConfigDict(from_attributes=True)
 
 
 class PostWithComments(PostResponse):
     """Schema for post with comments"""
     comments: List[CommentResponse] = []
-
+    
     model_config = ConfigDict(from_attributes=True)
 
 
@@ -111,3 +128,56 @@ class FriendRequest(BaseModel):
     """Schema for friend requests"""
     user_id: int = Field(..., description="User ID initiating friendship")
     friend_id: int = Field(..., description="User ID to befriend")
+
+
+class FriendImportResult(BaseModel):
+    """Schema for the outcome of a bulk friend import"""
+    added: int
+    existing: int
+
+
+class FriendSuggestion(BaseModel):
+    """Schema for a suggested friend"""
+    user: UserResponse
+    mutual_friends: int
+    co_comments: int
+
+
+# List Schemas
+class Page(BaseModel, Generic[T]):
+    """One page of a cursor-paginated list"""
+    items: List[T]
+    count: int
+    next_cursor: Optional[str]
+
+
+class MultiGet(BaseModel, Generic[T]):
+    """Rows fetched by id; ids with no row are listed in missing"""
+    items: List[T]
+    count: int
+    missing: List[int]
+
+
+class BatchCreated(BaseModel, Generic[T]):
+    """Rows created by a batch request, in id order"""
+    items: List[T]
+    count: int
+
+
+class SearchResults(BaseModel):
+    """Schema for combined search results"""
+    users: Optional[Page[UserResponse]] = None
+    posts: Optional[Page[PostResponse]] = None
+
+
+# Other Schemas
+class MessageResponse(BaseModel):
+    """Schema for plain confirmation messages"""
+    message: str
+
+
+class UploadResponse(BaseModel):
+    """Schema for uploaded files"""
+    filename: str
+    file_url: str
+    variants: dict[str, str]
@@ -0,0 +1,428 @@
+"""
+Full-text search backends
+
+Posts and users are indexed at write time and searched with BM25-style
+relevance ranking instead of leading-wildcard ILIKE scans. The backend is
+picked from SEARCH_BACKEND ("auto" chooses by database dialect):
+
+- fts5: SQLite FTS5 virtual tables kept in the same transaction as the write
+- mysql: InnoDB FULLTEXT indexes, which MySQL maintains itself
+- memory: a pure-Python inverted index, rebuilt from the database at startup
+  and changed only once the writing transaction commits
+
+Every search returns (score, id) pairs ordered by score then id, both
+descending, so results can be paged with a (score, id) keyset cursor.
+"""
+
+import math
+import re
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Iterable, Optional
+
+from sqlalchemy import event as orm_event, text, select
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.models import Post, User
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+# Relative weight of each user field when ranking user matches
+USER_FIELD_WEIGHTS = {"username": 3.0, "full_name": 2.0, "bio": 1.0}
+
+Hit = tuple[float, int]
+
+# Session.info key for in-memory index changes waiting on the transaction
+_ON_COMMIT = "search_on_commit"
+
+
+def tokenize(value: Optional[str]) -> list[str]:
+    """Split text into lowercase search terms"""
+    return TOKEN_RE.findall(value.lower()) if value else []
+
+
+class SearchBackend:
+    """Interface for full-text search backends"""
+    
+    name = "base"
+    
+    def setup(self, db: Session) -> None:
+        """Create index structures and index existing rows if needed"""
+    
+    def index_post(self, db: Session, post: Post) -> None:
+        """Add or refresh a post in the index"""
+    
+    def index_posts(self, db: Session, posts: Iterable[Post]) -> None:
+        """Add or refresh several posts in the index"""
+        for post in posts:
+            self.index_post(db, post)
+    
+    def remove_posts(self, db: Session, post_ids: Iterable[int]) -> None:
+        """Drop posts from the index"""
+    
+    def index_user(self, db: Session, user: User) -> None:
+        """Add or refresh a user in the index"""
+    
+    def remove_user(self, db: Session, user_id: int) -> None:
+        """Drop a user from the index"""
+    
+    def search_posts(self, db: Session, q: str, limit: int, after: Optional[Hit] = None) -> list[Hit]:
+        raise NotImplementedError
+    
+    def search_users(self, db: Session, q: str, limit: int, after: Optional[Hit] = None) -> list[Hit]:
+        raise NotImplementedError
+
+
+class SQLiteFTS5Backend(SearchBackend):
+    """SQLite FTS5 virtual tables ranked with the built-in bm25()"""
+    
+    name = "fts5"
+    
+    def setup(self, db: Session) -> None:
+        exists = db.execute(
+            text("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'posts_fts'")
+        ).first()
+        if exists:
+            return
+        
+        db.execute(text("CREATE VIRTUAL TABLE posts_fts USING fts5(content, prefix='2 3')"))
+        db.execute(text(
+            "CREATE VIRTUAL TABLE users_fts USING fts5(username, full_name, bio, prefix='2 3')"
+        ))
+        db.execute(text("INSERT INTO posts_fts(rowid, content) SELECT id, content FROM posts"))
+        db.execute(text(
+            "INSERT INTO users_fts(rowid, username, full_name, bio) "
+            "SELECT id, username, full_name, coalesce(bio, '') FROM users"
+        ))
+        db.commit()
+    
+    def index_post(self, db: Session, post: Post) -> None:
+        db.execute(text("DELETE FROM posts_fts WHERE rowid = :id"), {"id": post.id})
+        db.execute(
+            text("INSERT INTO posts_fts(rowid, content) VALUES (:id, :content)"),
+            {"id": post.id, "content": post.content},
+        )
+    
+    def index_posts(self, db: Session, posts: Iterable[Post]) -> None:
+        rows = [{"id": post.id, "content": post.content} for post in posts]
+        db.execute(text("DELETE FROM posts_fts WHERE rowid = :id"), [{"id": row["id"]} for row in rows])
+        db.execute(text("INSERT INTO posts_fts(rowid, content) VALUES (:id, :content)"), rows)
+    
+    def remove_posts(self, db: Session, post_ids: Iterable[int]) -> None:
+        rows = [{"id": post_id} for post_id in post_ids]
+        if rows:
+            db.execute(text("DELETE FROM posts_fts WHERE rowid = :id"), rows)
+    
+    def index_user(self, db: Session, user: User) -> None:
+        db.execute(text("DELETE FROM users_fts WHERE rowid = :id"), {"id": user.id})
+        db.execute(
+            text(
+                "INSERT INTO users_fts(rowid, username, full_name, bio) "
+                "VALUES (:id, :username, :full_name, :bio)"
+            ),
+            {"id": user.id, "username": user.username, "full_name": user.full_name, "bio": user.bio or ""},
+        )
+    
+    def remove_user(self, db: Session, user_id: int) -> None:
+        db.execute(text("DELETE FROM users_fts WHERE rowid = :id"), {"id": user_id})
+    
+    @staticmethod
+    def _match_query(q: str) -> Optional[str]:
+        # Quote every term so user input can't inject FTS5 syntax; prefix-match each one
+        terms = tokenize(q)
+        return " ".join(f'"{term}"*' for term in terms) if terms else None
+    
+    def _search(self, db: Session, table: str, rank: str, q: str, limit: int, after: Optional[Hit]) -> list[Hit]:
+        match = self._match_query(q)
+        if not match:
+            return []
+        
+        params = {"match": match, "limit": limit}
+        keyset = ""
+        if after:
+            keyset = "WHERE score < :score OR (score = :score AND id < :id)"
+            params.update(score=after[0], id=after[1])
+        
+        rows = db.execute(
+            text(
+                f"SELECT score, id FROM ("
+                f"  SELECT -{rank} AS score, rowid AS id FROM {table} WHERE {table} MATCH :match"
+                f") {keyset} ORDER BY score DESC, id DESC LIMIT :limit"
+            ),
+            params,
+        ).all()
+        return [(score, row_id) for score, row_id in rows]
+    
+    def search_posts(self, db: Session, q: str, limit: int, after: Optional[Hit] = None) -> list[Hit]:
+        return self._search(db, "posts_fts", "bm25(posts_fts)", q, limit, after)
+    
+    def search_users(self, db: Session, q: str, limit: int, after: Optional[Hit] = None) -> list[Hit]:
+        weights = ", ".join(str(weight) for weight in USER_FIELD_WEIGHTS.values())
+        return self._search(db, "users_fts", f"bm25(users_fts, {weights})", q, limit, after)
+
+
+class MySQLFulltextBackend(SearchBackend):
+    """
+    InnoDB FULLTEXT indexes
+    
+    InnoDB keeps the indexes current on every write, so the index_* hooks are
+    no-ops. Matching uses boolean mode (all terms, prefix match); ranking uses
+    the natural-language relevance score.
+    """
+    
+    name = "mysql"
+    
+    INDEXES = {
+        "posts": ("ft_posts_content", "content"),
+        "users": ("ft_users_text", "username, full_name, bio"),
+    }
+    
+    def setup(self, db: Session) -> None:
+        for table, (index_name, columns) in self.INDEXES.items():
+            exists = db.execute(
+                text(
+                    "SELECT 1 FROM information_schema.statistics "
+                    "WHERE table_schema = DATABASE() AND table_name = :table AND index_name = :index"
+                ),
+                {"table": table, "index": index_name},
+            ).first()
+            if not exists:
+                db.execute(text(f"ALTER TABLE {table} ADD FULLTEXT INDEX {index_name} ({columns})"))
+        db.commit()
+    
+    def _search(self, db: Session, table: str, columns: str, q: str, limit: int, after: Optional[Hit]) -> list[Hit]:
+        terms = tokenize(q)
+        if not terms:
+            return []
+        
+        params = {
+            "boolean": " ".join(f"+{term}*" for term in terms),
+            "natural": " ".join(terms),
+            "limit": limit,
+        }
+        keyset = ""
+        if after:
+            keyset = "WHERE score < :score OR (score = :score AND id < :id)"
+            params.update(score=after[0], id=after[1])
+        
+        rows = db.execute(
+            text(
+                f"SELECT score, id FROM ("
+                f"  SELECT MATCH({columns}) AGAINST (:natural) AS score, id FROM {table}"
+                f"  WHERE MATCH({columns}) AGAINST (:boolean IN BOOLEAN MODE)"
+                f") AS hits {keyset} ORDER BY score DESC, id DESC LIMIT :limit"
+            ),
+            params,
+        ).all()
+        return [(float(score), row_id) for score, row_id in rows]
+    
+    def search_posts(self, db: Session, q: str, limit: int, after: Optional[Hit] = None) -> list[Hit]:
+        return self._search(db, "posts", "content", q, limit, after)
+    
+    def search_users(self, db: Session, q: str, limit: int, after: Optional[Hit] = None) -> list[Hit]:
+        return self._search(db, "users", "username, full_name, bio", q, limit, after)
+
+
+class InvertedIndex:
+    """In-process inverted index with Okapi BM25 scoring"""
+    
+    K1 = 1.2
+    B = 0.75
+    
+    def __init__(self):
+        self.postings: dict[str, dict[int, float]] = defaultdict(dict)
+        self.doc_terms: dict[int, dict[str, float]] = {}
+        self.doc_lengths: dict[int, float] = {}
+        self.total_length = 0.0
+        self._vocabulary: list[str] = []
+        self._vocabulary_dirty = False
+    
+    def add(self, doc_id: int, term_weights: dict[str, float]) -> None:
+        self.remove(doc_id)
+        for term, weight in term_weights.items():
+            self.postings[term][doc_id] = weight
+        length = sum(term_weights.values())
+        self.doc_terms[doc_id] = term_weights
+        self.doc_lengths[doc_id] = length
+        self.total_length += length
+        self._vocabulary_dirty = True
+    
+    def remove(self, doc_id: int) -> None:
+        term_weights = self.doc_terms.pop(doc_id, None)
+        if term_weights is None:
+            return
+        for term in term_weights:
+            docs = self.postings[term]
+            docs.pop(doc_id, None)
+            if not docs:
+                del self.postings[term]
+        self.total_length -= self.doc_lengths.pop(doc_id)
+        self._vocabulary_dirty = True
+    
+    def _expand(self, prefix: str) -> list[str]:
+        # Sorted vocabulary is rebuilt lazily so writes stay O(terms)
+        if self._vocabulary_dirty:
+            self._vocabulary = sorted(self.postings)
+            self._vocabulary_dirty = False
+        start = bisect_left(self._vocabulary, prefix)
+        terms = []
+        for term in self._vocabulary[start:]:
+            if not term.startswith(prefix):
+                break
+            terms.append(term)
+        return terms
+    
+    def search(self, terms: list[str], limit: int, after: Optional[Hit] = None) -> list[Hit]:
+        if not terms or not self.doc_lengths:
+            return []
+        
+        doc_count = len(self.doc_lengths)
+        average_length = self.total_length / doc_count
+        scores: Optional[dict[int, float]] = None
+        
+        # Every query term must match (as a prefix); scores add up across terms
+        for term in terms:
+            term_scores: dict[int, float] = defaultdict(float)
+            for expanded in self._expand(term):
+                docs = self.postings[expanded]
+                idf = math.log(1 + (doc_count - len(docs) + 0.5) / (len(docs) + 0.5))
+                for doc_id, tf in docs.items():
+                    norm = self.K1 * (1 - self.B + self.B * self.doc_lengths[doc_id] / average_length)
+                    term_scores[doc_id] += idf * tf * (self.K1 + 1) / (tf + norm)
+            if scores is None:
+                scores = term_scores
+            else:
+                scores = {doc_id: score + term_scores[doc_id] for doc_id, score in scores.items() if doc_id in term_scores}
+            if not scores:
+                return []
+        
+        hits = ((score, doc_id) for doc_id, score in scores.items())
+        if after:
+            hits = (hit for hit in hits if hit < after)
+        return sorted(hits, reverse=True)[:limit]
+
+
+class InMemoryBackend(SearchBackend):
+    """Pure-Python fallback for databases without a native full-text engine"""
+    
+    name = "memory"
+    
+    def __init__(self):
+        self.posts = InvertedIndex()
+        self.users = InvertedIndex()
+        self.lock = threading.Lock()
+    
+    @staticmethod
+    def _post_terms(post: Post) -> dict[str, float]:
+        weights: dict[str, float] = defaultdict(float)
+        for term in tokenize(post.content):
+            weights[term] += 1.0
+        return weights
+    
+    @staticmethod
+    def _user_terms(user: User) -> dict[str, float]:
+        weights: dict[str, float] = defaultdict(float)
+        for field, weight in USER_FIELD_WEIGHTS.items():
+            for term in tokenize(getattr(user, field)):
+                weights[term] += weight
+        return weights
+    
+    def setup(self, db: Session) -> None:
+        posts = InvertedIndex()
+        for post in db.execute(select(Post.id, Post.content)).all():
+            posts.add(post.id, self._post_terms(post))
+        users = InvertedIndex()
+        for user in db.execute(select(User.id, User.username, User.full_name, User.bio)).all():
+            users.add(user.id, self._user_terms(user))
+        with self.lock:
+            self.posts, self.users = posts, users
+    
+    def _on_commit(self, db: Session, change) -> None:
+        # Terms are read from the rows now; they expire when the transaction commits
+        db.info.setdefault(_ON_COMMIT, []).append((self, change))
+    
+    def index_post(self, db: Session, post: Post) -> None:
+        post_id, terms = post.id, self._post_terms(post)
+        self._on_commit(db, lambda: self.posts.add(post_id, terms))
+    
+    def remove_posts(self, db: Session, post_ids: Iterable[int]) -> None:
+        post_ids = list(post_ids)
+        
+        def remove():
+            for post_id in post_ids:
+                self.posts.remove(post_id)
+        self._on_commit(db, remove)
+    
+    def index_user(self, db: Session, user: User) -> None:
+        user_id, terms = user.id, self._user_terms(user)
+        self._on_commit(db, lambda: self.users.add(user_id, terms))
+    
+    def remove_user(self, db: Session, user_id: int) -> None:
+        self._on_commit(db, lambda: self.users.remove(user_id))
+    
+    def search_posts(self, db: Session, q: str, limit: int, after: Optional[Hit] = None) -> list[Hit]:
+        with self.lock:
+            return self.posts.search(tokenize(q), limit, after)
+    
+    def search_users(self, db: Session, q: str, limit: int, after: Optional[Hit] = None) -> list[Hit]:
+        with self.lock:
+            return self.users.search(tokenize(q), limit, after)
+
+
+@orm_event.listens_for(Session, "after_commit")
+def _apply_on_commit(session: Session) -> None:
+    for memory_backend, change in session.info.pop(_ON_COMMIT, ()):
+        with memory_backend.lock:
+            change()
+
+
+@orm_event.listens_for(Session, "after_rollback")
+def _forget_on_rollback(session: Session) -> None:
+    session.info.pop(_ON_COMMIT, None)
+
+
+def _fts5_available(db: Session) -> bool:
+    try:
+        db.execute(text("CREATE VIRTUAL TABLE temp.fts5_probe USING fts5(x)"))
+        db.execute(text("DROP TABLE temp.fts5_probe"))
+        return True
+    except Exception:
+        db.rollback()
+        return False
+
+
+def create_backend(db: Session) -> SearchBackend:
+    """Pick a search backend from settings and the database dialect"""
+    choice = settings.SEARCH_BACKEND
+    dialect = db.get_bind().dialect.name
+    
+    if choice == "auto":
+        if dialect == "sqlite" and _fts5_available(db):
+            choice = "fts5"
+        elif dialect == "mysql":
+            choice = "mysql"
+        else:
+            choice = "memory"
+    
+    backends = {
+        "fts5": SQLiteFTS5Backend,
+        "mysql": MySQLFulltextBackend,
+        "memory": InMemoryBackend,
+    }
+    if choice not in backends:
+        raise ValueError(f"Unknown SEARCH_BACKEND: {choice}")
+    return backends[choice]()
+
+
+# Active backend, set up at application startup
+backend: SearchBackend = InMemoryBackend()
+
+
+def init_search(db: Session) -> SearchBackend:
+    """Select and set up the search backend"""
+    global backend
+    backend = create_backend(db)
+    backend.setup(db)
+    return backend
@@ -0,0 +1,257 @@
+"""
+Friend suggestions ("people you may know")
+
+Candidates are friends of friends, ranked by mutual friend count and then by
+the number of posts both users commented on. Mutual counts come from the
+in-memory friend graph: a user's friends' rows are concatenated and counted
+in one pass, with no per-candidate queries.
+
+Each user's ranked list (the top SUGGESTIONS_KEPT candidates) is kept in a
+bounded LRU, so requests are a slice of a stored list. Lists are per process
+and can't hold every user, so a list is computed on its user's first
+request (on the threadpool) and dropped when evicted; that request pays the
+O(sum of friend degrees) ranking.
+
+Friend writes keep stored lists current without putting that cost back on a
+request. The two users' lists are re-ranked by a background task in the
+process that stores them, and until that finishes they are served with the
+users' current friends filtered out. Each of their friends' lists gets one
+candidate (the other user) re-scored with a single intersection. Lists also
+expire after SUGGESTION_MAX_AGE_SECONDS, which picks up new co-comments and
+candidates pushed out of a full list.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from typing import Optional
+
+import numpy as np
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select, func, desc
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app import friend_graph
+from app.config import settings
+from app.database import session_scope
+from app.models import Comment
+
+logger = logging.getLogger(__name__)
+
+# Candidates stored per user; requests are served from a prefix of this list
+SUGGESTIONS_KEPT = 50
+
+# How many of the user's most recently commented posts count for co-commenting
+CO_COMMENT_RECENT_POSTS = 200
+
+# (candidate_id, mutual_friends, co_comments)
+Suggestion = tuple[int, int, int]
+
+
+def _rank_key(suggestion: Suggestion):
+    candidate_id, mutual_friends, co_comments = suggestion
+    return (-mutual_friends, -co_comments, candidate_id)
+
+
+def co_commenters(db: Session, user_id: int, limit: int = SUGGESTIONS_KEPT) -> dict[int, int]:
+    """Users who commented on the same posts as user_id, with the number of shared posts"""
+    recent_posts = (
+        select(Comment.post_id)
+        .where(Comment.user_id == user_id)
+        .group_by(Comment.post_id)
+        .order_by(func.max(Comment.created_at).desc())
+        .limit(CO_COMMENT_RECENT_POSTS)
+        .subquery()
+    )
+    shared = func.count(func.distinct(Comment.post_id)).label("shared")
+    query = (
+        select(Comment.user_id, shared)
+        .join(recent_posts, recent_posts.c.post_id == Comment.post_id)
+        .where(Comment.user_id != user_id)
+        .group_by(Comment.user_id)
+        .order_by(desc("shared"))
+        .limit(limit)
+    )
+    return {candidate_id: count for candidate_id, count in db.execute(query).all()}
+
+
+def rank_candidates(user_id: int, co_comments: dict[int, int]) -> list[Suggestion]:
+    """Rank friends of friends (and co-commenters) for a user"""
+    graph = friend_graph.graph
+    own = graph.friend_ids(user_id)
+    
+    rows = [graph.friend_ids(friend_id) for friend_id in own.tolist()]
+    if rows:
+        candidates, mutual = np.unique(np.concatenate(rows), return_counts=True)
+    else:
+        candidates, mutual = friend_graph.EMPTY, friend_graph.EMPTY
+    
+    excluded = np.append(own, user_id)
+    keep = ~np.isin(candidates, excluded)
+    candidates, mutual = candidates[keep], mutual[keep]
+    if len(candidates) > SUGGESTIONS_KEPT:
+        top = np.argpartition(-mutual, SUGGESTIONS_KEPT - 1)[:SUGGESTIONS_KEPT]
+        candidates, mutual = candidates[top], mutual[top]
+    
+    scores = {candidate_id: [count, 0] for candidate_id, count in zip(candidates.tolist(), mutual.tolist())}
+    for candidate_id, count in co_comments.items():
+        if candidate_id != user_id and not graph.are_friends(user_id, candidate_id):
+            scores.setdefault(candidate_id, [0, 0])[1] = count
+    
+    ranked = sorted(((candidate_id, m, c) for candidate_id, (m, c) in scores.items()), key=_rank_key)
+    return ranked[:SUGGESTIONS_KEPT]
+
+
+class SuggestionIndex:
+    """Bounded LRU of per-user ranked suggestion lists"""
+    
+    def __init__(self, max_users: int, max_age_seconds: float):
+        self.max_users = max_users
+        self.max_age_seconds = max_age_seconds
+        # user_id -> (computed_at, ranked suggestions)
+        self._lists: OrderedDict[int, tuple[float, list[Suggestion]]] = OrderedDict()
+        # user_id -> when their friends last changed, for lists awaiting a refresh
+        self._stale: dict[int, float] = {}
+        self._lock = threading.Lock()
+    
+    def get(self, user_id: int) -> Optional[list[Suggestion]]:
+        with self._lock:
+            entry = self._lists.get(user_id)
+            if entry is None:
+                return None
+            computed_at, ranked = entry
+            if time.monotonic() - computed_at > self.max_age_seconds:
+                del self._lists[user_id]
+                return None
+            self._lists.move_to_end(user_id)
+            return ranked
+    
+    def put(self, user_id: int, ranked: list[Suggestion]) -> None:
+        with self._lock:
+            self._lists[user_id] = (time.monotonic(), ranked)
+            self._lists.move_to_end(user_id)
+            while len(self._lists) > self.max_users:
+                evicted, _ = self._lists.popitem(last=False)
+                self._stale.pop(evicted, None)
+    
+    def refreshed(self, user_id: int, ranked: list[Suggestion], started_at: float) -> None:
+        """Store a list re-ranked in the background, unless it was evicted or went stale again since started_at"""
+        with self._lock:
+            if user_id not in self._lists or self._stale.get(user_id, started_at) > started_at:
+                return
+            self._stale.pop(user_id, None)
+            self._lists[user_id] = (time.monotonic(), ranked)
+    
+    def discard(self, user_id: int) -> None:
+        with self._lock:
+            self._lists.pop(user_id, None)
+            self._stale.pop(user_id, None)
+    
+    def _stored(self, user_ids) -> list[int]:
+        with self._lock:
+            return [user_id for user_id in user_ids if user_id in self._lists]
+    
+    def _mark_stale(self, user_ids) -> list[int]:
+        now = time.monotonic()
+        with self._lock:
+            stale = [user_id for user_id in user_ids if user_id in self._lists]
+            for user_id in stale:
+                self._stale[user_id] = now
+        return stale
+    
+    def _rescore(self, owner_id: int, candidate_id: int) -> None:
+        graph = friend_graph.graph
+        with self._lock:
+            entry = self._lists.get(owner_id)
+            if entry is None:
+                return
+            computed_at, ranked = entry
+            co_comments = next((c for cid, _, c in ranked if cid == candidate_id), 0)
+            ranked = [s for s in ranked if s[0] != candidate_id]
+            
+            if owner_id != candidate_id and not graph.are_friends(owner_id, candidate_id):
+                mutual = len(graph.mutual_friend_ids(owner_id, candidate_id))
+                if mutual or co_comments:
+                    ranked.append((candidate_id, mutual, co_comments))
+                    ranked.sort(key=_rank_key)
+                    del ranked[SUGGESTIONS_KEPT:]
+            self._lists[owner_id] = (computed_at, ranked)
+    
+    def friendship_changed(self, user_id: int, friend_id: int) -> list[int]:
+        """
+        Update stored lists after a friendship was added or removed
+        
+        Must run after the friend graph has been updated. Returns the users
+        whose lists need re-ranking (see refresh_in_background).
+        """
+        return self.friendships_changed([(user_id, friend_id)])
+    
+    def friendships_changed(self, pairs) -> list[int]:
+        """
+        friendship_changed for many friendships, scanning each user's friends once
+        
+        Must run after the friend graph has been updated.
+        """
+        graph = friend_graph.graph
+        candidates = defaultdict(set)
+        for user_id, friend_id in pairs:
+            candidates[user_id].add(friend_id)
+            candidates[friend_id].add(user_id)
+        # The users' own candidate sets change wholesale, so they are ranked afresh
+        stale = self._mark_stale(candidates)
+        
+        for owner_id, candidate_ids in candidates.items():
+            for other_id in self._stored(graph.friend_ids(owner_id).tolist()):
+                for candidate_id in candidate_ids:
+                    if other_id != candidate_id:
+                        self._rescore(other_id, candidate_id)
+        return stale
+
+
+suggestion_index = SuggestionIndex(settings.SUGGESTION_CACHE_USERS, settings.SUGGESTION_MAX_AGE_SECONDS)
+
+
+async def _rank(db, user_id: int) -> list[Suggestion]:
+    # Only the co-comment query runs in the session; ranking is CPU work over
+    # the friend graph, so it runs on the threadpool instead of the event loop
+    co_comments = await db.run_sync(co_commenters, user_id)
+    return await run_in_threadpool(rank_candidates, user_id, co_comments)
+
+
+async def _refresh(user_ids: list[int]) -> None:
+    try:
+        async with session_scope() as db:
+            for user_id in user_ids:
+                started_at = time.monotonic()
+                suggestion_index.refreshed(user_id, await _rank(db, user_id), started_at)
+    except Exception:
+        logger.exception("Failed to refresh friend suggestions")
+
+
+# Refreshes in flight, referenced so they aren't garbage collected
+_refreshing: set[asyncio.Task] = set()
+
+
+def refresh_in_background(user_ids: list[int]) -> None:
+    """Re-rank stored lists (from friendship_changed) off the request path; call from the event loop"""
+    if not user_ids:
+        return
+    task = asyncio.create_task(_refresh(user_ids))
+    _refreshing.add(task)
+    task.add_done_callback(_refreshing.discard)
+
+
+async def suggest(db: AsyncSession, user_id: int, limit: int) -> list[Suggestion]:
+    """
+    Top `limit` suggestions for a user, computed on their first request
+    """
+    ranked = suggestion_index.get(user_id)
+    if ranked is None:
+        ranked = await _rank(db, user_id)
+        suggestion_index.put(user_id, ranked)
+    # A list awaiting its refresh may still hold users who are now friends
+    graph = friend_graph.graph
+    return [suggestion for suggestion in ranked if not graph.are_friends(user_id, suggestion[0])][:limit]
@@ -0,0 +1,391 @@
+"""
+Materialized friend timelines (fan-out on write)
+
+Every user has a list of (post_id, created_at) entries in `timeline_entries`.
+Creating a post pushes it into the timelines of the author and the author's
+friends, so reading a feed is a single range scan on
+(user_id, created_at, post_id).
+
+Authors with more than FEED_FANOUT_MAX_FRIENDS friends are recorded in
+`high_degree_authors` and are not fanned out; their posts are pulled from
+`posts` at read time and merged with the pushed entries.
+
+The author's own entry is written with the post; with FEED_FANOUT_IN_BACKGROUND
+the friends' entries are written by a "timeline.fan_out" job shortly after,
+which then sends the live post.created events to the friends' feeds.
+"""
+
+import heapq
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import select, delete, func, true, tuple_
+from sqlalchemy.orm import Session
+
+from app import jobs, pubsub
+from app.config import settings
+from app.database import insert_ignore
+from app.models import Post, User, TimelineEntry, HighDegreeAuthor, friends, load_author
+from app.pagination import keyset_after
+
+# Authors leave the pull set only once they drop well below the threshold,
+# so a user hovering around it doesn't flip modes on every friend change
+PULL_EXIT_RATIO = 0.8
+
+# Users or friendships handled per statement by the bulk helpers
+BULK_CHUNK = 500
+
+
+def is_high_degree(db: Session, user_id: int) -> bool:
+    """Check if an author's posts are pulled at read time"""
+    return db.get(HighDegreeAuthor, user_id) is not None
+
+
+def pulled_author_ids(db: Session, author_ids) -> set[int]:
+    """
+    The authors among these whose posts are pulled at read time
+
+    The one push/pull rule, which live updates follow too. It can't be read
+    off the friend count: an author leaves pull mode only once their count
+    drops below PULL_EXIT_RATIO of FEED_FANOUT_MAX_FRIENDS.
+    """
+    author_ids = list(author_ids)
+    pulled = set()
+    for start in range(0, len(author_ids), BULK_CHUNK):
+        pulled.update(db.scalars(
+            select(HighDegreeAuthor.user_id).where(HighDegreeAuthor.user_id.in_(author_ids[start:start + BULK_CHUNK]))
+        ))
+    return pulled
+
+
+def pulled_friend_ids(db: Session, user_id: int) -> list[int]:
+    """A user's friends whose posts are pulled into their feed"""
+    return list(db.scalars(pulled_authors(user_id)))
+
+
+def _push_recent_posts(db: Session, author_id: int, follower_ids=None) -> None:
+    """
+    Push an author's most recent posts into follower timelines
+
+    With follower_ids=None the posts are pushed to all of the author's friends.
+    """
+    recent = (
+        select(Post.id, Post.user_id, Post.created_at)
+        .where(Post.user_id == author_id)
+        .order_by(Post.created_at.desc())
+        .limit(settings.TIMELINE_BACKFILL_LIMIT)
+        .subquery()
+    )
+    followers = select(friends.c.friend_id.label("follower_id")).where(friends.c.user_id == author_id)
+    if follower_ids is not None:
+        followers = followers.where(friends.c.friend_id.in_(follower_ids))
+    followers = followers.subquery()
+
+    db.execute(
+        insert_ignore(TimelineEntry).from_select(
+            ["user_id", "post_id", "author_id", "created_at"],
+            select(followers.c.follower_id, recent.c.id, recent.c.user_id, recent.c.created_at)
+            .select_from(followers.join(recent, true()))
+        )
+    )
+
+
+def fan_out_post(db: Session, post: Post) -> None:
+    """
+    Push a new post into the author's own timeline and, unless the author
+    is high-degree, into the timelines of all their friends
+    """
+    fan_out_posts(db, [post.id])
+
+
+def fan_out_posts(db: Session, post_ids: list[int]) -> None:
+    """
+    Fan out several new posts at once (two statements for the whole batch)
+
+    With FEED_FANOUT_IN_BACKGROUND only the authors' own timelines are written
+    here, and the push to friends is enqueued in the same transaction.
+    """
+    db.execute(
+        insert_ignore(TimelineEntry).from_select(
+            ["user_id", "post_id", "author_id", "created_at"],
+            select(Post.user_id, Post.id, Post.user_id, Post.created_at).where(Post.id.in_(post_ids))
+        )
+    )
+
+    if settings.FEED_FANOUT_IN_BACKGROUND:
+        jobs.enqueue(db, "timeline.fan_out", {"post_ids": list(post_ids)})
+    else:
+        push_to_friends(db, post_ids)
+
+
+def _pushed(post_ids: list[int]):
+    """Condition on `posts`: the posts among post_ids that are pushed to friends"""
+    return Post.id.in_(post_ids) & Post.user_id.not_in(select(HighDegreeAuthor.user_id))
+
+
+def push_to_friends(db: Session, post_ids: list[int]) -> None:
+    """
+    Push posts into the timelines of their authors' friends, skipping high-degree authors
+
+    Safe to repeat or to run late: friendships and posts are read as they are
+    now, and entries already there are ignored.
+    """
+    db.execute(
+        insert_ignore(TimelineEntry).from_select(
+            ["user_id", "post_id", "author_id", "created_at"],
+            select(friends.c.friend_id, Post.id, Post.user_id, Post.created_at)
+            .join(Post, Post.user_id == friends.c.user_id)
+            .where(_pushed(post_ids))
+        )
+    )
+
+
+@jobs.handler("timeline.fan_out", queue="timeline")
+def fan_out_in_background(db: Session, post_ids: list[int]) -> None:
+    """
+    The push to friends enqueued by fan_out_posts, after which their open feeds are told
+
+    The events go out when the job commits, so the posts are already in the timelines.
+    """
+    push_to_friends(db, post_ids)
+    if pubsub.broker.active:
+        posts = db.scalars(select(Post).options(load_author(Post.author)).where(_pushed(post_ids))).all()
+        pubsub.publish_pushed_posts(db, posts)
+
+
+def retract_post(db: Session, post_id: int) -> None:
+    """Remove a post from every timeline"""
+    db.execute(delete(TimelineEntry).where(TimelineEntry.post_id == post_id))
+
+
+def backfill_friendship(db: Session, user_id: int, friend_id: int) -> None:
+    """Backfill both timelines with each other's recent posts after befriending"""
+    for author_id, follower_id in ((friend_id, user_id), (user_id, friend_id)):
+        if not is_high_degree(db, author_id):
+            _push_recent_posts(db, author_id, [follower_id])
+
+
+def backfill_friendships(db: Session, pairs: list[tuple[int, int]]) -> None:
+    """
+    Backfill timelines for many new friendships at once
+
+    Each chunk of friendships is one INSERT ... SELECT that ranks every
+    author's posts and pushes the newest TIMELINE_BACKFILL_LIMIT to the new
+    friend. Run it after update_fanout_modes so high-degree authors are skipped.
+    """
+    directed = [(a, b) for a, b in pairs] + [(b, a) for a, b in pairs]
+    for start in range(0, len(directed), BULK_CHUNK):
+        chunk = directed[start:start + BULK_CHUNK]
+        edges = (
+            select(friends.c.user_id.label("author_id"), friends.c.friend_id.label("follower_id"))
+            .where(tuple_(friends.c.user_id, friends.c.friend_id).in_(chunk))
+            .subquery()
+        )
+        recent = (
+            select(
+                Post.id,
+                Post.user_id,
+                Post.created_at,
+                func.row_number().over(
+                    partition_by=Post.user_id, order_by=Post.created_at.desc()
+                ).label("position"),
+            )
+            .where(
+                Post.user_id.in_({author_id for author_id, _ in chunk}),
+                Post.user_id.not_in(select(HighDegreeAuthor.user_id)),
+            )
+            .subquery()
+        )
+        db.execute(
+            insert_ignore(TimelineEntry).from_select(
+                ["user_id", "post_id", "author_id", "created_at"],
+                select(edges.c.follower_id, recent.c.id, recent.c.user_id, recent.c.created_at)
+                .join(recent, recent.c.user_id == edges.c.author_id)
+                .where(recent.c.position <= settings.TIMELINE_BACKFILL_LIMIT)
+            )
+        )
+
+
+def prune_friendship(db: Session, user_id: int, friend_id: int) -> None:
+    """Remove each user's posts from the other's timeline after unfriending"""
+    for owner_id, author_id in ((user_id, friend_id), (friend_id, user_id)):
+        db.execute(
+            delete(TimelineEntry).where(
+                TimelineEntry.user_id == owner_id,
+                TimelineEntry.author_id == author_id,
+            )
+        )
+
+
+def update_fanout_mode(db: Session, user_id: int) -> bool:
+    """
+    Move an author between push and pull mode after their friend count changed
+
+    Returns whether the author switched modes.
+    """
+    return bool(update_fanout_modes(db, [user_id]))
+
+
+def update_fanout_modes(db: Session, user_ids) -> list[int]:
+    """
+    update_fanout_mode for many users, reading their counts in one query per chunk
+
+    Returns the users that switched modes.
+    """
+    user_ids = list(user_ids)
+    switched = []
+    for start in range(0, len(user_ids), BULK_CHUNK):
+        rows = db.execute(
+            select(User.id, User.friend_count, HighDegreeAuthor.user_id)
+            .outerjoin(HighDegreeAuthor, HighDegreeAuthor.user_id == User.id)
+            .where(User.id.in_(user_ids[start:start + BULK_CHUNK]))
+        ).all()
+        entering = [
+            user_id for user_id, degree, pulled in rows
+            if pulled is None and degree > settings.FEED_FANOUT_MAX_FRIENDS
+        ]
+        leaving = [
+            user_id for user_id, degree, pulled in rows
+            if pulled is not None and degree < settings.FEED_FANOUT_MAX_FRIENDS * PULL_EXIT_RATIO
+        ]
+
+        if entering:
+            db.execute(insert_ignore(HighDegreeAuthor), [{"user_id": user_id} for user_id in entering])
+        if leaving:
+            db.execute(delete(HighDegreeAuthor).where(HighDegreeAuthor.user_id.in_(leaving)))
+            # Posts written while pulled never reached follower timelines
+            for user_id in leaving:
+                _push_recent_posts(db, user_id)
+        switched += entering + leaving
+    return switched
+
+
+def purge_user(db: Session, user_id: int) -> None:
+    """Drop every timeline row owned by or authored by a user"""
+    db.execute(
+        delete(TimelineEntry).where(
+            (TimelineEntry.user_id == user_id) | (TimelineEntry.author_id == user_id)
+        )
+    )
+    db.execute(delete(HighDegreeAuthor).where(HighDegreeAuthor.user_id == user_id))
+
+
+def pulled_authors(user_id: int):
+    """Subquery of a user's high-degree friends, whose posts are read from `posts`"""
+    return (
+        select(friends.c.friend_id)
+        .join(HighDegreeAuthor, HighDegreeAuthor.user_id == friends.c.friend_id)
+        .where(friends.c.user_id == user_id)
+    )
+
+
+def read_timeline(
+    db: Session,
+    user_id: int,
+    after: Optional[tuple[datetime, int]] = None,
+    skip: int = 0,
+    limit: int = 50,
+) -> list[tuple[datetime, int]]:
+    """
+    Get (created_at, post_id) pairs for a user's feed, newest first
+
+    Pushed entries come from one index range scan; posts by high-degree
+    friends are pulled separately and merged in. `after` is a keyset
+    position; without it the legacy `skip` offset applies.
+    """
+    window = limit if after else skip + limit
+
+    pushed = (
+        select(TimelineEntry.created_at, TimelineEntry.post_id)
+        .where(TimelineEntry.user_id == user_id)
+        .order_by(TimelineEntry.created_at.desc(), TimelineEntry.post_id.desc())
+        .limit(window)
+    )
+
+    pulled = (
+        select(Post.created_at, Post.id)
+        .where(Post.user_id.in_(pulled_authors(user_id)))
+        .order_by(Post.created_at.desc(), Post.id.desc())
+        .limit(window)
+    )
+
+    if after:
+        pushed = pushed.where(keyset_after(TimelineEntry.created_at, TimelineEntry.post_id, after))
+        pulled = pulled.where(keyset_after(Post.created_at, Post.id, after))
+
+    merged = heapq.merge(
+        db.execute(pushed).all(),
+        db.execute(pulled).all(),
+        key=lambda row: (row[0], row[1]),
+        reverse=True,
+    )
+    entries = []
+    for created_at, post_id in merged:
+        if not entries or entries[-1][1] != post_id:
+            entries.append((created_at, post_id))
+    return entries if after else entries[skip:window]
+
+
+def rebuild_timelines(db: Session) -> None:
+    """
+    Rebuild every timeline from the posts and friends tables
+
+    Used to seed timelines for databases created before fan-out on write.
+    """
+    db.execute(delete(TimelineEntry))
+    db.execute(delete(HighDegreeAuthor))
+
+    degrees = select(friends.c.user_id, func.count().label("degree")).group_by(friends.c.user_id).subquery()
+    db.execute(
+        insert_ignore(HighDegreeAuthor).from_select(
+            ["user_id"],
+            select(degrees.c.user_id).where(degrees.c.degree > settings.FEED_FANOUT_MAX_FRIENDS)
+        )
+    )
+
+    ranked = select(
+        Post.id,
+        Post.user_id,
+        Post.created_at,
+        func.row_number().over(partition_by=Post.user_id, order_by=Post.created_at.desc()).label("rank"),
+    ).subquery()
+    recent = select(ranked).where(ranked.c.rank <= settings.TIMELINE_BACKFILL_LIMIT).subquery()
+
+    # Own posts
+    db.execute(
+        insert_ignore(TimelineEntry).from_select(
+            ["user_id", "post_id", "author_id", "created_at"],
+            select(recent.c.user_id, recent.c.id, recent.c.user_id, recent.c.created_at)
+        )
+    )
+
+    # Friends' posts, skipping high-degree authors
+    db.execute(
+        insert_ignore(TimelineEntry).from_select(
+            ["user_id", "post_id", "author_id", "created_at"],
+            select(friends.c.friend_id, recent.c.id, recent.c.user_id, recent.c.created_at)
+            .join(recent, recent.c.user_id == friends.c.user_id)
+            .where(recent.c.user_id.not_in(select(HighDegreeAuthor.user_id)))
+        )
+    )
+    db.commit()
+
+
+def ensure_seeded(db: Session) -> None:
+    """
+    Build the timelines of a database that has posts but no timeline entries yet
+
+    Every post puts at least its author's own entry in `timeline_entries`, so an
+    empty table next to existing posts means the database predates fan-out on write.
+    """
+    if db.scalar(select(TimelineEntry.post_id).limit(1)) is None and db.scalar(select(Post.id).limit(1)) is not None:
+        rebuild_timelines(db)
+
+
+if __name__ == "__main__":
+    from app.database import Base, SessionLocal, engine
+
+    Base.metadata.create_all(bind=engine)
+    with SessionLocal() as session:
+        rebuild_timelines(session)
+    print("Timelines rebuilt")
@@ -1,107 +1,337 @@
 """
 File upload utilities
+
+Uploads are stored by content: the SHA-256 of the bytes names the file, and
+files are sharded two levels deep, e.g.
+
+    uploads/post_images/ab/cd/abcd1234...<64 hex>.jpg
+
+Identical uploads therefore share one file and one URL, and a URL never
+changes content. `media_blobs` counts the posts (image_url) and users
+(profile_picture) that store a URL of each file, including variant URLs;
+routes call attach_upload_urls and release_upload_urls where those fields are
+set and cleared. A file no row stores is removed, with its image variants,
+by an "uploads.collect" job once UPLOAD_UNATTACHED_HOURS have passed since it
+was last uploaded, so an upload that is never attached goes too.
 """
 
+import hashlib
 import os
 import uuid
+from datetime import datetime, timedelta, timezone
 from fastapi import UploadFile, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from pathlib import Path
+from sqlalchemy import bindparam, select, update, delete
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from typing import Optional
+
+from app import jobs
+from app.config import settings
+from app.database import insert_ignore
+from app.images import VARIANTS, variant_path
+from app.models import MediaBlob
 
 # Base upload directory
 UPLOAD_DIR = Path(__file__).parent.parent / "uploads"
 PROFILE_PICTURES_DIR = UPLOAD_DIR / "profile_pictures"
 POST_IMAGES_DIR = UPLOAD_DIR / "post_images"
 
-# Allowed image extensions
+# Upload directories by URL path segment
+UPLOAD_DIRS = {
+    "profile_pictures": PROFILE_PICTURES_DIR,
+    "post_images": POST_IMAGES_DIR,
+}
+
+# Upload directories by upload type
+UPLOAD_TYPE_DIRS = {
+    "profile": PROFILE_PICTURES_DIR,
+    "post": POST_IMAGES_DIR,
+}
+
+# Image extensions that may be stored (uploads are saved under their sniffed type)
 ALLOWED_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".webp"}
 
 # Max file size (5MB)
 MAX_FILE_SIZE = 5 * 1024 * 1024
 
+# Bytes read and written per step while saving an upload; bounds memory per upload
+CHUNK_SIZE = 64 * 1024
+
+# Statements built once, as they run for every stored URL; parameters are bound per call
+_ATTACH = (
+    update(MediaBlob)
+    .where(MediaBlob.path == bindparam("blob_path"))
+    .values(refcount=MediaBlob.refcount + 1)
+)
+_RELEASE = (
+    update(MediaBlob)
+    .where(MediaBlob.path == bindparam("blob_path"), MediaBlob.refcount > 0)
+    .values(refcount=MediaBlob.refcount - 1)
+)
+
+
+def sniff_image_extension(head: bytes) -> Optional[str]:
+    """Detect the image type from the first bytes of a file"""
+    if head.startswith(b"\xff\xd8\xff"):
+        return ".jpg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return ".png"
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return ".gif"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return ".webp"
+    return None
+
+
+def content_filename(digest: str, extension: str) -> str:
+    """Sharded filename for content with the given SHA-256 hex digest"""
+    return f"{digest[:2]}/{digest[2:4]}/{digest}{extension}"
+
+
+def _stream_to_temp(source, save_dir: Path) -> tuple[Path, str, int]:
+    """
+    Copy an upload to a temporary file in CHUNK_SIZE pieces, hashing as it goes
+    
+    Runs in a worker thread. Stops as soon as MAX_FILE_SIZE is passed.
+    
+    Returns:
+        The temporary path, the content filename and the size in bytes
+    """
+    
+    # Check file type
+    chunk = source.read(CHUNK_SIZE)
+    file_extension = sniff_image_extension(chunk)
+    if file_extension is None:
+        raise HTTPException(
+            status_code=400,
+            detail=f"File type not allowed. Allowed types: {', '.join(sorted(ALLOWED_EXTENSIONS))}"
+        )
+    
+    temp_path = save_dir / f".{uuid.uuid4()}.part"
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(temp_path, "wb") as temp_file:
+            while chunk:
+                size += len(chunk)
+                if size > MAX_FILE_SIZE:
+                    raise HTTPException(
+                        status_code=400,
+                        detail=f"File too large. Max size: {MAX_FILE_SIZE / 1024 / 1024}MB"
+                    )
+                digest.update(chunk)
+                temp_file.write(chunk)
+                chunk = source.read(CHUNK_SIZE)
+    except BaseException:
+        temp_path.unlink(missing_ok=True)
+        raise
+    
+    return temp_path, content_filename(digest.hexdigest(), file_extension), size
+
+
+def _move_into_place(temp_path: Path, file_path: Path) -> None:
+    """Rename a finished upload into place, or drop it if the content is already stored"""
+    if file_path.exists():
+        temp_path.unlink(missing_ok=True)
+        return
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    os.replace(temp_path, file_path)
 
-def get_file_extension(filename: str) -> str:
-    """Get file extension from filename"""
-    return Path(filename).suffix.lower()
 
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
 
-def is_allowed_file(filename: str) -> bool:
-    """Check if file extension is allowed"""
-    return get_file_extension(filename) in ALLOWED_EXTENSIONS
 
+async def _record_upload(db: AsyncSession, path: str, size: int) -> None:
+    """Track an upload's file, and have it collected unless a post or user stores it in time"""
+    now = _now()
+    touch = update(MediaBlob).where(MediaBlob.path == path).values(uploaded_at=now)
+    if not (await db.execute(touch)).rowcount:
+        inserted = await db.execute(insert_ignore(MediaBlob).values(path=path, size=size, refcount=0, uploaded_at=now))
+        if not inserted.rowcount:
+            # Another upload of the same content created the row first
+            await db.execute(touch)
+    await db.run_sync(jobs.enqueue, "uploads.collect", {"path": path}, delay=settings.UPLOAD_UNATTACHED_HOURS * 3600)
 
-async def save_upload_file(upload_file: UploadFile, upload_type: str = "profile") -> str:
+
+async def save_upload_file(db: AsyncSession, upload_file: UploadFile, upload_type: str = "profile") -> str:
     """
     Save uploaded file and return the filename
     
+    The file is streamed to disk in chunks off the event loop, and its type
+    is sniffed from the first bytes rather than taken from the filename.
+    Content that is already stored is not written again.
+    
     Args:
+        db: Session used to track the file (committed here)
         upload_file: The uploaded file
         upload_type: Either 'profile' or 'post'
     
     Returns:
-        The saved filename
+        The saved filename, relative to the upload type's directory
     """
     
     if not upload_file or not upload_file.filename:
         raise HTTPException(status_code=400, detail="No file provided")
     
-    # Check file extension
-    if not is_allowed_file(upload_file.filename):
-        raise HTTPException(
-            status_code=400,
-            detail=f"File type not allowed. Allowed types: {', '.join(ALLOWED_EXTENSIONS)}"
-        )
+    # Determine save directory
+    save_dir = UPLOAD_TYPE_DIRS.get(upload_type)
+    if save_dir is None:
+        raise HTTPException(status_code=400, detail="Invalid upload type")
     
-    # Read file content
-    content = await upload_file.read()
+    temp_path, filename, size = await run_in_threadpool(_stream_to_temp, upload_file.file, save_dir)
+    file_path = save_dir / filename
     
-    # Check file size
-    if len(content) > MAX_FILE_SIZE:
-        raise HTTPException(
-            status_code=400,
-            detail=f"File too large. Max size: {MAX_FILE_SIZE / 1024 / 1024}MB"
-        )
+    # Track the file before it appears, so a concurrent collection of the same
+    # content (which unlinks before committing) can't remove it after
+    try:
+        await _record_upload(db, file_path.relative_to(UPLOAD_DIR).as_posix(), size)
+        await db.commit()
+    except BaseException:
+        await run_in_threadpool(temp_path.unlink, True)
+        raise
+    
+    await run_in_threadpool(_move_into_place, temp_path, file_path)
+    return filename
+
+
+def find_upload_file(directory: str, stem: str) -> Optional[Path]:
+    """
+    Find an uploaded file by directory name and filename without extension
     
-    # Generate unique filename
-    file_extension = get_file_extension(upload_file.filename)
-    unique_filename = f"{uuid.uuid4()}{file_extension}"
+    The stem may include the shard directories (ab/cd/<digest>).
     
-    # Determine save directory
-    if upload_type == "profile":
-        save_dir = PROFILE_PICTURES_DIR
-    elif upload_type == "post":
-        save_dir = POST_IMAGES_DIR
-    else:
-        raise HTTPException(status_code=400, detail="Invalid upload type")
+    Returns:
+        The file path, or None if there is no such upload
+    """
+    
+    parts = stem.split("/")
+    if directory not in UPLOAD_DIRS or not all(
+        part.replace("-", "").replace("_", "").isalnum() for part in parts
+    ):
+        return None
     
-    # Save file
-    file_path = save_dir / unique_filename
-    with open(file_path, "wb") as f:
-        f.write(content)
+    for extension in ALLOWED_EXTENSIONS:
+        file_path = UPLOAD_DIRS[directory].joinpath(*parts[:-1]) / f"{parts[-1]}{extension}"
+        if file_path.is_file():
+            return file_path
     
-    return unique_filename
+    return None
+
+
+def _remove_stored_file(file_path: Path) -> None:
+    for variant in VARIANTS:
+        variant_path(file_path, variant).unlink(missing_ok=True)
+    file_path.unlink(missing_ok=True)
 
 
-def delete_upload_file(filename: str, upload_type: str = "profile") -> bool:
+@jobs.handler("uploads.collect")
+def collect_upload(db: Session, path: str) -> None:
     """
-    Delete uploaded file
+    Delete an upload's file and variants if no row stores its URL and it is past UPLOAD_UNATTACHED_HOURS
+    
+    The files are unlinked while the deleted row is locked and this
+    transaction does nothing else: an upload of the same content or an attach
+    waits for the commit and then finds no row, so it stores the file again or
+    is refused. If the commit fails the job is retried, with the row still
+    unreferenced.
+    """
+    cutoff = _now() - timedelta(hours=settings.UPLOAD_UNATTACHED_HOURS)
+    deleted = db.execute(
+        delete(MediaBlob).where(MediaBlob.path == path, MediaBlob.refcount == 0, MediaBlob.uploaded_at <= cutoff)
+    )
+    if deleted.rowcount:
+        _remove_stored_file(UPLOAD_DIR / path)
+
+
+async def delete_upload_file(db: AsyncSession, filename: str, upload_type: str = "profile") -> None:
+    """
+    Give up a new upload that turned out unusable
+    
+    Its file is collected as soon as the caller commits, unless a post or
+    user stores its URL.
     
     Args:
-        filename: The filename to delete
+        db: Session to record it in
+        filename: The filename to give up
         upload_type: Either 'profile' or 'post'
+    """
     
-    Returns:
-        True if deleted, False if file not found
+    save_dir = UPLOAD_TYPE_DIRS.get(upload_type)
+    if save_dir is None:
+        return
+    
+    path = (save_dir / filename).relative_to(UPLOAD_DIR).as_posix()
+    expired = _now() - timedelta(hours=settings.UPLOAD_UNATTACHED_HOURS)
+    await db.execute(update(MediaBlob).where(MediaBlob.path == path).values(uploaded_at=expired))
+    await db.run_sync(jobs.enqueue, "uploads.collect", {"path": path})
+
+
+def _upload_stem(url: Optional[str]) -> Optional[str]:
     """
+    The tracked upload a URL names, as its path under uploads/ without the extension
     
-    if upload_type == "profile":
-        file_path = PROFILE_PICTURES_DIR / filename
-    elif upload_type == "post":
-        file_path = POST_IMAGES_DIR / filename
-    else:
-        return False
+    The URL may name the upload or one of its variants. None for empty and
+    external URLs and for files not stored by content (e.g. the default picture).
+    """
+    if not url or not url.startswith("/uploads/"):
+        return None
+    parts = url.removeprefix("/uploads/").split("/")
+    if parts[0] == "variants":
+        # variants/<variant>/<upload dir>/<stem>.webp
+        parts = parts[2:]
+    # <upload dir>/ab/cd/<sha256>.<extension>
+    if len(parts) != 4 or parts[0] not in UPLOAD_DIRS:
+        return None
+    return "/".join(parts).rpartition(".")[0]
+
+
+async def _blob_path(db: AsyncSession, stem: str) -> Optional[str]:
+    # Variants have their own extension, so match the upload by its stem
+    return await db.scalar(select(MediaBlob.path).where(MediaBlob.path.startswith(f"{stem}.", autoescape=True)))
+
+
+async def attach_upload_urls(db: AsyncSession, urls) -> None:
+    """
+    Count a reference for each upload URL a post or user now stores
     
-    if file_path.exists():
-        os.remove(file_path)
-        return True
+    Runs in the caller's transaction. Untracked URLs are skipped; a URL of an
+    upload that has been collected is refused with 400.
+    """
+    
+    for url in urls:
+        stem = _upload_stem(url)
+        if stem is None:
+            continue
+        path = await _blob_path(db, stem)
+        if path is None or not (await db.execute(_ATTACH, {"blob_path": path})).rowcount:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Upload not found: {url}"
+            )
+
+
+async def release_upload_urls(db: AsyncSession, urls) -> int:
+    """
+    Release the references held by upload URLs a post or user no longer stores
+    
+    Runs in the caller's transaction; a file left unreferenced is collected
+    after the caller commits, so nothing is removed if it rolls back.
+    
+    Returns:
+        The number of references released
+    """
+    
+    released = 0
+    for url in urls:
+        stem = _upload_stem(url)
+        path = await _blob_path(db, stem) if stem is not None else None
+        if path is None or not (await db.execute(_RELEASE, {"blob_path": path})).rowcount:
+            continue
+        released += 1
+        if await db.scalar(select(MediaBlob.refcount).where(MediaBlob.path == path)) == 0:
+            await db.run_sync(jobs.enqueue, "uploads.collect", {"path": path})
     
-    return False
+    return released
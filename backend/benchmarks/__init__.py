@@ -0,0 +1,5 @@
+"""
+Benchmarks
+
+Run from the backend directory, e.g. `python -m benchmarks.friend_graph`.
+"""
@@ -0,0 +1,163 @@
+"""
+Embedded author benchmark
+
+Fills a scratch SQLite database with users (with long bios) and posts, then
+loads pages of posts and comments with the whole author row joined in
+against only the summary columns (models.load_author). Reports query time,
+the bytes the database returns per page, and the JSON size of the page with
+a full user object against an AuthorSummary embedded in each item.
+
+    python -m benchmarks.authors --users 2000 --posts 20 --bio 1000
+"""
+
+import argparse
+import gc
+import json
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+from pydantic import TypeAdapter
+from sqlalchemy import create_engine, event, insert, select
+from sqlalchemy.orm import Session, joinedload
+
+from app.database import Base
+from app.models import Comment, Post, User, load_author
+from app.schemas import CommentResponse, Page, PostResponse, UserResponse
+
+
+class PostWithUser(PostResponse):
+    author: UserResponse
+
+
+class CommentWithUser(CommentResponse):
+    author: UserResponse
+
+
+def populate(db: Session, users: int, posts_per_user: int, comments_per_post: int, bio: int, seed: int) -> None:
+    rng = np.random.default_rng(seed)
+    now = datetime.now(timezone.utc)
+    
+    db.execute(insert(User), [
+        {
+            "id": i,
+            "username": f"user{i}",
+            "email": f"user{i}@example.com",
+            "full_name": f"User {i}",
+            "bio": "x" * bio,
+            "profile_picture": "/uploads/profile_pictures/default.jpg",
+        }
+        for i in range(1, users + 1)
+    ])
+    
+    post_count = users * posts_per_user
+    authors = rng.integers(1, users + 1, size=post_count).tolist()
+    db.execute(insert(Post), [
+        {"id": i + 1, "content": f"post {i}", "user_id": authors[i], "created_at": now - timedelta(seconds=i)}
+        for i in range(post_count)
+    ])
+    
+    # Comments go to the first 1% of posts so comment pages are full
+    comment_posts = rng.integers(1, hot_posts(post_count) + 1, size=post_count * comments_per_post).tolist()
+    commenters = rng.integers(1, users + 1, size=len(comment_posts)).tolist()
+    db.execute(insert(Comment), [
+        {"content": "comment", "user_id": commenter, "post_id": post}
+        for post, commenter in zip(comment_posts, commenters)
+    ])
+    db.commit()
+
+
+def hot_posts(post_count: int) -> int:
+    return max(post_count // 100, 1)
+
+
+def row_bytes(rows) -> int:
+    """Approximate size of the values the database returned"""
+    return sum(len(value) if isinstance(value, (str, bytes)) else 8 for row in rows for value in row if value is not None)
+
+
+def time_pages(db: Session, page_query, adapter: TypeAdapter, keys: list[int], limit: int) -> dict:
+    """Mean and p99 query time per page in milliseconds, with bytes fetched and sent"""
+    statements = []
+    
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+    
+    samples = np.empty(len(keys))
+    fetched = sent = 0
+    for i, key in enumerate(keys):
+        db.expunge_all()
+        gc.collect()
+        statements.clear()
+        event.listen(db.get_bind(), "before_cursor_execute", capture)
+        start = time.perf_counter()
+        items = db.scalars(page_query(key, limit)).unique().all()
+        samples[i] = time.perf_counter() - start
+        event.remove(db.get_bind(), "before_cursor_execute", capture)
+        
+        raw = db.connection().connection.driver_connection
+        fetched += sum(row_bytes(raw.execute(statement, parameters).fetchall()) for statement, parameters in statements)
+        sent += len(adapter.dump_json(adapter.validate_python(
+            {"items": items, "count": len(items), "next_cursor": None}, from_attributes=True
+        )))
+    samples *= 1e3
+    return {
+        "mean_ms": round(float(samples.mean()), 3),
+        "p99_ms": round(float(np.percentile(samples, 99)), 3),
+        "db_bytes_per_page": fetched // len(keys),
+        "json_bytes_per_page": sent // len(keys),
+    }
+
+
+def run(users: int, posts_per_user: int, comments_per_post: int, bio: int, requests: int, limit: int, seed: int) -> dict:
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_engine(f"sqlite:///{os.path.join(directory, 'authors.db')}")
+        Base.metadata.create_all(bind=engine)
+        with Session(engine) as db:
+            populate(db, users, posts_per_user, comments_per_post, bio, seed)
+            rng = np.random.default_rng(seed + 1)
+            post_count = users * posts_per_user
+            starts = rng.integers(0, max(post_count - limit, 1), size=requests).tolist()
+            post_ids = rng.integers(1, hot_posts(post_count) + 1, size=requests).tolist()
+            
+            def posts_page(author_option):
+                return lambda start, limit: (
+                    select(Post).options(author_option(Post.author))
+                    .where(Post.id > start).order_by(Post.id).limit(limit)
+                )
+            
+            def comments_page(author_option):
+                return lambda post_id, limit: (
+                    select(Comment).options(author_option(Comment.author))
+                    .where(Comment.post_id == post_id).order_by(Comment.created_at, Comment.id).limit(limit)
+                )
+            
+            results = {
+                "GET /posts/": {
+                    "full_author": time_pages(db, posts_page(joinedload), TypeAdapter(Page[PostWithUser]), starts, limit),
+                    "author_summary": time_pages(db, posts_page(load_author), TypeAdapter(Page[PostResponse]), starts, limit),
+                },
+                "GET /comments/post/{id}": {
+                    "full_author": time_pages(db, comments_page(joinedload), TypeAdapter(Page[CommentWithUser]), post_ids, limit),
+                    "author_summary": time_pages(db, comments_page(load_author), TypeAdapter(Page[CommentResponse]), post_ids, limit),
+                },
+            }
+        engine.dispose()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--posts", type=int, default=20, help="posts per user")
+    parser.add_argument("--comments", type=int, default=2, help="comments per post, on average")
+    parser.add_argument("--bio", type=int, default=1000, help="bio length in characters")
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    print(json.dumps(run(
+        args.users, args.posts, args.comments, args.bio, args.requests, args.limit, args.seed
+    ), indent=2))
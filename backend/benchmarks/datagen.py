@@ -0,0 +1,281 @@
+"""
+Synthetic data generator
+
+Fills a new database with users, a power-law friend graph and Zipf-skewed
+posting and commenting activity, then builds the derived state a long-lived
+database has (counters, timelines, feed ranking, search index). Rows are
+bulk-inserted through Core in chunks.
+
+    DATABASE_URL=sqlite:///bench.db python -m benchmarks.datagen --rows 1000000
+
+--rows is the approximate total of users, friendship rows (both directions),
+posts and comments; 10k to 10M is the intended range. The shape is set by
+--avg-friends, --posts-per-user, --comments-per-post and the skew exponents.
+Without DATABASE_URL a temporary SQLite file is used.
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}")
+
+from sqlalchemy import insert, inspect  # noqa: E402
+
+from app import ranking, timeline  # noqa: E402
+from app.database import Base, SessionLocal, engine  # noqa: E402
+from app.models import User, Post, Comment, friends  # noqa: E402
+from app.search_index import init_search  # noqa: E402
+
+# Rows per INSERT executemany
+INSERT_CHUNK = 20_000
+
+DAY_SECONDS = 86400
+
+SYLLABLES = [
+    "ka", "lo", "mi", "ra", "te", "su", "no", "vi", "an", "el", "or", "un", "ba", "de", "fi", "go",
+    "ha", "jo", "ku", "ly", "ma", "ne", "pa", "qui", "ro", "sa", "to", "ve", "wa", "xi", "yo", "ze",
+]
+
+DEFAULT_PICTURE = "/uploads/profile_pictures/default.jpg"
+
+
+def zipf_probabilities(rng: np.random.Generator, count: int, exponent: float, shuffle: bool = True) -> np.ndarray:
+    """Probabilities proportional to 1 / rank**exponent, ranks assigned at random unless shuffle is off"""
+    weights = 1.0 / np.arange(1, count + 1) ** exponent
+    if shuffle:
+        rng.shuffle(weights)
+    return weights / weights.sum()
+
+
+def vocabulary(size: int = 5000) -> list[str]:
+    """Made-up words, most frequent first; always the same list, so runners can search for them"""
+    rng = np.random.default_rng(0)
+    words = {}
+    while len(words) < size:
+        words["".join(rng.choice(SYLLABLES, size=rng.integers(2, 5)))] = None
+    return list(words)
+
+
+def friend_pairs(rng: np.random.Generator, users: int, avg_friends: float, exponent: float) -> np.ndarray:
+    """
+    Undirected friendships (a, b) with a < b, as 0-based user indexes
+    
+    Chung-Lu model: every user gets an expected degree from a power law with
+    the given exponent (capped at users - 1) and both endpoints of each edge
+    are drawn in proportion to it. Self-loops and repeats are dropped, so the
+    realised average comes out slightly under avg_friends.
+    """
+    edges = int(users * avg_friends / 2)
+    if users < 2 or edges == 0:
+        return np.empty((0, 2), dtype=np.int64)
+    
+    weights = np.arange(1, users + 1) ** (-1.0 / (exponent - 1))
+    weights = np.minimum(weights * (avg_friends / weights.mean()), users - 1)
+    rng.shuffle(weights)
+    p = weights / weights.sum()
+    
+    a = rng.choice(users, size=edges, p=p)
+    b = rng.choice(users, size=edges, p=p)
+    keep = a != b
+    keys = np.unique(np.minimum(a, b)[keep].astype(np.int64) * users + np.maximum(a, b)[keep])
+    return np.column_stack((keys // users, keys % users))
+
+
+def sentences(rng: np.random.Generator, words: list[str], p: np.ndarray, count: int, low: int, high: int) -> list[str]:
+    """`count` strings of low..high words drawn with probabilities p"""
+    lengths = rng.integers(low, high + 1, size=count)
+    picked = [words[i] for i in rng.choice(len(words), size=int(lengths.sum()), p=p).tolist()]
+    ends = np.cumsum(lengths).tolist()
+    return [" ".join(picked[end - length:end]) for end, length in zip(ends, lengths.tolist())]
+
+
+def timestamps(seconds: np.ndarray) -> list[datetime]:
+    return [datetime.fromtimestamp(value, timezone.utc) for value in seconds.tolist()]
+
+
+def insert_chunks(db, table, make_rows, count: int) -> None:
+    """Insert rows make_rows(start, stop) for 0..count in INSERT_CHUNK pieces, then commit"""
+    for start in range(0, count, INSERT_CHUNK):
+        db.execute(insert(table), make_rows(start, min(start + INSERT_CHUNK, count)))
+    db.commit()
+
+
+def plan(rows: int, avg_friends: float, posts_per_user: float, comments_per_post: float) -> dict:
+    """How many users, posts and comments make up roughly `rows` rows"""
+    per_user = 1 + avg_friends + posts_per_user * (1 + comments_per_post)
+    users = max(2, int(rows / per_user))
+    posts = int(users * posts_per_user)
+    return {"users": users, "posts": posts, "comments": int(posts * comments_per_post)}
+
+
+def generate(
+    rows: int,
+    avg_friends: float = 20,
+    posts_per_user: float = 5,
+    comments_per_post: float = 3,
+    degree_exponent: float = 2.5,
+    activity_exponent: float = 1.1,
+    popularity_exponent: float = 1.2,
+    days: int = 365,
+    seed: int = 0,
+) -> dict:
+    """
+    Generate and load a dataset into the (new) database at DATABASE_URL
+    
+    Returns:
+        Row counts, degree statistics and seconds spent per phase
+    """
+    if inspect(engine).has_table(User.__tablename__):
+        raise SystemExit(f"{engine.url.render_as_string(hide_password=True)} already has tables; use a new database")
+    
+    rng = np.random.default_rng(seed)
+    words = vocabulary()
+    word_p = zipf_probabilities(rng, len(words), 1.0, shuffle=False)
+    counts = plan(rows, avg_friends, posts_per_user, comments_per_post)
+    users, posts, comments = counts["users"], counts["posts"], counts["comments"]
+    now = time.time()
+    phases = {}
+    
+    start = time.perf_counter()
+    pairs = friend_pairs(rng, users, avg_friends, degree_exponent)
+    degrees = np.bincount(pairs.ravel(), minlength=users)
+    
+    # Ids follow creation time, as they would in a real database
+    user_created = np.sort(now - rng.uniform(0, days * DAY_SECONDS, users))
+    activity = zipf_probabilities(rng, users, activity_exponent)
+    
+    post_author = rng.choice(users, size=posts, p=activity)
+    post_created = user_created[post_author] + rng.random(posts) * (now - user_created[post_author])
+    order = np.argsort(post_created)
+    post_author, post_created = post_author[order], post_created[order]
+    
+    comment_post = rng.choice(posts, size=comments, p=zipf_probabilities(rng, posts, popularity_exponent))
+    comment_user = rng.choice(users, size=comments, p=activity)
+    comment_created = np.minimum(post_created[comment_post] + rng.exponential(DAY_SECONDS, comments), now)
+    order = np.argsort(comment_created)
+    comment_post, comment_user, comment_created = comment_post[order], comment_user[order], comment_created[order]
+    phases["generate_seconds"] = round(time.perf_counter() - start, 2)
+    
+    post_count = np.bincount(post_author, minlength=users)
+    comment_count = np.bincount(comment_post, minlength=posts)
+    
+    def user_rows(first, stop):
+        names = sentences(rng, words, word_p, stop - first, 2, 2)
+        bios = sentences(rng, words, word_p, stop - first, 4, 16)
+        has_bio = rng.random(stop - first) < 0.5
+        created = timestamps(user_created[first:stop])
+        return [
+            {
+                "id": i + 1,
+                "username": f"user{i + 1}",
+                "email": f"user{i + 1}@example.com",
+                "full_name": names[i - first].title(),
+                "bio": bios[i - first] if has_bio[i - first] else None,
+                "profile_picture": DEFAULT_PICTURE,
+                "is_admin": False,
+                "post_count": int(post_count[i]),
+                "friend_count": int(degrees[i]),
+                "created_at": created[i - first],
+            }
+            for i in range(first, stop)
+        ]
+    
+    def friend_rows(first, stop):
+        # Each friendship is stored in both directions
+        chunk = (pairs[first // 2:stop // 2] + 1).tolist()
+        return [{"user_id": a, "friend_id": b} for a, b in chunk] + [{"user_id": b, "friend_id": a} for a, b in chunk]
+    
+    def post_rows(first, stop):
+        contents = sentences(rng, words, word_p, stop - first, 5, 40)
+        created = timestamps(post_created[first:stop])
+        return [
+            {
+                "id": i + 1,
+                "content": contents[i - first],
+                "user_id": int(post_author[i]) + 1,
+                "comment_count": int(comment_count[i]),
+                "engagement": 0.0,
+                "created_at": created[i - first],
+                "updated_at": created[i - first],
+            }
+            for i in range(first, stop)
+        ]
+    
+    def comment_rows(first, stop):
+        contents = sentences(rng, words, word_p, stop - first, 2, 20)
+        created = timestamps(comment_created[first:stop])
+        return [
+            {
+                "id": i + 1,
+                "content": contents[i - first],
+                "user_id": int(comment_user[i]) + 1,
+                "post_id": int(comment_post[i]) + 1,
+                "created_at": created[i - first],
+            }
+            for i in range(first, stop)
+        ]
+    
+    Base.metadata.create_all(bind=engine)
+    with SessionLocal() as db:
+        start = time.perf_counter()
+        insert_chunks(db, User.__table__, user_rows, users)
+        # Chunks are cut on even row numbers so both directions of an edge land together
+        insert_chunks(db, friends, friend_rows, 2 * len(pairs))
+        insert_chunks(db, Post.__table__, post_rows, posts)
+        insert_chunks(db, Comment.__table__, comment_rows, comments)
+        phases["insert_seconds"] = round(time.perf_counter() - start, 2)
+        
+        start = time.perf_counter()
+        timeline.rebuild_timelines(db)
+        ranking.rebuild(db)
+        init_search(db)
+        phases["derive_seconds"] = round(time.perf_counter() - start, 2)
+    
+    return {
+        "database_url": engine.url.render_as_string(hide_password=True),
+        "seed": seed,
+        "rows": users + 2 * len(pairs) + posts + comments,
+        "users": users,
+        "friendships": int(len(pairs)),
+        "posts": posts,
+        "comments": comments,
+        "degree": {
+            "mean": round(float(degrees.mean()), 1),
+            "p50": int(np.percentile(degrees, 50)),
+            "p99": int(np.percentile(degrees, 99)),
+            "max": int(degrees.max()),
+        },
+        "comments_on_top_1pct_posts": round(float(np.sort(comment_count)[::-1][:max(1, posts // 100)].sum() / max(1, comments)), 3),
+        **phases,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100_000, help="approximate total rows to generate")
+    parser.add_argument("--avg-friends", type=float, default=20)
+    parser.add_argument("--posts-per-user", type=float, default=5)
+    parser.add_argument("--comments-per-post", type=float, default=3)
+    parser.add_argument("--degree-exponent", type=float, default=2.5, help="power-law exponent of the degree distribution")
+    parser.add_argument("--activity-exponent", type=float, default=1.1, help="Zipf exponent of posting and commenting per user")
+    parser.add_argument("--popularity-exponent", type=float, default=1.2, help="Zipf exponent of comments per post")
+    parser.add_argument("--days", type=int, default=365, help="how far back activity goes")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    print(json.dumps(generate(
+        args.rows,
+        avg_friends=args.avg_friends,
+        posts_per_user=args.posts_per_user,
+        comments_per_post=args.comments_per_post,
+        degree_exponent=args.degree_exponent,
+        activity_exponent=args.activity_exponent,
+        popularity_exponent=args.popularity_exponent,
+        days=args.days,
+        seed=args.seed,
+    ), indent=2))
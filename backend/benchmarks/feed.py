@@ -0,0 +1,129 @@
+"""
+Ranked feed benchmark
+
+Fills a scratch SQLite database with users, friendships, posts and comments,
+then times a page of the chronological feed against a page of the ranked
+feed for random users. Both include loading the page's posts.
+
+    python -m benchmarks.feed --users 2000 --friends 50 --posts 20 --comments 5
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+from sqlalchemy import create_engine, insert, select
+from sqlalchemy.orm import Session
+
+from app import ranking, timeline
+from app.database import Base
+from app.models import Comment, Post, User, friends
+
+
+def populate(db: Session, users: int, friends_per_user: int, posts_per_user: int, comments_per_post: int, seed: int) -> None:
+    rng = np.random.default_rng(seed)
+    now = datetime.now(timezone.utc)
+    
+    db.execute(insert(User), [
+        {"id": i, "username": f"user{i}", "email": f"user{i}@example.com", "full_name": f"User {i}"}
+        for i in range(1, users + 1)
+    ])
+    
+    pairs = rng.integers(1, users + 1, size=(users * friends_per_user // 2, 2))
+    pairs = np.unique(np.sort(pairs[pairs[:, 0] != pairs[:, 1]], axis=1), axis=0).tolist()
+    db.execute(insert(friends), [{"user_id": a, "friend_id": b} for a, b in pairs] + [
+        {"user_id": b, "friend_id": a} for a, b in pairs
+    ])
+    
+    # Posts spread over the last week, comments within a day of their post
+    post_count = users * posts_per_user
+    authors = rng.integers(1, users + 1, size=post_count).tolist()
+    ages = rng.uniform(0, 7 * 24 * 3600, size=post_count).tolist()
+    created = [now - timedelta(seconds=age) for age in ages]
+    db.execute(insert(Post), [
+        {"id": i + 1, "content": f"post {i}", "user_id": authors[i], "created_at": created[i], "updated_at": created[i]}
+        for i in range(post_count)
+    ])
+    
+    comment_posts = rng.integers(0, post_count, size=post_count * comments_per_post).tolist()
+    commenters = rng.integers(1, users + 1, size=len(comment_posts)).tolist()
+    delays = rng.exponential(3 * 3600, size=len(comment_posts)).tolist()
+    db.execute(insert(Comment), [
+        {
+            "content": "comment",
+            "user_id": commenter,
+            "post_id": post + 1,
+            "created_at": min(created[post] + timedelta(seconds=delay), now),
+        }
+        for post, commenter, delay in zip(comment_posts, commenters, delays)
+    ])
+    db.commit()
+    
+    timeline.rebuild_timelines(db)
+    ranking.rebuild(db)
+
+
+def load_posts(db: Session, post_ids: list[int]) -> list[Post]:
+    return db.scalars(select(Post).where(Post.id.in_(post_ids))).all()
+
+
+def chronological_page(db: Session, user_id: int, limit: int) -> None:
+    entries = timeline.read_timeline(db, user_id, limit=limit + 1)
+    load_posts(db, [post_id for _, post_id in entries])
+
+
+def ranked_page(db: Session, user_id: int, limit: int) -> None:
+    post_ids, _ = ranking.rank_user_feed(db, user_id, datetime.now(timezone.utc), limit=limit)
+    load_posts(db, post_ids)
+
+
+def time_pages(db: Session, page, user_ids: list[int], limit: int) -> dict:
+    """Mean and p99 latency of one page, in milliseconds"""
+    samples = np.empty(len(user_ids))
+    for i, user_id in enumerate(user_ids):
+        start = time.perf_counter()
+        page(db, user_id, limit)
+        samples[i] = time.perf_counter() - start
+        db.expunge_all()
+    samples *= 1e3
+    return {"mean_ms": round(float(samples.mean()), 3), "p99_ms": round(float(np.percentile(samples, 99)), 3)}
+
+
+def run(users: int, friends_per_user: int, posts_per_user: int, comments_per_post: int, requests: int, limit: int, seed: int) -> dict:
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_engine(f"sqlite:///{os.path.join(directory, 'feed.db')}")
+        Base.metadata.create_all(bind=engine)
+        with Session(engine) as db:
+            start = time.perf_counter()
+            populate(db, users, friends_per_user, posts_per_user, comments_per_post, seed)
+            populate_seconds = time.perf_counter() - start
+            
+            user_ids = np.random.default_rng(seed + 1).integers(1, users + 1, size=requests).tolist()
+            results = {
+                "posts": users * posts_per_user,
+                "comments": users * posts_per_user * comments_per_post,
+                "populate_seconds": round(populate_seconds, 2),
+                "chronological": time_pages(db, chronological_page, user_ids, limit),
+                "ranked": time_pages(db, ranked_page, user_ids, limit),
+            }
+        engine.dispose()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--friends", type=int, default=50, help="average friends per user")
+    parser.add_argument("--posts", type=int, default=20, help="posts per user")
+    parser.add_argument("--comments", type=int, default=5, help="comments per post")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--limit", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    print(json.dumps(run(
+        args.users, args.friends, args.posts, args.comments, args.requests, args.limit, args.seed
+    ), indent=2))
@@ -0,0 +1,77 @@
+"""
+Friend graph index benchmark
+
+Builds a FriendGraph from a random graph (no database involved) and reports
+build time, memory per edge and per-operation latency.
+
+    python -m benchmarks.friend_graph --edges 10000000 --users 1000000
+"""
+
+import argparse
+import json
+import time
+
+import numpy as np
+
+from app.friend_graph import FriendGraph
+
+
+def random_edges(users: int, edges: int, seed: int) -> tuple[np.ndarray, np.ndarray]:
+    """Directed edges for edges // 2 random friendships, both directions stored"""
+    rng = np.random.default_rng(seed)
+    pairs = rng.integers(1, users + 1, size=(edges // 2, 2), dtype=np.int64)
+    pairs = pairs[pairs[:, 0] != pairs[:, 1]]
+    pairs = np.unique(np.sort(pairs, axis=1), axis=0)
+    return np.concatenate([pairs[:, 0], pairs[:, 1]]), np.concatenate([pairs[:, 1], pairs[:, 0]])
+
+
+def time_op(fn, args: list) -> dict:
+    """Mean and p99 latency of fn over args, in microseconds"""
+    samples = np.empty(len(args))
+    for i, arg in enumerate(args):
+        start = time.perf_counter()
+        fn(*arg)
+        samples[i] = time.perf_counter() - start
+    samples *= 1e6
+    return {"mean_us": round(float(samples.mean()), 2), "p99_us": round(float(np.percentile(samples, 99)), 2)}
+
+
+def run(users: int, edges: int, ops: int, seed: int) -> dict:
+    sources, targets = random_edges(users, edges, seed)
+    
+    start = time.perf_counter()
+    graph = FriendGraph(sources, targets)
+    build_seconds = time.perf_counter() - start
+    del sources, targets
+    
+    stats = graph.stats()
+    rng = np.random.default_rng(seed + 1)
+    pairs = rng.integers(1, users + 1, size=(ops, 2)).tolist()
+    singles = [(user_id,) for user_id, _ in pairs]
+    
+    return {
+        "users": users,
+        "edges": stats["edges"],
+        "build_seconds": round(build_seconds, 3),
+        "memory_bytes": stats["memory_bytes"],
+        "bytes_per_edge": round(stats["memory_bytes"] / max(stats["edges"], 1), 2),
+        "degree": time_op(graph.degree, singles),
+        "friend_ids": time_op(graph.friend_ids, singles),
+        "are_friends": time_op(graph.are_friends, pairs),
+        "mutual_friend_ids": time_op(graph.mutual_friend_ids, pairs),
+        "add_friendship": time_op(graph.add_friendship, pairs[:1000]),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--edges", type=int, default=10_000_000, help="directed edges (two per friendship)")
+    parser.add_argument("--ops", type=int, default=100_000)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    print(json.dumps(run(args.users, args.edges, args.ops, args.seed), indent=2))
+
+
+if __name__ == "__main__":
+    main()
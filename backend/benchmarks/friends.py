@@ -0,0 +1,89 @@
+"""
+Friendship write benchmark
+
+Builds users of increasing degree with POST /friends/bulk, then times adding
+and removing one more friendship for each of them. Add and remove latency
+should not grow with the user's degree. Also reports how fast the bulk
+import itself goes.
+
+    python -m benchmarks.friends --degrees 10 100 1000 5000 --requests 100
+
+Set DATABASE_URL to run against another database; by default a temporary
+SQLite file is used.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'friends.db')}")
+
+import httpx  # noqa: E402
+from sqlalchemy import func, insert, select  # noqa: E402
+
+from app.database import SessionLocal  # noqa: E402
+from app.main import app  # noqa: E402
+from app.models import User  # noqa: E402
+
+
+def create_users(count: int) -> list[int]:
+    with SessionLocal() as db:
+        first = (db.scalar(select(func.max(User.id))) or 0) + 1
+        db.execute(insert(User), [
+            {"id": i, "username": f"f{i}", "email": f"f{i}@example.com", "full_name": f"F {i}"}
+            for i in range(first, first + count)
+        ])
+        db.commit()
+    return list(range(first, first + count))
+
+
+async def time_requests(client: httpx.AsyncClient, requests: list, expect: int) -> dict:
+    """Mean and p99 latency of requests sent one after another, in milliseconds"""
+    samples = np.empty(len(requests))
+    for i, (method, url, body) in enumerate(requests):
+        start = time.perf_counter()
+        response = await client.request(method, url, json=body)
+        samples[i] = time.perf_counter() - start
+        if response.status_code != expect:
+            raise RuntimeError(f"{method} {url}: {response.status_code} {response.text[:200]}")
+    samples *= 1e3
+    return {"mean_ms": round(float(samples.mean()), 2), "p99_ms": round(float(np.percentile(samples, 99)), 2)}
+
+
+async def run(degrees: list[int], requests: int) -> dict:
+    results = {}
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench/api") as client:
+            for degree in degrees:
+                hub, *friend_ids = create_users(degree + 1)
+                others = create_users(requests)
+                
+                edges = [{"user_id": hub, "friend_id": friend_id} for friend_id in friend_ids]
+                start = time.perf_counter()
+                response = await client.post("/friends/bulk", json=edges)
+                elapsed = time.perf_counter() - start
+                if response.status_code != 201:
+                    raise RuntimeError(f"bulk import: {response.status_code} {response.text[:200]}")
+                
+                pairs = [{"user_id": hub, "friend_id": other} for other in others]
+                results[degree] = {
+                    "bulk_import_seconds": round(elapsed, 3),
+                    "bulk_edges_per_second": round(degree / elapsed),
+                    "add_friend": await time_requests(client, [("POST", "/friends/", pair) for pair in pairs], 201),
+                    "remove_friend": await time_requests(client, [("DELETE", "/friends/", pair) for pair in pairs], 204),
+                }
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--degrees", type=int, nargs="+", default=[10, 100, 1000, 5000])
+    parser.add_argument("--requests", type=int, default=100, help="adds and removes timed per degree")
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args.degrees, args.requests)), indent=2))
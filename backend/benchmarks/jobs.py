@@ -0,0 +1,152 @@
+"""
+Background job benchmark
+
+Two parts, against a scratch database:
+
+- queue: the cost of enqueueing one job in a committed transaction, then how
+  fast this process's workers drain --jobs fan-out jobs at each --concurrency,
+  with the delay from enqueue to start and to finish (lag).
+- create_post: POST /posts by authors with --friends friends each, with the
+  friends' timelines written inline and in a background job; reports the
+  request latency and, for the job, how long until every friend's timeline
+  has the post.
+    
+    python -m benchmarks.jobs --jobs 2000 --concurrency 1 4 16 --friends 1000
+
+Set DATABASE_URL to run against another database; by default a temporary
+SQLite file is used.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'jobs.db')}")
+
+import httpx  # noqa: E402
+from sqlalchemy import delete, func, insert, select  # noqa: E402
+
+from app import friend_graph, jobs  # noqa: E402
+from app.config import settings  # noqa: E402
+from app.database import SessionLocal  # noqa: E402
+from app.main import app  # noqa: E402
+from app.models import Job, TimelineEntry, User, friends  # noqa: E402
+
+
+def percentiles(seconds) -> dict:
+    values = np.array(seconds) * 1e3
+    return {
+        "p50_ms": round(float(np.percentile(values, 50)), 2),
+        "p99_ms": round(float(np.percentile(values, 99)), 2),
+        "max_ms": round(float(values.max()), 2),
+    }
+
+
+def enqueue_cost(count: int) -> dict:
+    """One job per committed transaction, as a route does"""
+    seconds = []
+    with SessionLocal() as db:
+        for i in range(count):
+            start = time.perf_counter()
+            jobs.enqueue(db, "timeline.fan_out", {"post_ids": [-i]})
+            db.commit()
+            seconds.append(time.perf_counter() - start)
+    return percentiles(seconds)
+
+
+async def drain(count: int, concurrency: int) -> dict:
+    """Enqueue `count` jobs at once and time the workers through them"""
+    with SessionLocal() as db:
+        db.execute(delete(Job))
+        for i in range(count):
+            jobs.enqueue(db, "timeline.fan_out", {"post_ids": [-i]})
+        db.commit()
+    
+    settings.JOB_QUEUES = {**settings.JOB_QUEUES, "timeline": concurrency}
+    start = time.perf_counter()
+    jobs.workers.start()
+    while True:
+        await asyncio.sleep(0.05)
+        with SessionLocal() as db:
+            if not db.scalar(select(func.count()).select_from(Job).where(Job.status != jobs.DONE)):
+                break
+    elapsed = time.perf_counter() - start
+    await jobs.workers.stop()
+    
+    with SessionLocal() as db:
+        rows = db.execute(select(Job.run_at, Job.started_at, Job.finished_at)).all()
+    return {
+        "concurrency": concurrency,
+        "jobs_per_second": round(count / elapsed, 1),
+        "start_lag": percentiles([(started - run_at).total_seconds() for run_at, started, _ in rows]),
+        "finish_lag": percentiles([(finished - run_at).total_seconds() for run_at, _, finished in rows]),
+    }
+
+
+def populate_authors(authors: int, friends_per_author: int) -> list[int]:
+    """Authors with their own disjoint sets of friends"""
+    with SessionLocal() as db:
+        first = (db.scalar(select(func.max(User.id))) or 0) + 1
+        count = authors * (friends_per_author + 1)
+        db.execute(insert(User), [
+            {"id": i, "username": f"job{i}", "email": f"job{i}@example.com", "full_name": f"Job {i}"}
+            for i in range(first, first + count)
+        ])
+        author_ids = list(range(first, first + count, friends_per_author + 1))
+        edges = [(a, a + 1 + j) for a in author_ids for j in range(friends_per_author)]
+        db.execute(insert(friends), [{"user_id": a, "friend_id": b} for a, b in edges] + [
+            {"user_id": b, "friend_id": a} for a, b in edges
+        ])
+        db.commit()
+        friend_graph.init_friend_graph(db)
+    return author_ids
+
+
+async def create_posts(client: httpx.AsyncClient, author_ids: list[int], friends_per_author: int, background: bool) -> dict:
+    settings.FEED_FANOUT_IN_BACKGROUND = background
+    latencies, visible = [], []
+    for author_id in author_ids:
+        start = time.perf_counter()
+        response = await client.post("/posts/", json={"content": "fan out", "user_id": author_id})
+        latencies.append(time.perf_counter() - start)
+        post_id = response.json()["id"]
+        # Every friend has it once the post has friends_per_author + 1 entries
+        while True:
+            with SessionLocal() as db:
+                entries = db.scalar(select(func.count()).where(TimelineEntry.post_id == post_id))
+            if entries > friends_per_author:
+                break
+            await asyncio.sleep(0.001)
+        visible.append(time.perf_counter() - start)
+    return {"request": percentiles(latencies), "visible_to_all_friends": percentiles(visible)}
+
+
+async def run(count: int, concurrencies: list[int], friends_per_author: int, posts: int) -> dict:
+    report = {"enqueue_and_commit": enqueue_cost(min(count, 1000))}
+    report["drain"] = [await drain(count, concurrency) for concurrency in concurrencies]
+    
+    author_ids = populate_authors(posts * 2, friends_per_author)
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench/api") as client:
+            report["create_post"] = {
+                "friends": friends_per_author,
+                "inline": await create_posts(client, author_ids[:posts], friends_per_author, False),
+                "background": await create_posts(client, author_ids[posts:], friends_per_author, True),
+            }
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=2000, help="jobs drained per concurrency level")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--friends", type=int, default=1000, help="friends of each posting author")
+    parser.add_argument("--posts", type=int, default=50, help="posts created per fan-out mode")
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args.jobs, args.concurrency, args.friends, args.posts)), indent=2))
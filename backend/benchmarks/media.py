@@ -0,0 +1,115 @@
+"""
+Media serving benchmark
+
+Serves the same files through the /uploads media routes and through a bare
+StaticFiles mount of the uploads directory, and reports requests per second
+for each scenario. Requests go through the ASGI interface in-process, so the
+numbers measure server-side work per request, not network throughput.
+
+    python -m benchmarks.media --requests 2000 --concurrency 16
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import time
+
+import httpx
+from fastapi import FastAPI
+from fastapi.staticfiles import StaticFiles
+
+from app.routes.media import router as media_router
+from app.upload_utils import UPLOAD_DIR, POST_IMAGES_DIR, content_filename
+
+
+def media_app() -> FastAPI:
+    app = FastAPI()
+    app.include_router(media_router, prefix="/uploads")
+    return app
+
+
+def static_app() -> FastAPI:
+    app = FastAPI()
+    app.mount("/uploads", StaticFiles(directory=str(UPLOAD_DIR)), name="uploads")
+    return app
+
+
+def make_file(size: int) -> str:
+    """Write a content-named post image of the given size and return its URL"""
+    contents = b"\xff\xd8\xff\xe0" + os.urandom(size - 4)
+    filename = content_filename(hashlib.sha256(contents).hexdigest(), ".jpg")
+    path = POST_IMAGES_DIR / filename
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(contents)
+    return f"/uploads/post_images/{filename}"
+
+
+def remove_file(url: str) -> None:
+    path = UPLOAD_DIR / url.removeprefix("/uploads/")
+    path.unlink(missing_ok=True)
+    for directory in (path.parent, path.parent.parent):
+        if not any(directory.iterdir()):
+            directory.rmdir()
+
+
+async def run_scenario(app: FastAPI, url: str, headers: dict, requests: int, concurrency: int) -> dict:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        # Revalidation needs the validator this app hands out
+        if headers.get("if-none-match") == "<etag>":
+            headers = {"if-none-match": (await client.get(url)).headers["etag"]}
+        
+        remaining = requests
+        statuses: dict[int, int] = {}
+        received = 0
+        
+        async def worker():
+            nonlocal remaining, received
+            while remaining > 0:
+                remaining -= 1
+                response = await client.get(url, headers=headers)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+                received += len(response.content)
+        
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        seconds = time.perf_counter() - start
+    
+    return {
+        "requests_per_second": round(requests / seconds),
+        "mb_per_second": round(received / seconds / 1024 / 1024, 1),
+        "statuses": statuses,
+    }
+
+
+async def main(requests: int, concurrency: int, large_size: int) -> dict:
+    large = make_file(large_size)
+    scenarios = {
+        "small": ("/uploads/profile_pictures/default.jpg", {}),
+        "small_revalidate": ("/uploads/profile_pictures/default.jpg", {"if-none-match": "<etag>"}),
+        "large": (large, {}),
+        "large_range": (large, {"range": "bytes=0-65535"}),
+    }
+    
+    results = {}
+    try:
+        for name, (url, headers) in scenarios.items():
+            results[name] = {
+                "media": await run_scenario(media_app(), url, headers, requests, concurrency),
+                "static": await run_scenario(static_app(), url, headers, requests, concurrency),
+            }
+    finally:
+        remove_file(large)
+    
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--large-size", type=int, default=1024 * 1024, help="large file size in bytes")
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(main(args.requests, args.concurrency, args.large_size)), indent=2))
@@ -0,0 +1,162 @@
+"""
+Request metrics overhead benchmark
+
+Measures what app.metrics adds: the middleware around a bare ASGI app, the
+cursor listeners around a trivial statement, and a real cached route
+(GET /api/users/{id}) through the whole app with and without metrics. Also
+reports the memory retained per request, which should be zero once a
+route's series exists.
+
+    python -m benchmarks.metrics --requests 20000
+
+Set DATABASE_URL to run against another database; by default a temporary
+SQLite file is used.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'metrics.db')}")
+
+import httpx  # noqa: E402
+from sqlalchemy import create_engine, event, text  # noqa: E402
+
+from app import metrics  # noqa: E402
+from app.database import sync_engines  # noqa: E402
+from app.main import app  # noqa: E402
+
+SCOPE = {"type": "http", "method": "GET", "path": "/bench", "path_params": {}, "headers": []}
+
+
+async def bare_app(scope, receive, send):
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"ok"})
+
+
+async def call(asgi_app, requests: int) -> float:
+    """Seconds per direct call of an ASGI app"""
+    async def receive():
+        return {"type": "http.request"}
+    
+    async def send(message):
+        pass
+    
+    start = time.perf_counter()
+    for _ in range(requests):
+        await asgi_app(SCOPE, receive, send)
+    return (time.perf_counter() - start) / requests
+
+
+async def middleware_overhead(requests: int) -> dict:
+    registry = metrics.MetricsRegistry()
+    wrapped = metrics.MetricsMiddleware(bare_app, registry)
+    await call(wrapped, 100)
+    
+    bare = await call(bare_app, requests)
+    timed = await call(wrapped, requests)
+    
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    await call(wrapped, requests)
+    retained = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return {
+        "bare_us": round(bare * 1e6, 2),
+        "with_middleware_us": round(timed * 1e6, 2),
+        "overhead_us": round((timed - bare) * 1e6, 2),
+        "retained_bytes_per_request": round(retained / requests, 3),
+    }
+
+
+def statement_overhead(statements: int) -> dict:
+    db_engine = create_engine("sqlite://")
+    
+    def run() -> float:
+        with db_engine.connect() as conn:
+            start = time.perf_counter()
+            for _ in range(statements):
+                conn.execute(text("SELECT 1"))
+            return (time.perf_counter() - start) / statements
+    
+    run()
+    bare = run()
+    metrics.instrument_engine(db_engine)
+    token = metrics._request_sql.set(metrics.RequestSQL())
+    try:
+        timed = run()
+    finally:
+        metrics._request_sql.reset(token)
+    return {
+        "bare_us": round(bare * 1e6, 2),
+        "with_listeners_us": round(timed * 1e6, 2),
+        "overhead_us": round((timed - bare) * 1e6, 2),
+    }
+
+
+def build_stacks() -> dict:
+    """The app's middleware stack with and without MetricsMiddleware, to swap in between rounds"""
+    with_metrics = app.build_middleware_stack()
+    app.user_middleware = [m for m in app.user_middleware if m.cls is not metrics.MetricsMiddleware]
+    without_metrics = app.build_middleware_stack()
+    return {True: with_metrics, False: without_metrics}
+
+
+def set_metrics(stacks: dict, enabled: bool) -> None:
+    app.middleware_stack = stacks[enabled]
+    for db_engine in sync_engines():
+        if enabled:
+            metrics.instrument_engine(db_engine)
+        elif event.contains(db_engine, "after_cursor_execute", metrics._after_cursor_execute):
+            event.remove(db_engine, "before_cursor_execute", metrics._before_cursor_execute)
+            event.remove(db_engine, "after_cursor_execute", metrics._after_cursor_execute)
+
+
+async def route_overhead(requests: int, rounds: int) -> dict:
+    """GET /api/users/{id} with and without metrics, alternating rounds to spread out noise"""
+    samples = {True: [], False: []}
+    stacks = build_stacks()
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench/api") as client:
+            response = await client.post("/users/", json={
+                "username": f"m{time.time_ns()}", "email": f"m{time.time_ns()}@example.com", "full_name": "M"
+            })
+            url = f"/users/{response.json()['id']}"
+            for _ in range(rounds):
+                for enabled in (False, True):
+                    set_metrics(stacks, enabled)
+                    start = time.perf_counter()
+                    for _ in range(requests // rounds):
+                        await client.get(url)
+                    samples[enabled].append((time.perf_counter() - start) / (requests // rounds))
+    set_metrics(stacks, True)
+    
+    bare, timed = float(np.median(samples[False])), float(np.median(samples[True]))
+    return {
+        "without_metrics_us": round(bare * 1e6, 1),
+        "with_metrics_us": round(timed * 1e6, 1),
+        "overhead_percent": round((timed - bare) / bare * 100, 2),
+    }
+
+
+async def run(requests: int, rounds: int) -> dict:
+    return {
+        "middleware": await middleware_overhead(requests),
+        "sql_listeners": statement_overhead(requests),
+        "cached_route": await route_overhead(requests, rounds),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--rounds", type=int, default=10, help="alternations of the with/without route runs")
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args.requests, args.rounds)), indent=2))
@@ -0,0 +1,276 @@
+"""
+Live update (pub/sub) benchmark
+
+Three parts:
+
+- broker: N in-process subscribers, each a task waiting on its queue, all
+  subscribed to one post. Reports the time of publish() itself, the delay
+  until the median and the last subscriber had the event, deliveries per
+  second and the memory per subscriber, for growing N. The largest N whose
+  p99 delay to the last subscriber stays under --budget-ms is the worst-case
+  capacity of one worker (one event loop), with every subscriber on one
+  topic; with events reaching a few subscribers each, memory and deliveries
+  per second are the limit. Also times publishing a post to
+  FEED_FANOUT_MAX_FRIENDS feed topics among N idle subscribers.
+- bridge: the same delivery through a second broker over the Unix datagram
+  socket bridge, as between two workers.
+- sse: --connections real SSE clients against uvicorn (--workers, bridged
+  when more than one), all watching one post; reports the delay from
+  POST /comments to each client having the event (the clients run in this
+  process, so their parsing is included), and the server's memory per open
+  connection (single worker only).
+    
+    python -m benchmarks.pubsub --subscribers 1000 10000 100000 --connections 1000
+
+Set DATABASE_URL to run against another database; by default a temporary
+SQLite file is used.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'pubsub.db')}")
+
+import httpx  # noqa: E402
+
+import app.main  # noqa: E402,F401  (creates the tables before the workers start)
+from app import pubsub  # noqa: E402
+from app.config import settings  # noqa: E402
+from benchmarks.scenarios import uvicorn_server  # noqa: E402
+
+EVENT = json.dumps({"type": "comment.created", "data": {"id": 1, "content": "x" * 200}})
+
+
+def percentiles(seconds: list[float]) -> dict:
+    values = np.array(seconds) * 1e3
+    return {
+        "p50_ms": round(float(np.percentile(values, 50)), 3),
+        "p99_ms": round(float(np.percentile(values, 99)), 3),
+        "max_ms": round(float(values.max()), 3),
+    }
+
+
+async def consume(subscription: pubsub.Subscription, received: list, done: asyncio.Event, expected: int) -> None:
+    """Record when each event arrives; set done once `expected` have"""
+    try:
+        while True:
+            for _ in await subscription.get():
+                received.append(time.perf_counter())
+                if len(received) == expected:
+                    done.set()
+    except pubsub.SubscriptionClosed:
+        pass
+
+
+async def measure_delivery(publisher: pubsub.Broker, receiver: pubsub.Broker, subscribers: int, events: int) -> dict:
+    """Publish `events` events on publisher, one at a time, to `subscribers` subscriptions on receiver"""
+    subscriptions = [receiver.subscribe(["post:1"]) for _ in range(subscribers)]
+    received, done = [], asyncio.Event()
+    tasks = [asyncio.create_task(consume(subscription, received, done, subscribers)) for subscription in subscriptions]
+    await asyncio.sleep(0)
+    
+    publish_seconds, median_seconds, last_seconds = [], [], []
+    for _ in range(events):
+        received.clear()
+        done.clear()
+        start = time.perf_counter()
+        publisher.publish(["post:1"], EVENT)
+        publish_seconds.append(time.perf_counter() - start)
+        await done.wait()
+        median_seconds.append(float(np.median(received)) - start)
+        last_seconds.append(max(received) - start)
+    
+    for subscription in subscriptions:
+        receiver.unsubscribe(subscription)
+    await asyncio.gather(*tasks)
+    return {
+        "publish": percentiles(publish_seconds),
+        "median_subscriber": percentiles(median_seconds),
+        "last_subscriber": percentiles(last_seconds),
+    }
+
+
+async def subscriber_memory(subscribers: int) -> float:
+    """Bytes per idle subscription with its consumer task"""
+    broker = pubsub.Broker(settings.PUBSUB_QUEUE_SIZE)
+    received, done = [], asyncio.Event()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    subscriptions = [broker.subscribe([f"feed:{i}", "post:1"]) for i in range(subscribers)]
+    tasks = [asyncio.create_task(consume(subscription, received, done, 0)) for subscription in subscriptions]
+    await asyncio.sleep(0)
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    broker.stop()
+    await asyncio.gather(*tasks)
+    return used / subscribers
+
+
+async def feed_publish(subscribers: int, events: int) -> dict:
+    """publish() of a post to an author's own and FEED_FANOUT_MAX_FRIENDS friends' feeds"""
+    broker = pubsub.Broker(events + 1)
+    subscriptions = [broker.subscribe([f"feed:{i}"]) for i in range(subscribers)]
+    topics = [f"feed:{i}" for i in range(settings.FEED_FANOUT_MAX_FRIENDS + 1)]
+    seconds = []
+    for _ in range(events):
+        start = time.perf_counter()
+        broker.publish(topics, EVENT)
+        seconds.append(time.perf_counter() - start)
+    broker.stop()
+    return {"topics": len(topics), "subscribers": len(subscriptions), **percentiles(seconds)}
+
+
+async def broker_sweep(counts: list[int], events: int, budget_ms: float) -> dict:
+    results = []
+    capacity = 0
+    for count in counts:
+        broker = pubsub.Broker(settings.PUBSUB_QUEUE_SIZE)
+        delivery = await measure_delivery(broker, broker, count, events)
+        results.append({
+            "subscribers": count,
+            "bytes_per_subscriber": round(await subscriber_memory(count)),
+            "deliveries_per_second": round(count / delivery["last_subscriber"]["p50_ms"] * 1e3),
+            **delivery,
+        })
+        if delivery["last_subscriber"]["p99_ms"] <= budget_ms:
+            capacity = count
+    return {
+        "budget_ms": budget_ms,
+        "max_subscribers_on_one_topic_within_budget": capacity,
+        "sweep": results,
+        "feed_post": await feed_publish(max(counts), events),
+    }
+
+
+async def bridge(subscribers: int, events: int) -> dict:
+    socket_dir = tempfile.mkdtemp()
+    # Two brokers in one process stand in for two workers, so they need their own socket names
+    publisher = pubsub.Broker(settings.PUBSUB_QUEUE_SIZE, socket_dir, name="publisher")
+    receiver = pubsub.Broker(settings.PUBSUB_QUEUE_SIZE, socket_dir, name="receiver")
+    receiver.start()
+    publisher.start()
+    try:
+        result = await measure_delivery(publisher, receiver, subscribers, events)
+    finally:
+        publisher.stop()
+        receiver.stop()
+    return {"subscribers": subscribers, **result, "dropped": publisher.dropped}
+
+
+def rss_bytes(pid: int) -> int:
+    with open(f"/proc/{pid}/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def server_pid(port: int):
+    """Pid of the uvicorn process started for a port, from /proc (Linux only)"""
+    for entry in os.scandir("/proc"):
+        if not entry.name.isdigit():
+            continue
+        try:
+            with open(f"{entry.path}/cmdline", "rb") as cmdline:
+                args = cmdline.read().split(b"\0")
+        except OSError:
+            continue
+        if b"uvicorn" in args and str(port).encode() in args:
+            return int(entry.name)
+    return None
+
+
+async def sse_client(client: httpx.AsyncClient, url: str, connected: list, received: list) -> None:
+    async with client.stream("GET", url) as response:
+        async for line in response.aiter_lines():
+            if line.startswith(":"):
+                if line == ": subscribed":
+                    connected.append(True)
+            elif line.startswith("data: "):
+                received.append(time.perf_counter())
+
+
+async def sse(connections: int, events: int, workers: int) -> dict:
+    if workers > 1:
+        os.environ["PUBSUB_SOCKET_DIR"] = tempfile.mkdtemp()
+    async with uvicorn_server(workers) as base_url:
+        async with httpx.AsyncClient(base_url=f"{base_url}/api", timeout=60) as client:
+            tag = time.time_ns()
+            user = (await client.post("/users/", json={
+                "username": f"sse{tag}", "email": f"sse{tag}@example.com", "full_name": "SSE"
+            })).json()["id"]
+            post = (await client.post("/posts/", json={"content": "live", "user_id": user})).json()["id"]
+            pid = server_pid(int(base_url.rsplit(":", 1)[1])) if workers == 1 else None
+            rss_before = rss_bytes(pid) if pid else None
+            
+            connected, received = [], []
+            limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+            async with httpx.AsyncClient(base_url=f"{base_url}/api", timeout=None, limits=limits) as streams:
+                tasks = [
+                    asyncio.create_task(sse_client(streams, f"/live/events?posts={post}", connected, received))
+                    for _ in range(connections)
+                ]
+                started = time.perf_counter()
+                while len(connected) < connections:
+                    await asyncio.sleep(0.05)
+                connect_seconds = time.perf_counter() - started
+                rss_after = rss_bytes(pid) if pid else None
+                # Let every worker see the others' sockets
+                await asyncio.sleep(pubsub.PEER_REFRESH_SECONDS * 1.5)
+                
+                post_seconds, median_seconds, last_seconds, missing = [], [], [], 0
+                for _ in range(events):
+                    received.clear()
+                    start = time.perf_counter()
+                    await client.post("/comments/", json={"content": "hello", "user_id": user, "post_id": post})
+                    post_seconds.append(time.perf_counter() - start)
+                    deadline = time.perf_counter() + 5
+                    while len(received) < connections and time.perf_counter() < deadline:
+                        await asyncio.sleep(0.001)
+                    missing += connections - len(received)
+                    if not received:
+                        continue
+                    median_seconds.append(float(np.median(received)) - start)
+                    last_seconds.append(max(received) - start)
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+    
+    result = {
+        "connections": connections,
+        "workers": workers,
+        "connect_seconds": round(connect_seconds, 2),
+        "post_comment": percentiles(post_seconds),
+        "median_client": percentiles(median_seconds),
+        "last_client": percentiles(last_seconds),
+        "missed_events": missing,
+    }
+    if rss_before is not None:
+        result["server_bytes_per_connection"] = round((rss_after - rss_before) / connections)
+    return result
+
+
+async def run(subscribers: list[int], events: int, budget_ms: float, connections: int, workers: int) -> dict:
+    report = {"broker": await broker_sweep(subscribers, events, budget_ms)}
+    report["bridge"] = await bridge(min(subscribers), events)
+    if connections:
+        report["sse"] = await sse(connections, events, workers)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--subscribers", type=int, nargs="+", default=[1000, 10000, 50000, 100000])
+    parser.add_argument("--events", type=int, default=50, help="events published per measurement")
+    parser.add_argument("--budget-ms", type=float, default=50, help="p99 delay to the last subscriber that still counts")
+    parser.add_argument("--connections", type=int, default=1000, help="SSE clients against uvicorn (0 to skip)")
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args.subscribers, args.events, args.budget_ms, args.connections, args.workers)), indent=2))
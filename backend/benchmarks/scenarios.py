@@ -0,0 +1,474 @@
+"""
+Route scenarios
+
+Sends a request mix to every API route (everything routes/router.py mounts
+under API_PREFIX) and reports, per scenario, p50/p95/p99 latency, throughput
+and SQL statements per request. The app is driven in-process through ASGI
+and as a uvicorn server over HTTP, against the same database. Results are
+written as JSON; --compare adds the change against an earlier results file.
+
+    DATABASE_URL=sqlite:///bench.db python -m benchmarks.scenarios --output before.json
+    DATABASE_URL=sqlite:///bench.db python -m benchmarks.scenarios --output after.json --compare before.json
+
+A new database is filled with benchmarks.datagen first (--rows). Reads use ids
+sampled from the data; writes are made by users the run creates and deletes
+again, so repeated runs see the same dataset. Statements can only be counted
+in-process, so they are null for uvicorn.
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import platform
+import socket
+import subprocess
+import sys
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+
+import httpx
+from PIL import Image
+from sqlalchemy import event, func, inspect, select
+
+# Sets the default DATABASE_URL, so it comes before the app modules
+from benchmarks import datagen
+from app.config import settings
+from app.database import SessionLocal, engine, session_scope, sync_engines
+from app.models import Comment, Post, User
+from app.upload_utils import delete_upload_file
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+# Existing ids sampled for the read scenarios
+SAMPLE_SIZE = 10_000
+
+# Rows per request in the batch and bulk scenarios
+BATCH_SIZE = 10
+
+SERVER_START_SECONDS = 60
+
+# Long-lived streams aren't request/response scenarios; benchmarks.pubsub measures them
+STREAMING_ROUTES = {f"GET {settings.API_PREFIX}/live/events"}
+
+# Metrics compared against a baseline run
+COMPARED = ("p50_ms", "p95_ms", "p99_ms", "requests_per_second", "statements_per_request")
+
+
+class StatementCounter:
+    """Counts statements sent through the primary and replica engines"""
+    
+    def __init__(self):
+        self.count = 0
+        for db_engine in sync_engines():
+            event.listen(db_engine, "before_cursor_execute", self.record)
+    
+    def record(self, *args):
+        self.count += 1
+
+
+class Scenario:
+    """
+    One kind of request against one route
+    
+    make(state, rng, n) returns n (method, url, httpx keyword arguments)
+    tuples. collect(state, requests, responses), if set, is given the requests
+    that succeeded so later scenarios can use what they created.
+    """
+    
+    def __init__(self, name: str, route: str, expect: int, make, collect=None):
+        self.name = name
+        self.route = route
+        self.expect = expect
+        self.make = make
+        self.collect = collect
+
+
+def pick(rng: np.random.Generator, ids: list, n: int) -> list:
+    return rng.choice(ids, size=n).tolist() if ids else []
+
+
+def take(state: dict, key: str, n: int) -> list:
+    """Remove and return up to n created rows, so each is used by one request"""
+    taken, state[key] = state[key][:n], state[key][n:]
+    return taken
+
+
+def jpeg_bytes() -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 64), (200, 120, 40)).save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+def collect_created(key: str, *fields: str):
+    """Record fields of the row each successful create returned"""
+    def collect(state, requests, responses):
+        for response in responses:
+            body = response.json()
+            state[key].append(tuple(body[field] for field in fields) if len(fields) > 1 else body[fields[0]])
+    return collect
+
+
+def collect_pairs(state, requests, responses):
+    for _, _, kwargs in requests:
+        state["new_pairs"].append((kwargs["json"]["user_id"], kwargs["json"]["friend_id"]))
+
+
+def collect_uploads(upload_type: str):
+    def collect(state, requests, responses):
+        state["uploads"].extend((upload_type, response.json()["filename"]) for response in responses)
+    return collect
+
+
+def build_scenarios(tag: str) -> list[Scenario]:
+    """Every scenario, reads first; writes run in an order where each one's inputs exist"""
+    prefix = settings.API_PREFIX
+    image = ("bench.jpg", jpeg_bytes(), "image/jpeg")
+    
+    def get(url, params=None):
+        return ("GET", url, {"params": params} if params else {})
+    
+    def pages(rng, n, **params):
+        return [{"limit": 20, "skip": skip, **params} for skip in rng.integers(0, 500, size=n).tolist()]
+    
+    def id_lists(state, rng, key, n):
+        return [",".join(map(str, pick(rng, state[key], 20))) for _ in range(n)]
+    
+    def search_terms(state, rng, n):
+        # Drawn with the generator's word frequencies, so common words come up more often
+        words = state["words"]
+        return [words[i] for i in rng.choice(len(words), size=n, p=state["word_p"]).tolist()]
+    
+    def by_user(url, **params):
+        return lambda s, rng, n: [get(url.format(i), params or None) for i in pick(rng, s["users"], n)]
+    
+    def create_users(s, rng, n):
+        return [
+            ("POST", "/users/", {"json": {"username": f"b{tag}_{i}", "email": f"b{tag}_{i}@example.com", "full_name": f"Bench {i}"}})
+            for i in range(n)
+        ]
+    
+    def add_friends(s, rng, n):
+        return [
+            ("POST", "/friends/", {"json": {"user_id": user_id, "friend_id": friend_id}})
+            for user_id, friend_id in zip(s["new_users"], pick(rng, s["users"], n))
+        ]
+    
+    def import_friends(s, rng, n):
+        return [
+            ("POST", "/friends/bulk", {"json": [{"user_id": user_id, "friend_id": f} for f in pick(rng, s["users"], BATCH_SIZE)]})
+            for user_id in pick(rng, s["new_users"], n)
+        ]
+    
+    def create_posts(s, rng, n):
+        return [
+            ("POST", "/posts/", {"json": {"content": f"bench post {i}", "user_id": user_id}})
+            for i, user_id in enumerate(pick(rng, s["new_users"], n))
+        ]
+    
+    def create_post_batches(s, rng, n):
+        return [
+            ("POST", "/posts/batch", {"json": [{"content": f"bench post {j}", "user_id": user_id} for j in range(BATCH_SIZE)]})
+            for user_id in pick(rng, s["new_users"], n)
+        ]
+    
+    def create_comments(s, rng, n):
+        return [
+            ("POST", "/comments/", {"json": {"content": f"bench comment {i}", "user_id": user_id, "post_id": post_id}})
+            for i, (user_id, post_id) in enumerate(zip(pick(rng, s["new_users"], n), pick(rng, s["posts"], n)))
+        ]
+    
+    def create_comment_batches(s, rng, n):
+        return [
+            ("POST", "/comments/batch", {"json": [
+                {"content": f"bench comment {j}", "user_id": user_id, "post_id": post_id}
+                for j, post_id in enumerate(pick(rng, s["posts"], BATCH_SIZE))
+            ]})
+            for user_id in pick(rng, s["new_users"], n)
+        ]
+    
+    return [
+        # Reads of the generated data
+        Scenario("list_users", f"GET {prefix}/users/", 200,
+                 lambda s, rng, n: [get("/users/", p) for p in pages(rng, n)]),
+        Scenario("get_users_by_ids", f"GET {prefix}/users/", 200,
+                 lambda s, rng, n: [get("/users/", {"ids": ids}) for ids in id_lists(s, rng, "users", n)]),
+        Scenario("get_user", f"GET {prefix}/users/{{user_id}}", 200, by_user("/users/{}")),
+        Scenario("list_posts", f"GET {prefix}/posts/", 200,
+                 lambda s, rng, n: [get("/posts/", p) for p in pages(rng, n)]),
+        Scenario("get_posts_by_ids", f"GET {prefix}/posts/", 200,
+                 lambda s, rng, n: [get("/posts/", {"ids": ids}) for ids in id_lists(s, rng, "posts", n)]),
+        Scenario("get_post", f"GET {prefix}/posts/{{post_id}}", 200,
+                 lambda s, rng, n: [get(f"/posts/{i}") for i in pick(rng, s["posts"], n)]),
+        Scenario("user_posts", f"GET {prefix}/posts/user/{{user_id}}", 200, by_user("/posts/user/{}", limit=20)),
+        Scenario("get_comments_by_ids", f"GET {prefix}/comments/", 200,
+                 lambda s, rng, n: [get("/comments/", {"ids": ids}) for ids in id_lists(s, rng, "comments", n)]),
+        Scenario("get_comment", f"GET {prefix}/comments/{{comment_id}}", 200,
+                 lambda s, rng, n: [get(f"/comments/{i}") for i in pick(rng, s["comments"], n)]),
+        Scenario("post_comments", f"GET {prefix}/comments/post/{{post_id}}", 200,
+                 lambda s, rng, n: [get(f"/comments/post/{i}", {"limit": 20}) for i in pick(rng, s["commented_posts"], n)]),
+        Scenario("get_friends", f"GET {prefix}/friends/{{user_id}}", 200, by_user("/friends/{}")),
+        Scenario("friend_suggestions", f"GET {prefix}/friends/{{user_id}}/suggestions", 200, by_user("/friends/{}/suggestions")),
+        Scenario("search", f"GET {prefix}/search/", 200,
+                 lambda s, rng, n: [get("/search/", {"q": q}) for q in search_terms(s, rng, n)]),
+        Scenario("search_users", f"GET {prefix}/search/users", 200,
+                 lambda s, rng, n: [get("/search/users", {"q": q}) for q in search_terms(s, rng, n)]),
+        Scenario("search_posts", f"GET {prefix}/search/posts", 200,
+                 lambda s, rng, n: [get("/search/posts", {"q": q}) for q in search_terms(s, rng, n)]),
+        Scenario("public_feed", f"GET {prefix}/feed/public", 200,
+                 lambda s, rng, n: [get("/feed/public", p) for p in pages(rng, n)]),
+        Scenario("public_feed_ranked", f"GET {prefix}/feed/public", 200,
+                 lambda s, rng, n: [get("/feed/public", {"mode": "ranked", "limit": 20})] * n),
+        Scenario("user_feed", f"GET {prefix}/feed/{{user_id}}", 200, by_user("/feed/{}", limit=20)),
+        Scenario("user_feed_ranked", f"GET {prefix}/feed/{{user_id}}", 200, by_user("/feed/{}", mode="ranked", limit=20)),
+        
+        # Writes by the run's own users
+        Scenario("create_user", f"POST {prefix}/users/", 201, create_users, collect_created("new_users", "id")),
+        Scenario("update_user", f"PUT {prefix}/users/{{user_id}}", 200,
+                 lambda s, rng, n: [("PUT", f"/users/{i}", {"json": {"bio": f"bio {i}"}}) for i in pick(rng, s["new_users"], n)]),
+        Scenario("add_friend", f"POST {prefix}/friends/", 201, add_friends, collect_pairs),
+        Scenario("import_friends", f"POST {prefix}/friends/bulk", 201, import_friends),
+        Scenario("create_post", f"POST {prefix}/posts/", 201, create_posts, collect_created("new_posts", "id", "user_id")),
+        Scenario("create_posts_batch", f"POST {prefix}/posts/batch", 201, create_post_batches),
+        Scenario("update_post", f"PUT {prefix}/posts/{{post_id}}", 200,
+                 lambda s, rng, n: [("PUT", f"/posts/{i}", {"json": {"content": f"edited {i}"}}) for i, _ in s["new_posts"][:n]]),
+        Scenario("create_comment", f"POST {prefix}/comments/", 201, create_comments, collect_created("new_comments", "id")),
+        Scenario("create_comments_batch", f"POST {prefix}/comments/batch", 201, create_comment_batches),
+        Scenario("upload_profile_picture", f"POST {prefix}/upload/profile-picture", 200,
+                 lambda s, rng, n: [("POST", "/upload/profile-picture", {"files": {"file": image}})] * n,
+                 collect_uploads("profile")),
+        Scenario("upload_post_image", f"POST {prefix}/upload/post-image", 200,
+                 lambda s, rng, n: [("POST", "/upload/post-image", {"files": {"file": image}})] * n,
+                 collect_uploads("post")),
+        Scenario("delete_comment", f"DELETE {prefix}/comments/{{comment_id}}", 204,
+                 lambda s, rng, n: [("DELETE", f"/comments/{i}", {}) for i in take(s, "new_comments", n)]),
+        Scenario("delete_post", f"DELETE {prefix}/posts/{{post_id}}", 204,
+                 lambda s, rng, n: [("DELETE", f"/posts/{i}", {"params": {"user_id": u}}) for i, u in take(s, "new_posts", n)]),
+        Scenario("remove_friend", f"DELETE {prefix}/friends/", 204,
+                 lambda s, rng, n: [("DELETE", "/friends/", {"json": {"user_id": u, "friend_id": f}}) for u, f in take(s, "new_pairs", n)]),
+        # Takes the batch posts, batch comments and imported friendships with it
+        Scenario("delete_user", f"DELETE {prefix}/users/{{user_id}}", 204,
+                 lambda s, rng, n: [("DELETE", f"/users/{i}", {"params": {"current_user_id": i}}) for i in take(s, "new_users", n)]),
+    ]
+
+
+def api_routes(app) -> set[str]:
+    """'METHOD path' of every route under API_PREFIX"""
+    prefix = settings.API_PREFIX + "/"
+    return {
+        f"{method.upper()} {path}"
+        for path, operations in app.openapi()["paths"].items() if path.startswith(prefix)
+        for method in operations
+    }
+
+
+def sample_state(seed: int) -> dict:
+    """Ids of existing rows for the read scenarios to pick from"""
+    rng = np.random.default_rng(seed)
+    
+    def sample(ids):
+        return rng.choice(ids, size=min(SAMPLE_SIZE, len(ids)), replace=False).tolist() if ids else []
+    
+    with SessionLocal() as db:
+        state = {
+            "users": sample(db.scalars(select(User.id)).all()),
+            "posts": sample(db.scalars(select(Post.id)).all()),
+            "commented_posts": sample(db.scalars(select(Comment.post_id).distinct()).all()),
+        }
+        state["comments"] = sample(db.scalars(
+            select(Comment.id).where(Comment.post_id.in_(state["commented_posts"][:1000]))
+        ).all())
+        state["dataset"] = {
+            model.__tablename__: db.scalar(select(func.count()).select_from(model)) for model in (User, Post, Comment)
+        }
+    
+    state["words"] = datagen.vocabulary()
+    state["word_p"] = datagen.zipf_probabilities(rng, len(state["words"]), 1.0, shuffle=False)
+    return state
+
+
+async def run_scenario(client: httpx.AsyncClient, scenario: Scenario, state: dict, rng, requests: int, concurrency: int, counter) -> dict:
+    """Send a scenario's requests from `concurrency` workers; report latency, throughput and statements"""
+    batch = scenario.make(state, rng, requests)
+    if not batch:
+        return {"requests": 0}
+    
+    queue = asyncio.Queue()
+    for index in range(len(batch)):
+        queue.put_nowait(index)
+    latencies = np.empty(len(batch))
+    responses = [None] * len(batch)
+    
+    async def worker():
+        while not queue.empty():
+            index = queue.get_nowait()
+            method, url, kwargs = batch[index]
+            start = time.perf_counter()
+            responses[index] = await client.request(method, url, **kwargs)
+            latencies[index] = time.perf_counter() - start
+    
+    statements = counter.count if counter else 0
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    
+    succeeded = [i for i, response in enumerate(responses) if response.status_code == scenario.expect]
+    failures = [responses[i] for i in range(len(batch)) if responses[i].status_code != scenario.expect]
+    if scenario.collect:
+        scenario.collect(state, [batch[i] for i in succeeded], [responses[i] for i in succeeded])
+    
+    samples = latencies * 1e3
+    return {
+        "route": scenario.route,
+        "requests": len(batch),
+        "requests_per_second": round(len(batch) / elapsed, 1),
+        "p50_ms": round(float(np.percentile(samples, 50)), 2),
+        "p95_ms": round(float(np.percentile(samples, 95)), 2),
+        "p99_ms": round(float(np.percentile(samples, 99)), 2),
+        "statements_per_request": round((counter.count - statements) / len(batch), 2) if counter else None,
+        "failures": len(failures),
+        "first_failure": f"{failures[0].status_code} {failures[0].text[:200]}" if failures else None,
+    }
+
+
+async def release_uploads(uploads: list) -> None:
+    """Drop the references the upload scenarios added"""
+    async with session_scope() as db:
+        for upload_type, filename in uploads:
+            await delete_upload_file(db, filename, upload_type=upload_type)
+        await db.commit()
+
+
+async def run_mode(client: httpx.AsyncClient, sampled: dict, requests: int, concurrency: int, seed: int, counter=None) -> dict:
+    rng = np.random.default_rng(seed)
+    state = {**sampled, "new_users": [], "new_posts": [], "new_comments": [], "new_pairs": [], "uploads": []}
+    results = {}
+    try:
+        for scenario in build_scenarios(f"{seed}{time.time_ns()}"):
+            results[scenario.name] = await run_scenario(client, scenario, state, rng, requests, concurrency, counter)
+    finally:
+        await release_uploads(state["uploads"])
+    return results
+
+
+@asynccontextmanager
+async def uvicorn_server(workers: int):
+    """Serve app.main:app with uvicorn on a free local port, against the same DATABASE_URL"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning"],
+        cwd=BACKEND_DIR,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        deadline = time.monotonic() + SERVER_START_SECONDS
+        async with httpx.AsyncClient() as probe:
+            while True:
+                try:
+                    await probe.get(f"{base_url}/health")
+                    break
+                except httpx.TransportError:
+                    if process.poll() is not None or time.monotonic() > deadline:
+                        raise RuntimeError("uvicorn did not start")
+                    await asyncio.sleep(0.2)
+        yield base_url
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+
+def git_commit():
+    try:
+        completed = subprocess.run(["git", "rev-parse", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True)
+    except OSError:
+        return None
+    return completed.stdout.strip() or None
+
+
+async def run(modes: list[str], requests: int, concurrency: int, workers: int, seed: int) -> dict:
+    # Imported here so a new database is generated before app startup touches it
+    from app.main import app
+    
+    sampled = sample_state(seed)
+    results = {}
+    if "asgi" in modes:
+        counter = StatementCounter()
+        async with app.router.lifespan_context(app):
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url=f"http://bench{settings.API_PREFIX}") as client:
+                results["asgi"] = await run_mode(client, sampled, requests, concurrency, seed, counter)
+    if "uvicorn" in modes:
+        async with uvicorn_server(workers) as base_url:
+            limits = httpx.Limits(max_connections=concurrency)
+            async with httpx.AsyncClient(base_url=f"{base_url}{settings.API_PREFIX}", limits=limits, timeout=60) as client:
+                results["uvicorn"] = await run_mode(client, sampled, requests, concurrency, seed)
+    
+    covered = {scenario.route for scenario in build_scenarios("")}
+    return {
+        "meta": {
+            "started_at": datetime.now(timezone.utc).isoformat(),
+            "git_commit": git_commit(),
+            "python": platform.python_version(),
+            "database": engine.url.render_as_string(hide_password=True),
+            "dataset": sampled["dataset"],
+            "requests": requests,
+            "concurrency": concurrency,
+            "uvicorn_workers": workers,
+            "seed": seed,
+            "db_async": settings.DB_ASYNC,
+            "cache_backend": settings.CACHE_BACKEND,
+        },
+        "uncovered_routes": sorted(api_routes(app) - covered - STREAMING_ROUTES),
+        "results": results,
+    }
+
+
+def compare(report: dict, baseline: dict) -> dict:
+    """Percent change of each metric against a baseline report, per mode and scenario"""
+    changes = {}
+    for mode, scenarios in report["results"].items():
+        for name, current in scenarios.items():
+            before = baseline.get("results", {}).get(mode, {}).get(name)
+            if not before:
+                continue
+            changes.setdefault(mode, {})[name] = {
+                metric: round((current[metric] - before[metric]) / before[metric] * 100, 1)
+                if current.get(metric) is not None and before.get(metric) else None
+                for metric in COMPARED
+            }
+    return changes
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100_000, help="rows to generate if the database is new")
+    parser.add_argument("--requests", type=int, default=200, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--modes", nargs="+", choices=["asgi", "uvicorn"], default=["asgi", "uvicorn"])
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results JSON here")
+    parser.add_argument("--compare", help="earlier results JSON to compare against")
+    args = parser.parse_args()
+    
+    generated = None
+    if not inspect(engine).has_table(User.__tablename__):
+        generated = datagen.generate(args.rows, seed=args.seed)
+    report = asyncio.run(run(args.modes, args.requests, args.concurrency, args.workers, args.seed))
+    report["meta"]["generated"] = generated
+    if args.compare:
+        with open(args.compare) as f:
+            report["comparison"] = compare(report, json.load(f))
+    
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    print(output)
@@ -0,0 +1,130 @@
+"""
+Response serialization benchmark
+
+Serializes a 100-item page of ORM objects the way each endpoint did before it
+declared a response model (jsonable_encoder walking the instances, then
+json.dumps) and the way it does now (the route's precompiled pydantic
+validator and serializer, straight to JSON bytes). Also shows jsonable_encoder
+followed by orjson, the usual "fast JSON response class", for comparison.
+
+    python -m benchmarks.serialization --items 100 --rounds 200
+"""
+
+import argparse
+import json
+import time
+from datetime import datetime, timedelta, timezone
+from typing import List
+
+import numpy as np
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+from sqlalchemy.orm.attributes import set_committed_value
+
+from app.models import Comment, Post, User
+from app.schemas import CommentResponse, Page, PostResponse, UserResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def make_user(user_id: int, created_at: datetime) -> User:
+    return User(
+        id=user_id,
+        username=f"user{user_id}",
+        email=f"user{user_id}@example.com",
+        full_name=f"User {user_id}",
+        bio="Likes long walks and short posts",
+        profile_picture="/uploads/profile_pictures/default.jpg",
+        is_admin=0,
+        post_count=12,
+        friend_count=34,
+        created_at=created_at,
+    )
+
+
+def make_items(items: int) -> dict:
+    """ORM instances (not attached to a session) shaped like each endpoint's page"""
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    users = [make_user(i, now - timedelta(days=i)) for i in range(1, items + 1)]
+    posts = [
+        Post(
+            id=i,
+            content="Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 3,
+            image_url=None,
+            comment_count=5,
+            created_at=now - timedelta(minutes=i),
+            updated_at=now - timedelta(minutes=i),
+            user_id=users[i - 1].id,
+        )
+        for i in range(1, items + 1)
+    ]
+    comments = [
+        Comment(
+            id=i,
+            content="Nice post!",
+            created_at=now - timedelta(seconds=i),
+            user_id=users[i - 1].id,
+            post_id=1,
+        )
+        for i in range(1, items + 1)
+    ]
+    # As joinedload leaves them: author loaded, the author's collections not
+    for row, author in zip(posts + comments, users + users):
+        set_committed_value(row, "author", author)
+    return {
+        "GET /posts/": (Page[PostResponse], {"items": posts, "count": items, "next_cursor": "abc"}),
+        "GET /comments/post/{id}": (Page[CommentResponse], {"items": comments, "count": items, "next_cursor": "abc"}),
+        "GET /users/": (Page[UserResponse], {"items": users, "count": items, "next_cursor": "abc"}),
+        "GET /friends/{id}": (List[UserResponse], users),
+    }
+
+
+def encoder_json(content) -> bytes:
+    # FastAPI's path for routes without a response model
+    return json.dumps(
+        jsonable_encoder(content), ensure_ascii=False, allow_nan=False, separators=(",", ":")
+    ).encode("utf-8")
+
+
+def encoder_orjson(content) -> bytes:
+    return orjson.dumps(jsonable_encoder(content))
+
+
+def time_serializer(serialize, content, rounds: int) -> dict:
+    """Mean and p99 time to serialize one page, in microseconds"""
+    samples = np.empty(rounds)
+    for i in range(rounds):
+        start = time.perf_counter()
+        serialize(content)
+        samples[i] = time.perf_counter() - start
+    samples *= 1e6
+    return {"mean_us": round(float(samples.mean()), 1), "p99_us": round(float(np.percentile(samples, 99)), 1)}
+
+
+def run(items: int, rounds: int) -> dict:
+    results = {}
+    for endpoint, (model, content) in make_items(items).items():
+        adapter = TypeAdapter(model)
+        
+        def response_model(content, adapter=adapter):
+            return adapter.dump_json(adapter.validate_python(content, from_attributes=True))
+        
+        serializers = {"before": encoder_json, "after": response_model}
+        if orjson is not None:
+            serializers["encoder_orjson"] = encoder_orjson
+        
+        timings = {name: time_serializer(serialize, content, rounds) for name, serialize in serializers.items()}
+        timings["speedup"] = round(timings["before"]["mean_us"] / timings["after"]["mean_us"], 1)
+        results[endpoint] = timings
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, default=100, help="items per page")
+    parser.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args()
+    print(json.dumps(run(args.items, args.rounds), indent=2))
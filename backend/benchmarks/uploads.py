@@ -0,0 +1,101 @@
+"""
+Upload memory benchmark
+
+Saves N concurrent 5 MB uploads with save_upload_file and with the previous
+read-everything approach, and reports the peak Python heap (tracemalloc)
+during each batch. The streaming path should stay flat as N grows.
+
+    python -m benchmarks.uploads --concurrency 1 8 32
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+import uuid
+from pathlib import Path
+
+from fastapi import UploadFile
+
+from app.database import Base, engine, session_scope
+from app.upload_utils import save_upload_file, delete_upload_file, MAX_FILE_SIZE
+
+
+async def save_buffered(upload_file: UploadFile, target_dir: Path) -> str:
+    """The old upload path: whole body in memory, blocking write"""
+    content = await upload_file.read()
+    filename = f"{uuid.uuid4()}.jpg"
+    with open(target_dir / filename, "wb") as f:
+        f.write(content)
+    return filename
+
+
+def make_source(directory: Path, size: int) -> Path:
+    path = directory / "source.jpg"
+    with open(path, "wb") as f:
+        f.write(b"\xff\xd8\xff\xe0" + os.urandom(size - 4))
+    return path
+
+
+async def save_streaming(upload_file: UploadFile) -> str:
+    async with session_scope() as db:
+        return await save_upload_file(db, upload_file, upload_type="post")
+
+
+async def release(filenames: list[str]) -> None:
+    async with session_scope() as db:
+        for filename in filenames:
+            await delete_upload_file(db, filename, upload_type="post")
+        await db.commit()
+
+
+async def run_batch(save, source: Path, concurrency: int) -> tuple[dict, list[str]]:
+    files = [open(source, "rb") for _ in range(concurrency)]
+    uploads = [UploadFile(file=f, filename="photo.jpg") for f in files]
+    
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        filenames = await asyncio.gather(*(save(upload) for upload in uploads))
+    finally:
+        seconds = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        for f in files:
+            f.close()
+    
+    return {
+        "concurrency": concurrency,
+        "peak_heap_mb": round(peak / 1024 / 1024, 2),
+        "seconds": round(seconds, 3),
+    }, filenames
+
+
+async def main(concurrency_levels: list[int], size: int) -> dict:
+    results = {"streaming": [], "buffered": []}
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        source = make_source(tmp, size)
+        
+        for concurrency in concurrency_levels:
+            result, filenames = await run_batch(save_streaming, source, concurrency)
+            await release(filenames)
+            results["streaming"].append(result)
+            
+            result, _ = await run_batch(lambda upload: save_buffered(upload, tmp), source, concurrency)
+            results["buffered"].append(result)
+    
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--size", type=int, default=MAX_FILE_SIZE, help="upload size in bytes")
+    args = parser.parse_args()
+    
+    Base.metadata.create_all(bind=engine)
+    print(json.dumps(asyncio.run(main(args.concurrency, args.size)), indent=2))
@@ -0,0 +1,137 @@
+"""
+Write path load test
+
+Drives the write endpoints through the ASGI app with concurrent clients
+against a scratch database and reports, per operation, throughput, latency
+and how many SQL statements one request sent to the database.
+
+    python -m benchmarks.writes --requests 500 --concurrency 4
+
+Set DATABASE_URL to load-test another database; by default a temporary
+SQLite file is used.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'writes.db')}")
+
+import httpx  # noqa: E402
+from sqlalchemy import event  # noqa: E402
+
+from app.database import async_engine, engine  # noqa: E402
+from app.main import app  # noqa: E402
+
+
+class StatementCounter:
+    """Counts statements sent through the primary engines"""
+    
+    def __init__(self):
+        self.count = 0
+        for db_engine in (engine, async_engine.sync_engine):
+            event.listen(db_engine, "before_cursor_execute", self.record)
+    
+    def record(self, *args):
+        self.count += 1
+
+
+async def run_phase(client: httpx.AsyncClient, counter: StatementCounter, requests: list, concurrency: int, expect: int) -> dict:
+    """Send (method, url, json) requests from `concurrency` workers; report throughput and latency"""
+    queue = asyncio.Queue()
+    for request in requests:
+        queue.put_nowait(request)
+    latencies = []
+    failures = []
+    
+    async def worker():
+        while not queue.empty():
+            method, url, body = queue.get_nowait()
+            start = time.perf_counter()
+            response = await client.request(method, url, json=body)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code != expect:
+                failures.append(response.text[:200])
+    
+    statements = counter.count
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    samples = np.array(latencies) * 1e3
+    return {
+        "requests_per_second": round(len(requests) / elapsed, 1),
+        "p50_ms": round(float(np.percentile(samples, 50)), 2),
+        "p99_ms": round(float(np.percentile(samples, 99)), 2),
+        "statements_per_request": round((counter.count - statements) / len(requests), 2),
+        "failures": len(failures),
+        "first_failure": failures[0] if failures else None,
+    }
+
+
+async def run(requests: int, concurrency: int, seed: int) -> dict:
+    rng = np.random.default_rng(seed)
+    counter = StatementCounter()
+    tag = f"{seed}{int(time.time())}"
+    results = {}
+    
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench/api") as client:
+            results["create_user"] = await run_phase(client, counter, [
+                ("POST", "/users/", {"username": f"w{tag}_{i}", "email": f"w{tag}_{i}@example.com", "full_name": f"W {i}"})
+                for i in range(requests)
+            ], concurrency, 201)
+            user_ids = [user["id"] for user in (await client.get("/users/", params={"limit": requests * 2})).json()["items"]]
+            
+            results["update_user"] = await run_phase(client, counter, [
+                ("PUT", f"/users/{user_id}", {"bio": f"bio {i}"})
+                for i, user_id in enumerate(rng.choice(user_ids, size=requests).tolist())
+            ], concurrency, 200)
+            
+            results["create_post"] = await run_phase(client, counter, [
+                ("POST", "/posts/", {"content": f"post {i}", "user_id": user_id})
+                for i, user_id in enumerate(rng.choice(user_ids, size=requests).tolist())
+            ], concurrency, 201)
+            post_ids = [post["id"] for post in (await client.get("/posts/", params={"limit": requests * 2})).json()["items"]]
+            
+            results["create_comment"] = await run_phase(client, counter, [
+                ("POST", "/comments/", {"content": f"comment {i}", "user_id": user_id, "post_id": post_id})
+                for i, (user_id, post_id) in enumerate(zip(
+                    rng.choice(user_ids, size=requests).tolist(), rng.choice(post_ids, size=requests).tolist()
+                ))
+            ], concurrency, 201)
+            comment_ids = []
+            for post_id in set(post_ids):
+                page = (await client.get(f"/comments/post/{post_id}", params={"limit": 100})).json()
+                comment_ids.extend(comment["id"] for comment in page["items"])
+            
+            results["delete_comment"] = await run_phase(client, counter, [
+                ("DELETE", f"/comments/{comment_id}", None) for comment_id in comment_ids[:requests]
+            ], concurrency, 204)
+            
+            pairs = set()
+            while len(pairs) < min(requests, len(user_ids) * (len(user_ids) - 1) // 2):
+                a, b = sorted(rng.choice(user_ids, size=2, replace=False).tolist())
+                pairs.add((a, b))
+            results["add_friend"] = await run_phase(client, counter, [
+                ("POST", "/friends/", {"user_id": a, "friend_id": b}) for a, b in pairs
+            ], concurrency, 201)
+            
+            results["remove_friend"] = await run_phase(client, counter, [
+                ("DELETE", "/friends/", {"user_id": a, "friend_id": b}) for a, b in pairs
+            ], concurrency, 204)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=500, help="requests per operation")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args.requests, args.concurrency, args.seed)), indent=2))
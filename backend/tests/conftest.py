@@ -0,0 +1,57 @@
+"""
+Test fixtures
+
+The suite runs the app against a temporary SQLite database, created before
+the app is imported. Tests share one app, so each creates its own users
+(see make_user) rather than relying on an empty database.
+"""
+
+import itertools
+import os
+import tempfile
+
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'test.db')}"
+os.environ.setdefault("DATABASE_REPLICA_URLS", "[]")
+os.environ.setdefault("JOB_POLL_SECONDS", "0.05")
+
+import pytest  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+from app.database import SessionLocal  # noqa: E402
+from app.main import app  # noqa: E402
+
+_names = itertools.count(1)
+
+
+@pytest.fixture(scope="session")
+def client():
+    with TestClient(app) as test_client:
+        yield test_client
+
+
+@pytest.fixture
+def db():
+    with SessionLocal() as session:
+        yield session
+
+
+@pytest.fixture
+def make_user(client):
+    """Create a user with a unique name and return its JSON"""
+    def create(**fields) -> dict:
+        n = next(_names)
+        body = {"username": f"user{n}", "email": f"user{n}@example.com", "full_name": f"User {n}", **fields}
+        response = client.post("/api/users/", json=body)
+        assert response.status_code == 201, response.text
+        return response.json()
+    return create
+
+
+@pytest.fixture
+def make_post(client):
+    """Create a post and return its JSON"""
+    def create(user_id: int, content: str = "hello") -> dict:
+        response = client.post("/api/posts/", json={"content": content, "user_id": user_id})
+        assert response.status_code == 201, response.text
+        return response.json()
+    return create
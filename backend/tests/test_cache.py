@@ -0,0 +1,99 @@
+"""
+Response cache: tag invalidation, and reads through a lagging replica
+"""
+
+import os
+import tempfile
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import database
+from app.config import settings
+from app.database import create_db_async_engine, create_db_engine, to_async_url
+from app.main import app
+from app.replicas import Replica, copy_sqlite_database
+
+
+def test_hit_until_a_write_invalidates(client, make_user, make_post):
+    user = make_user()
+    post = make_post(user["id"], "before")
+
+    assert client.get(f"/api/posts/{post['id']}").headers["X-Cache"] == "MISS"
+    assert client.get(f"/api/posts/{post['id']}").headers["X-Cache"] == "HIT"
+
+    client.put(f"/api/posts/{post['id']}", json={"content": "after"})
+    response = client.get(f"/api/posts/{post['id']}")
+    assert response.headers["X-Cache"] == "MISS"
+    assert response.json()["content"] == "after"
+
+
+def test_author_changes_invalidate_embedded_copies(client, make_user, make_post):
+    user = make_user(full_name="Old Name")
+    post = make_post(user["id"])
+    client.get(f"/api/posts/{post['id']}")
+
+    client.put(f"/api/users/{user['id']}", json={"full_name": "New Name"})
+    assert client.get(f"/api/posts/{post['id']}").json()["author"]["full_name"] == "New Name"
+
+
+def test_new_posts_invalidate_first_feed_page(client, make_user, make_post):
+    user = make_user()
+    client.get(f"/api/posts/user/{user['id']}")
+    post = make_post(user["id"])
+    assert client.get(f"/api/posts/user/{user['id']}").json()["items"][0]["id"] == post["id"]
+
+
+@pytest.fixture
+def lagging_replica(monkeypatch):
+    """A replica holding a copy of the primary that is refreshed only by catch_up()"""
+    url = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'replica.db')}"
+    copy_sqlite_database(settings.DATABASE_URL, url)
+    replica = Replica(url, create_db_async_engine(to_async_url(url)), create_db_engine(url))
+    monkeypatch.setattr(database.replica_set, "replicas", [replica])
+
+    def catch_up():
+        copy_sqlite_database(settings.DATABASE_URL, url)
+    yield catch_up
+    replica.sync_engine.dispose()
+
+
+def test_stale_replica_reads_are_not_cached(make_user, lagging_replica):
+    user = make_user(full_name="Old Name")
+    lagging_replica()
+    # Separate clients: the writer gets the read-your-writes cookie, the reader doesn't
+    writer, reader = TestClient(app), TestClient(app)
+    url = f"/api/users/{user['id']}"
+
+    assert writer.put(url, json={"full_name": "New Name"}).status_code == 200
+    assert database.READ_PRIMARY_COOKIE in writer.cookies
+
+    # The replica hasn't seen the write: the old row is served but not cached
+    for _ in range(2):
+        response = reader.get(url)
+        assert response.json()["full_name"] == "Old Name"
+        assert response.headers["X-Cache"] == "MISS"
+
+    lagging_replica()
+    assert reader.get(url).json()["full_name"] == "New Name"
+
+
+def test_pinned_client_skips_the_cache(make_user, lagging_replica):
+    user = make_user(full_name="Old Name")
+    lagging_replica()
+    writer, reader = TestClient(app), TestClient(app)
+    url = f"/api/users/{user['id']}"
+
+    reader.get(url)
+    assert reader.get(url).headers["X-Cache"] == "MISS"
+
+    writer.put(url, json={"full_name": "New Name"})
+    for _ in range(2):
+        response = writer.get(url)
+        assert response.json()["full_name"] == "New Name"
+        assert response.headers["X-Cache"] == "MISS"
+
+    # The pinned read came from the primary, so it was cached for everyone
+    response = reader.get(url)
+    assert response.headers["X-Cache"] == "HIT"
+    assert response.json()["full_name"] == "New Name"
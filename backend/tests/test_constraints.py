@@ -0,0 +1,46 @@
+"""
+Writes rejected by the database's constraints map to 400/404
+"""
+
+MISSING = 10**9
+
+
+def test_taken_username_and_email(client, make_user):
+    user = make_user()
+    response = client.post("/api/users/", json={"username": user["username"], "email": "other@example.com", "full_name": "X"})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Username already exists"
+
+    other = make_user()
+    response = client.put(f"/api/users/{other['id']}", json={"email": user["email"]})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Email already exists"
+
+
+def test_missing_references(client, make_user, make_post):
+    user = make_user()
+    post = make_post(user["id"])
+
+    response = client.post("/api/posts/", json={"content": "x", "user_id": MISSING})
+    assert response.status_code == 404
+    assert response.json()["detail"] == f"User with id {MISSING} not found"
+
+    response = client.post("/api/comments/", json={"content": "x", "user_id": user["id"], "post_id": MISSING})
+    assert response.status_code == 404
+    assert response.json()["detail"] == f"Post with id {MISSING} not found"
+
+    response = client.post("/api/comments/", json={"content": "x", "user_id": MISSING, "post_id": post["id"]})
+    assert response.status_code == 404
+    assert response.json()["detail"] == f"User with id {MISSING} not found"
+
+
+def test_rejected_batch_writes_nothing(client, make_user, make_post):
+    user = make_user()
+    post = make_post(user["id"])
+    comments = [{"content": "ok", "user_id": user["id"], "post_id": post["id"]}, {"content": "x", "user_id": user["id"], "post_id": MISSING}]
+
+    response = client.post("/api/comments/batch", json=comments)
+    assert response.status_code == 404
+    assert response.json()["detail"] == f"Posts with ids [{MISSING}] not found"
+    assert client.get(f"/api/comments/post/{post['id']}").json()["count"] == 0
+    assert client.get(f"/api/posts/{post['id']}").json()["comment_count"] == 0
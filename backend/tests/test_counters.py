@@ -0,0 +1,52 @@
+"""
+Denormalized counters: kept in step by the write routes, repaired by reconcile
+"""
+
+from sqlalchemy import update
+
+from app import counters
+from app.models import Post, User
+
+
+def test_writes_adjust_the_counters(client, make_user, make_post):
+    author, friend = make_user(), make_user()
+    post = make_post(author["id"])
+    make_post(author["id"])
+    client.post("/api/comments/", json={"content": "x", "user_id": friend["id"], "post_id": post["id"]})
+    client.post("/api/friends/", json={"user_id": author["id"], "friend_id": friend["id"]})
+
+    assert client.get(f"/api/posts/{post['id']}").json()["comment_count"] == 1
+    user = client.get(f"/api/users/{author['id']}").json()
+    assert (user["post_count"], user["friend_count"]) == (2, 1)
+
+    client.delete(f"/api/posts/{post['id']}", params={"user_id": author["id"]})
+    client.request("DELETE", "/api/friends/", json={"user_id": author["id"], "friend_id": friend["id"]})
+    user = client.get(f"/api/users/{author['id']}").json()
+    assert (user["post_count"], user["friend_count"]) == (1, 0)
+
+
+def _drifted(report: dict, counter: str) -> dict:
+    return {example["id"]: (example["stored"], example["actual"]) for example in report[counter]["examples"]}
+
+
+def test_reconcile_reports_and_fixes_drift(client, db, make_user, make_post):
+    user = make_user()
+    post = make_post(user["id"])
+    db.execute(update(User).where(User.id == user["id"]).values(post_count=5, friend_count=3))
+    db.execute(update(Post).where(Post.id == post["id"]).values(comment_count=2))
+    db.commit()
+
+    report = counters.reconcile(db, fix=False, examples=10**6)
+    assert _drifted(report, "users.post_count")[user["id"]] == (5, 1)
+    assert _drifted(report, "users.friend_count")[user["id"]] == (3, 0)
+    assert _drifted(report, "posts.comment_count")[post["id"]] == (2, 0)
+    db.expire_all()
+    assert db.get(User, user["id"]).post_count == 5
+
+    counters.reconcile(db)
+    report = counters.reconcile(db, fix=False, examples=10**6)
+    assert user["id"] not in _drifted(report, "users.post_count")
+    assert post["id"] not in _drifted(report, "posts.comment_count")
+    db.expire_all()
+    fixed = db.get(User, user["id"])
+    assert (fixed.post_count, fixed.friend_count) == (1, 0)
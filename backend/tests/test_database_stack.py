@@ -0,0 +1,51 @@
+"""
+Routes on the async stack and, with DB_ASYNC off, on the sync stack
+"""
+
+import pytest
+
+from app import database
+from app.config import settings
+
+
+@pytest.fixture(params=[True, False], ids=["async", "sync"])
+def stack(request, monkeypatch):
+    monkeypatch.setattr(settings, "DB_ASYNC", request.param)
+    return request.param
+
+
+def test_round_trip(client, stack, make_user, make_post):
+    author, friend = make_user(), make_user()
+    assert client.post("/api/friends/", json={"user_id": author["id"], "friend_id": friend["id"]}).status_code == 201
+    post = make_post(author["id"], "round trip")
+    comment = client.post("/api/comments/", json={"content": "hi", "user_id": friend["id"], "post_id": post["id"]})
+    assert comment.status_code == 201
+
+    assert client.get(f"/api/posts/{post['id']}").json()["author"]["id"] == author["id"]
+    assert [item["id"] for item in client.get(f"/api/comments/post/{post['id']}").json()["items"]] == [comment.json()["id"]]
+    assert [user["id"] for user in client.get(f"/api/friends/{friend['id']}").json()] == [author["id"]]
+
+    response = client.put(f"/api/posts/{post['id']}", json={"content": "edited"})
+    assert response.json()["content"] == "edited"
+    assert client.delete(f"/api/posts/{post['id']}", params={"user_id": author["id"]}).status_code == 204
+    assert client.get(f"/api/posts/{post['id']}").status_code == 404
+
+
+def test_missing_rows_are_404(client, stack, make_user):
+    user = make_user()
+    missing = 10**9
+    assert client.get(f"/api/users/{missing}").status_code == 404
+    assert client.get(f"/api/posts/{missing}").status_code == 404
+    assert client.get(f"/api/comments/{missing}").status_code == 404
+    assert client.put(f"/api/posts/{missing}", json={"content": "x"}).status_code == 404
+    assert client.delete(f"/api/users/{missing}", params={"current_user_id": user["id"]}).status_code == 404
+    assert client.delete(f"/api/users/{user['id']}", params={"current_user_id": missing}).status_code == 404
+
+
+def test_sessions_are_returned_to_the_pool(client, make_user, make_post):
+    # Only the async pool: the job workers share the sync one
+    user = make_user()
+    make_post(user["id"])
+    client.get(f"/api/posts/{10**9}")
+    client.get(f"/api/feed/{user['id']}")
+    assert database.pool_stats()["async"]["checked_out"] == 0
@@ -0,0 +1,187 @@
+"""
+Friend routes
+"""
+
+import threading
+import time
+
+from sqlalchemy import func, insert, select, update
+
+from app import friend_graph, suggestions
+from app.config import settings
+from app.models import HighDegreeAuthor, TimelineEntry, User, friends
+
+
+def _befriend(client, user_id: int, friend_id: int):
+    return client.post("/api/friends/", json={"user_id": user_id, "friend_id": friend_id})
+
+
+def _unfriend(client, user_id: int, friend_id: int):
+    return client.request("DELETE", "/api/friends/", json={"user_id": user_id, "friend_id": friend_id})
+
+
+def test_already_friends_is_decided_by_the_database(client, make_user):
+    a, b = make_user()["id"], make_user()["id"]
+    assert _befriend(client, a, b).status_code == 201
+    assert _unfriend(client, a, b).status_code == 204
+
+    # Another worker's graph that never saw the removal
+    friend_graph.graph.add_friendship(a, b)
+    assert _befriend(client, a, b).status_code == 201
+    assert [user["id"] for user in client.get(f"/api/friends/{a}").json()] == [b]
+
+
+def test_suggestions_rank_by_mutual_friends_then_co_comments(client, make_user, make_post):
+    me, a, b = (make_user()["id"] for _ in range(3))
+    two_mutual, one_mutual, co_commenter = (make_user()["id"] for _ in range(3))
+    for friend_id in (a, b):
+        _befriend(client, me, friend_id)
+    for friend_id in (a, b):
+        _befriend(client, two_mutual, friend_id)
+    _befriend(client, one_mutual, a)
+    post = make_post(a)
+    for user_id in (me, co_commenter):
+        client.post("/api/comments/", json={"content": "hi", "user_id": user_id, "post_id": post["id"]})
+
+    body = client.get(f"/api/friends/{me}/suggestions").json()
+    assert [(s["user"]["id"], s["mutual_friends"], s["co_comments"]) for s in body] == [
+        (two_mutual, 2, 0), (one_mutual, 1, 0), (co_commenter, 0, 1)
+    ]
+
+    # Stored lists follow friend writes
+    _befriend(client, me, two_mutual)
+    assert [s["user"]["id"] for s in client.get(f"/api/friends/{me}/suggestions").json()][0] == one_mutual
+
+
+def test_friend_writes_refresh_stored_lists_in_the_background(client, make_user):
+    me, friend, friend_of_friend = (make_user()["id"] for _ in range(3))
+    _befriend(client, friend, friend_of_friend)
+    assert client.get(f"/api/friends/{me}/suggestions").json() == []
+
+    _befriend(client, me, friend)
+    deadline = time.monotonic() + 5
+    while [candidate_id for candidate_id, _, _ in suggestions.suggestion_index.get(me)] != [friend_of_friend]:
+        assert time.monotonic() < deadline, "The stored list was never re-ranked"
+        time.sleep(0.02)
+
+
+def test_duplicate_and_missing_users(client, make_user):
+    a, b = make_user()["id"], make_user()["id"]
+    assert _befriend(client, a, b).status_code == 201
+
+    response = _befriend(client, b, a)
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Users are already friends"
+
+    response = _befriend(client, a, 10**9)
+    assert response.status_code == 404
+    assert response.json()["detail"] == f"User with id {10**9} not found"
+    assert _befriend(client, a, a).status_code == 400
+    assert client.get(f"/api/users/{a}").json()["friend_count"] == 1
+
+
+def _store_one_direction(db, user_id: int, friend_id: int):
+    db.execute(insert(friends).values(user_id=user_id, friend_id=friend_id))
+    db.execute(update(User).where(User.id == user_id).values(friend_count=User.friend_count + 1))
+    db.commit()
+
+
+def test_half_stored_friendship_is_repaired(client, db, make_user):
+    a, b = make_user()["id"], make_user()["id"]
+    _store_one_direction(db, a, b)
+
+    assert _befriend(client, a, b).status_code == 201
+    assert _befriend(client, a, b).status_code == 400
+    assert db.scalar(select(func.count()).select_from(friends).where(friends.c.user_id.in_([a, b]))) == 2
+    assert [client.get(f"/api/users/{user_id}").json()["friend_count"] for user_id in (a, b)] == [1, 1]
+
+
+def test_bulk_import(client, db, make_user):
+    a, b, c, d = (make_user()["id"] for _ in range(4))
+    _befriend(client, a, b)
+    _store_one_direction(db, c, a)
+
+    edges = [(a, b), (b, a), (a, c), (a, d), (d, a), (d, d)]
+    response = client.post("/api/friends/bulk", json=[{"user_id": u, "friend_id": f} for u, f in edges])
+    assert response.status_code == 201
+    assert response.json() == {"added": 2, "existing": 1}
+
+    assert sorted(user["id"] for user in client.get(f"/api/friends/{a}").json()) == [b, c, d]
+    counts = [client.get(f"/api/users/{user_id}").json()["friend_count"] for user_id in (a, b, c, d)]
+    assert counts == [3, 1, 1, 1]
+
+
+
+def test_bulk_import_limits(client, make_user, monkeypatch):
+    a, b, c = (make_user()["id"] for _ in range(3))
+    assert client.post("/api/friends/bulk", json=[]).status_code == 400
+
+    monkeypatch.setattr(settings, "FRIEND_IMPORT_MAX_EDGES", 1)
+    edges = [{"user_id": a, "friend_id": b}, {"user_id": a, "friend_id": c}]
+    assert client.post("/api/friends/bulk", json=edges).status_code == 400
+
+
+def test_bulk_import_rejects_missing_users(client, make_user):
+    a, b = make_user()["id"], make_user()["id"]
+    edges = [{"user_id": a, "friend_id": b}, {"user_id": a, "friend_id": 10**9}]
+    response = client.post("/api/friends/bulk", json=edges)
+    assert response.status_code == 404
+    assert client.get(f"/api/friends/{a}").json() == []
+
+
+def test_bulk_import_backfills_timelines(client, make_user, make_post, monkeypatch):
+    monkeypatch.setattr(settings, "FEED_FANOUT_IN_BACKGROUND", False)
+    a, b = make_user()["id"], make_user()["id"]
+    post = make_post(b)
+
+    client.post("/api/friends/bulk", json=[{"user_id": a, "friend_id": b}])
+    assert post["id"] in [item["id"] for item in client.get(f"/api/feed/{a}").json()["items"]]
+
+
+def test_graph_compaction_keeps_writes_made_while_it_runs(monkeypatch):
+    graph = friend_graph.FriendGraph()
+    monkeypatch.setattr(friend_graph, "COMPACT_OVERLAY_ROWS", 3)
+    building, release = threading.Event(), threading.Event()
+    build_csr = friend_graph._build_csr
+
+    def slow_build(sources, targets):
+        building.set()
+        release.wait(5)
+        return build_csr(sources, targets)
+
+    monkeypatch.setattr(friend_graph, "_build_csr", slow_build)
+    graph.add_friendships([(1, 2), (1, 3)])
+    assert building.wait(5)
+
+    # Goes ahead while the rebuild is blocked
+    graph.add_friendship(2, 4)
+    graph.remove_friendship(1, 3)
+    release.set()
+
+    deadline = time.monotonic() + 5
+    while graph._compacting:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    # Rows rewritten during the rebuild stay in the overlay over the new arrays
+    assert len(graph._state[1]) == 4
+    assert graph.stats()["overlay_rows"] == 4
+    assert graph.friend_ids(1).tolist() == [2]
+    assert graph.friend_ids(2).tolist() == [1, 4]
+    assert graph.friend_ids(3).tolist() == []
+
+
+def test_deleting_a_user_updates_their_friends_fan_out_modes(client, db, make_user, make_post, monkeypatch):
+    # Pulled above two friends, pushed again only below 1.6
+    monkeypatch.setattr(settings, "FEED_FANOUT_MAX_FRIENDS", 2)
+    hub, kept, removed, deleted = (make_user()["id"] for _ in range(4))
+    for friend_id in (kept, removed, deleted):
+        _befriend(client, hub, friend_id)
+    _unfriend(client, hub, removed)
+    post = make_post(hub)
+    assert db.scalar(select(HighDegreeAuthor.user_id).where(HighDegreeAuthor.user_id == hub)) == hub
+
+    client.delete(f"/api/users/{deleted}", params={"current_user_id": deleted})
+    db.expire_all()
+    assert db.scalar(select(HighDegreeAuthor.user_id).where(HighDegreeAuthor.user_id == hub)) is None
+    assert post["id"] in [item["id"] for item in client.get(f"/api/feed/{kept}").json()["items"]]
+    assert db.scalars(select(TimelineEntry.post_id).where(TimelineEntry.user_id == kept)).all() == [post["id"]]
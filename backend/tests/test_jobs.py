@@ -0,0 +1,155 @@
+"""
+Background jobs: retries, permanent failures, idempotency keys and leases
+"""
+
+import time
+import uuid
+from datetime import timedelta
+
+import pytest
+from sqlalchemy import select, update
+
+from app import jobs
+from app.config import settings
+from app.models import Job
+
+calls: dict[str, int] = {}
+
+
+@jobs.handler("test.flaky", max_attempts=5)
+def flaky(db, key: str, failures: int):
+    calls[key] = calls.get(key, 0) + 1
+    if calls[key] <= failures:
+        raise RuntimeError("flaky")
+
+
+@jobs.handler("test.rejected")
+def rejected(db, key: str):
+    calls[key] = calls.get(key, 0) + 1
+    raise jobs.JobFailed("rejected")
+
+
+@pytest.fixture(autouse=True)
+def _fast_retries(monkeypatch):
+    monkeypatch.setattr(settings, "JOB_RETRY_BASE_SECONDS", 0.01)
+
+
+def _key() -> str:
+    return uuid.uuid4().hex
+
+
+def _job(db, key: str):
+    db.expire_all()
+    return db.scalar(select(Job).where(Job.idempotency_key == key))
+
+
+def _wait_for(db, key: str, status: str, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = _job(db, key)
+        if job is not None and job.status == status:
+            return job
+        time.sleep(0.02)
+    raise AssertionError(f"Job {key} never became {status}")
+
+
+def _enqueue(db, name: str, key: str, **payload):
+    jobs.enqueue(db, name, {"key": key, **payload}, key=key)
+    db.commit()
+
+
+def test_failures_are_retried_until_the_job_succeeds(client, db):
+    key = _key()
+    _enqueue(db, "test.flaky", key, failures=2)
+    job = _wait_for(db, key, jobs.DONE)
+    assert job.attempts == 3 and calls[key] == 3
+
+
+def test_job_fails_after_max_attempts(client, db):
+    key = _key()
+    _enqueue(db, "test.flaky", key, failures=10)
+    job = _wait_for(db, key, jobs.FAILED)
+    assert job.attempts == 5 and calls[key] == 5
+    assert job.last_error == "RuntimeError: flaky"
+
+
+def test_job_failed_is_not_retried(client, db):
+    key = _key()
+    _enqueue(db, "test.rejected", key)
+    job = _wait_for(db, key, jobs.FAILED)
+    assert job.attempts == 1 and calls[key] == 1
+    assert job.last_error == "JobFailed: rejected"
+
+
+def test_backoff_grows_and_is_capped(monkeypatch):
+    monkeypatch.setattr(settings, "JOB_RETRY_BASE_SECONDS", 1.0)
+    monkeypatch.setattr(settings, "JOB_RETRY_MAX_SECONDS", 10.0)
+    assert 0.5 <= jobs.backoff_seconds(1) <= 1.0
+    assert 4.0 <= jobs.backoff_seconds(4) <= 8.0
+    assert 5.0 <= jobs.backoff_seconds(20) <= 10.0
+
+
+def test_idempotency_key_adds_the_job_once(client, db):
+    key = _key()
+    for _ in range(2):
+        jobs.enqueue(db, "test.flaky", {"key": key, "failures": 0}, key=key)
+    db.commit()
+    _enqueue(db, "test.flaky", key, failures=0)
+    _wait_for(db, key, jobs.DONE)
+    assert len(db.scalars(select(Job.id).where(Job.idempotency_key == key)).all()) == 1
+    assert calls[key] == 1
+
+
+def test_rolled_back_enqueue_adds_nothing(client, db):
+    key = _key()
+    jobs.enqueue(db, "test.flaky", {"key": key, "failures": 0}, key=key)
+    db.rollback()
+    time.sleep(0.2)
+    assert _job(db, key) is None and key not in calls
+
+
+def test_job_of_a_dead_worker_is_run_once_its_lease_expires(client, db):
+    key = _key()
+    jobs.enqueue(db, "test.flaky", {"key": key, "failures": 0}, key=key, delay=3600)
+    db.commit()
+    # Claimed by a worker that never finished it
+    now = jobs._now()
+    db.execute(
+        update(Job)
+        .where(Job.idempotency_key == key)
+        .values(status=jobs.RUNNING, claimed_by="dead", attempts=1, run_at=now, locked_until=now - timedelta(seconds=1))
+    )
+    db.commit()
+    job = _wait_for(db, key, jobs.DONE)
+    assert job.attempts == 2 and calls[key] == 1
+
+
+def test_posts_reach_friends_feeds_through_the_fan_out_job(client, make_user, make_post, monkeypatch):
+    monkeypatch.setattr(settings, "FEED_FANOUT_IN_BACKGROUND", True)
+    me, friend = make_user()["id"], make_user()["id"]
+    client.post("/api/friends/", json={"user_id": me, "friend_id": friend})
+    post = make_post(friend)
+
+    deadline = time.monotonic() + 5
+    while post["id"] not in [item["id"] for item in client.get(f"/api/feed/{me}").json()["items"]]:
+        assert time.monotonic() < deadline, "The post never reached the friend's feed"
+        time.sleep(0.02)
+
+
+def test_finished_jobs_are_purged_after_their_retention(client, db):
+    keys = {status: _key() for status in (jobs.DONE, jobs.FAILED)}
+    for status, key in keys.items():
+        jobs.enqueue(db, "test.flaky", {"key": key, "failures": 0}, key=key, delay=3600)
+    db.commit()
+    for status, key in keys.items():
+        db.execute(
+            update(Job).where(Job.idempotency_key == key).values(status=status, finished_at=jobs._now() - timedelta(days=2))
+        )
+    db.commit()
+
+    # Done jobs are kept for hours, failed ones for days
+    jobs.purge_finished(retention_hours=24, failed_retention_days=7)
+    assert _job(db, keys[jobs.DONE]) is None
+    assert _job(db, keys[jobs.FAILED]) is not None
+    jobs.purge_finished(retention_hours=24, failed_retention_days=1)
+    assert _job(db, keys[jobs.FAILED]) is None
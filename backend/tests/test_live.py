@@ -0,0 +1,91 @@
+"""
+Live feed updates over the WebSocket
+"""
+
+import dataclasses
+import time
+
+from app import jobs
+from app.config import settings
+
+
+def _befriend(client, user_id: int, friend_id: int):
+    assert client.post("/api/friends/", json={"user_id": user_id, "friend_id": friend_id}).status_code == 201
+
+
+def _received(socket, make_post, user_id: int) -> list:
+    """
+    Events received so far, as (type, post id) pairs
+
+    Ends with a post by the feed's owner, which always reaches their feed, so
+    an event that never comes fails the test instead of hanging it.
+    """
+    marker = make_post(user_id, "marker")["id"]
+    events = []
+    while True:
+        event = socket.receive_json()
+        if event["type"] == "post.created" and event["data"]["id"] == marker:
+            return events
+        events.append((event["type"], event["data"].get("id")))
+
+
+def test_feed_stream_follows_friendship_changes(client, make_user, make_post, monkeypatch):
+    # Anyone with two friends is high-degree: their posts go to their author topic
+    monkeypatch.setattr(settings, "FEED_FANOUT_MAX_FRIENDS", 1)
+    me, hub = make_user()["id"], make_user()["id"]
+    for _ in range(2):
+        _befriend(client, hub, make_user()["id"])
+
+    with client.websocket_connect(f"/api/live/ws?feed={me}") as socket:
+        _befriend(client, me, hub)
+        post = make_post(hub)
+        assert _received(socket, make_post, me) == [("friendship.changed", None), ("post.created", post["id"])]
+
+        client.request("DELETE", "/api/friends/", json={"user_id": me, "friend_id": hub})
+        make_post(hub)
+        assert _received(socket, make_post, me) == [("friendship.changed", None)]
+
+
+def test_crossing_the_fan_out_limit_reaches_existing_friends(client, make_user, make_post, monkeypatch):
+    monkeypatch.setattr(settings, "FEED_FANOUT_MAX_FRIENDS", 1)
+    me, author = make_user()["id"], make_user()["id"]
+    _befriend(client, me, author)
+
+    with client.websocket_connect(f"/api/live/ws?feed={me}") as socket:
+        # The author's second friend moves their posts to the author topic
+        _befriend(client, author, make_user()["id"])
+        post = make_post(author)
+        assert _received(socket, make_post, me) == [("friendship.changed", None), ("post.created", post["id"])]
+
+
+
+def test_author_between_the_pull_thresholds_reaches_friends(client, make_user, make_post, monkeypatch):
+    # Pulled above two friends, pushed again only below 1.6
+    monkeypatch.setattr(settings, "FEED_FANOUT_MAX_FRIENDS", 2)
+    me, author, other = make_user()["id"], make_user()["id"], make_user()["id"]
+    for friend_id in (me, other, make_user()["id"]):
+        _befriend(client, author, friend_id)
+    client.request("DELETE", "/api/friends/", json={"user_id": author, "friend_id": other})
+
+    with client.websocket_connect(f"/api/live/ws?feed={me}") as socket:
+        post = make_post(author)
+        assert _received(socket, make_post, me) == [("post.created", post["id"])]
+    assert post["id"] in [item["id"] for item in client.get(f"/api/feed/{me}").json()["items"]]
+
+def test_background_fan_out_publishes_once_the_feed_has_the_post(client, make_user, make_post, monkeypatch):
+    monkeypatch.setattr(settings, "FEED_FANOUT_IN_BACKGROUND", True)
+    fan_out = jobs._handlers["timeline.fan_out"]
+
+    def slow_fan_out(db, **payload):
+        time.sleep(0.3)
+        fan_out.function(db, **payload)
+
+    monkeypatch.setitem(jobs._handlers, "timeline.fan_out", dataclasses.replace(fan_out, function=slow_fan_out))
+    me, friend = make_user()["id"], make_user()["id"]
+    _befriend(client, me, friend)
+
+    with client.websocket_connect(f"/api/live/ws?feed={me}") as socket:
+        post = make_post(friend)
+        event = socket.receive_json()
+        assert (event["type"], event["data"]["id"]) == ("post.created", post["id"])
+        assert post["id"] in [item["id"] for item in client.get(f"/api/feed/{me}").json()["items"]]
@@ -0,0 +1,95 @@
+"""
+Cursor (keyset) pagination
+"""
+
+from datetime import datetime, timezone
+
+from app.config import settings
+from app.models import Post
+
+
+def _pages(client, url, limit):
+    """Follow next_cursor to the end; return every page's ids"""
+    pages, after = [], None
+    while True:
+        params = {"limit": limit, **({"after": after} if after else {})}
+        body = client.get(url, params=params).json()
+        pages.append([item["id"] for item in body["items"]])
+        after = body["next_cursor"]
+        if after is None:
+            return pages
+
+
+def test_cursor_pages_cover_every_post_once(client, make_user, make_post):
+    user = make_user()
+    created = [make_post(user["id"], f"post {i}")["id"] for i in range(5)]
+
+    pages = _pages(client, f"/api/posts/user/{user['id']}", limit=2)
+    assert [len(page) for page in pages] == [2, 2, 1]
+    assert sum(pages, []) == created[::-1]
+
+
+def test_ties_on_created_at_are_ordered_by_id(client, db, make_user):
+    user = make_user()
+    same_time = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    posts = [Post(content=f"tie {i}", user_id=user["id"], created_at=same_time, updated_at=same_time) for i in range(5)]
+    db.add_all(posts)
+    db.commit()
+
+    pages = _pages(client, f"/api/posts/user/{user['id']}", limit=2)
+    assert sum(pages, []) == sorted((post.id for post in posts), reverse=True)
+
+
+def test_cursor_survives_deleting_its_row(client, make_user, make_post):
+    user = make_user()
+    created = [make_post(user["id"], f"post {i}")["id"] for i in range(4)]
+    first = client.get(f"/api/posts/user/{user['id']}", params={"limit": 2}).json()
+    assert [item["id"] for item in first["items"]] == [created[3], created[2]]
+
+    response = client.delete(f"/api/posts/{created[2]}", params={"user_id": user["id"]})
+    assert response.status_code == 204
+
+    rest = client.get(f"/api/posts/user/{user['id']}", params={"limit": 2, "after": first["next_cursor"]}).json()
+    assert [item["id"] for item in rest["items"]] == [created[1], created[0]]
+    assert rest["next_cursor"] is None
+
+
+def test_new_rows_do_not_shift_later_pages(client, make_user, make_post):
+    user = make_user()
+    created = [make_post(user["id"], f"post {i}")["id"] for i in range(4)]
+    first = client.get(f"/api/posts/user/{user['id']}", params={"limit": 2}).json()
+    make_post(user["id"], "newer")
+
+    rest = client.get(f"/api/posts/user/{user['id']}", params={"limit": 2, "after": first["next_cursor"]}).json()
+    assert [item["id"] for item in rest["items"]] == [created[1], created[0]]
+
+
+def test_invalid_cursor_is_rejected(client, make_user):
+    user = make_user()
+    for cursor in ("not-a-cursor", "WyJ4Il0", "e30"):
+        response = client.get(f"/api/posts/user/{user['id']}", params={"after": cursor})
+        assert response.status_code == 400
+        assert response.json()["detail"] == "Invalid cursor"
+
+
+def test_legacy_skip_still_pages(client, make_user, make_post):
+    user = make_user()
+    created = [make_post(user["id"], f"post {i}")["id"] for i in range(3)]
+    body = client.get(f"/api/posts/user/{user['id']}", params={"skip": 1, "limit": 1}).json()
+    assert [item["id"] for item in body["items"]] == [created[1]]
+
+
+def test_ranked_pages_skip_posts_newer_than_the_first_page(client, make_user, make_post, monkeypatch):
+    monkeypatch.setattr(settings, "FEED_FANOUT_IN_BACKGROUND", False)
+    monkeypatch.setattr(settings, "FEED_RANK_CANDIDATES", 3)
+    me, author = make_user()["id"], make_user()["id"]
+    client.post("/api/friends/", json={"user_id": me, "friend_id": author})
+    created = [make_post(author, f"post {i}")["id"] for i in range(3)]
+
+    url = f"/api/feed/{me}"
+    first = client.get(url, params={"mode": "ranked", "limit": 2}).json()
+    for i in range(3):
+        make_post(author, f"newer {i}")
+
+    rest = client.get(url, params={"mode": "ranked", "limit": 2, "after": first["next_cursor"]}).json()
+    assert sorted(item["id"] for item in first["items"] + rest["items"]) == created
@@ -0,0 +1,118 @@
+"""
+Full-text search: ranking, indexing at write time and the (score, id) cursor
+"""
+
+import itertools
+
+import pytest
+
+from app import search_index
+from app.database import SessionLocal
+
+_words = itertools.count(1)
+
+
+def _word() -> str:
+    """A search term no other test uses"""
+    return f"zephyrword{next(_words)}"
+
+
+@pytest.fixture(params=["fts5", "memory"])
+def backend(request, client, monkeypatch):
+    """Run the test against each backend available on SQLite"""
+    monkeypatch.setattr(search_index.settings, "SEARCH_BACKEND", request.param)
+    with SessionLocal() as db:
+        active = search_index.init_search(db)
+    yield active
+    monkeypatch.undo()
+    with SessionLocal() as db:
+        search_index.init_search(db)
+
+
+def _ids(body) -> list[int]:
+    return [item["id"] for item in body["items"]]
+
+
+def test_user_field_weights(client, backend, make_user):
+    word = _word()
+    in_bio = make_user(bio=f"likes {word}")
+    in_name = make_user(full_name=f"Sam {word}")
+    in_username = make_user(username=f"{word}fan")
+
+    body = client.get("/api/search/users", params={"q": word}).json()
+    assert _ids(body) == [in_username["id"], in_name["id"], in_bio["id"]]
+
+
+def test_prefix_match(client, backend, make_user, make_post):
+    word = _word()
+    user = make_user()
+    post = make_post(user["id"], f"all about {word}ing")
+
+    body = client.get("/api/search/posts", params={"q": word}).json()
+    assert _ids(body) == [post["id"]]
+
+
+def test_index_follows_updates_and_deletes(client, backend, make_user, make_post):
+    old, new = _word(), _word()
+    user = make_user()
+    post = make_post(user["id"], f"first {old}")
+
+    client.put(f"/api/posts/{post['id']}", json={"content": f"second {new}"})
+    assert _ids(client.get("/api/search/posts", params={"q": old}).json()) == []
+    assert _ids(client.get("/api/search/posts", params={"q": new}).json()) == [post["id"]]
+
+    client.delete(f"/api/posts/{post['id']}", params={"user_id": user["id"]})
+    assert _ids(client.get("/api/search/posts", params={"q": new}).json()) == []
+
+
+def test_failed_write_leaves_the_index_alone(client, backend, make_user, make_post):
+    old, new = _word(), _word()
+    user = make_user()
+    post = make_post(user["id"], old)
+
+    # Indexed, then rolled back because the image was never uploaded
+    missing_upload = f"/uploads/post_images/00/00/{'0' * 64}.jpg"
+    response = client.put(f"/api/posts/{post['id']}", json={"content": new, "image_url": missing_upload})
+    assert response.status_code == 400
+    assert _ids(client.get("/api/search/posts", params={"q": new}).json()) == []
+    assert _ids(client.get("/api/search/posts", params={"q": old}).json()) == [post["id"]]
+
+
+def test_rank_cursor_pages_cover_every_hit_once(client, backend, make_user, make_post):
+    word = _word()
+    user = make_user()
+    created = {make_post(user["id"], f"{word} " * (i % 3 + 1))["id"] for i in range(7)}
+
+    seen, after = [], None
+    while True:
+        params = {"q": word, "limit": 3, **({"after": after} if after else {})}
+        body = client.get("/api/search/posts", params=params).json()
+        seen += _ids(body)
+        after = body["next_cursor"]
+        if after is None:
+            break
+    assert sorted(seen) == sorted(created)
+
+
+def test_search_all_returns_both_result_sets(client, backend, make_user, make_post):
+    word = _word()
+    user = make_user(bio=word)
+    post = make_post(user["id"], word)
+
+    body = client.get("/api/search/", params={"q": word}).json()
+    assert _ids(body["users"]) == [user["id"]]
+    assert _ids(body["posts"]) == [post["id"]]
+
+    body = client.get("/api/search/", params={"q": word, "type": "users"}).json()
+    assert "posts" not in body
+
+
+def test_input_is_not_fts_syntax(client, backend):
+    for q in ('"', "a OR", "NEAR(x y)", "*"):
+        assert client.get("/api/search/posts", params={"q": q}).status_code == 200
+
+
+def test_invalid_rank_cursor_is_rejected(client):
+    response = client.get("/api/search/posts", params={"q": "x", "after": "not-a-cursor"})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid cursor"
@@ -0,0 +1,145 @@
+"""
+Content-addressed uploads: references held by the posts and users storing their URLs
+"""
+
+import io
+import os
+import time
+
+import pytest
+from PIL import Image
+from sqlalchemy import func, select, update
+
+from app import jobs
+from app.config import settings
+from app.models import Job
+from app.upload_utils import UPLOAD_DIR, UPLOAD_DIRS
+
+MISSING_UPLOAD = f"/uploads/post_images/00/00/{'0' * 64}.jpg"
+
+
+def _image() -> bytes:
+    """A JPEG of random pixels, so no other upload has the same content"""
+    buffer = io.BytesIO()
+    Image.frombytes("RGB", (64, 48), os.urandom(64 * 48 * 3)).save(buffer, "JPEG")
+    return buffer.getvalue()
+
+
+def _stored(url: str):
+    return UPLOAD_DIR / url.removeprefix("/uploads/")
+
+
+@pytest.fixture(autouse=True)
+def _remove_empty_dirs():
+    yield
+    for path in sorted(UPLOAD_DIR.rglob("*"), reverse=True):
+        if path.is_dir() and path not in UPLOAD_DIRS.values() and not any(path.iterdir()):
+            path.rmdir()
+
+
+def _upload(client, kind: str, content: bytes) -> dict:
+    response = client.post(f"/api/upload/{kind}", files={"file": ("a.jpg", content, "image/jpeg")})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def _collect_now(monkeypatch):
+    """Collect unreferenced uploads as soon as they are released, rather than after a day"""
+    monkeypatch.setattr(settings, "UPLOAD_UNATTACHED_HOURS", 0)
+
+
+def _wait_for_collection(db, timeout: float = 5.0) -> None:
+    """Wait until every due uploads.collect job has run"""
+    deadline = time.monotonic() + timeout
+    pending = (
+        select(func.count())
+        .select_from(Job)
+        .where(Job.name == "uploads.collect", Job.status.in_([jobs.QUEUED, jobs.RUNNING]), Job.run_at <= jobs._now())
+    )
+    while db.scalar(pending):
+        assert time.monotonic() < deadline, "Collection never finished"
+        time.sleep(0.02)
+        db.rollback()
+
+
+def test_file_lives_while_any_row_stores_its_url(client, db, make_user, monkeypatch):
+    content = _image()
+    first, second = _upload(client, "post-image", content), _upload(client, "post-image", content)
+    assert first["file_url"] == second["file_url"]
+
+    owner, other = make_user(), make_user()
+    post = client.post("/api/posts/", json={"content": "a", "user_id": owner["id"], "image_url": first["file_url"]})
+    # Reuses the stored URL (a variant of it) without uploading again
+    client.post("/api/posts/", json={"content": "b", "user_id": other["id"], "image_url": first["variants"]["full"]})
+    _collect_now(monkeypatch)
+
+    client.delete(f"/api/posts/{post.json()['id']}", params={"user_id": owner["id"]})
+    _wait_for_collection(db)
+    assert _stored(first["file_url"]).exists()
+
+    client.delete(f"/api/users/{other['id']}", params={"current_user_id": other["id"]})
+    _wait_for_collection(db)
+    assert not _stored(first["file_url"]).exists()
+    assert not _stored(first["variants"]["full"]).exists()
+
+
+def test_unattached_upload_is_collected(client, db, monkeypatch):
+    upload = _upload(client, "post-image", _image())
+    # A day passes: the collection queued by the upload is due and the grace period is over
+    _collect_now(monkeypatch)
+    db.execute(update(Job).where(Job.name == "uploads.collect", Job.status == jobs.QUEUED).values(run_at=jobs._now()))
+    db.commit()
+    _wait_for_collection(db)
+    assert not _stored(upload["file_url"]).exists()
+
+
+def test_replacing_a_profile_picture_releases_the_old_one(client, db, make_user, monkeypatch):
+    old, new = _upload(client, "profile-picture", _image()), _upload(client, "profile-picture", _image())
+    user = make_user()
+    client.put(f"/api/users/{user['id']}", json={"profile_picture": old["variants"]["feed"]})
+    client.put(f"/api/users/{user['id']}", json={"profile_picture": new["variants"]["feed"]})
+    _collect_now(monkeypatch)
+    _wait_for_collection(db)
+    assert not _stored(old["file_url"]).exists()
+    assert _stored(new["file_url"]).exists()
+
+    client.delete(f"/api/users/{user['id']}", params={"current_user_id": user["id"]})
+    _wait_for_collection(db)
+    assert not _stored(new["file_url"]).exists()
+
+
+def test_replacing_a_post_image_releases_the_old_one(client, db, make_user, monkeypatch):
+    old, new = _upload(client, "post-image", _image()), _upload(client, "post-image", _image())
+    user = make_user()
+    post = client.post("/api/posts/", json={"content": "a", "user_id": user["id"], "image_url": old["file_url"]}).json()
+    client.put(f"/api/posts/{post['id']}", json={"image_url": new["file_url"]})
+    _collect_now(monkeypatch)
+    _wait_for_collection(db)
+    assert not _stored(old["file_url"]).exists()
+
+    client.delete(f"/api/posts/{post['id']}", params={"user_id": user["id"]})
+    _wait_for_collection(db)
+    assert not _stored(new["file_url"]).exists()
+
+
+def test_failed_update_keeps_the_old_image(client, db, make_user, monkeypatch):
+    upload = _upload(client, "post-image", _image())
+    user = make_user()
+    post = client.post("/api/posts/", json={"content": "a", "user_id": user["id"], "image_url": upload["file_url"]}).json()
+    _collect_now(monkeypatch)
+
+    response = client.put(f"/api/posts/{post['id']}", json={"image_url": MISSING_UPLOAD})
+    assert response.status_code == 400
+    assert response.json()["detail"] == f"Upload not found: {MISSING_UPLOAD}"
+    _wait_for_collection(db)
+    assert _stored(upload["file_url"]).exists()
+    assert client.get(f"/api/posts/{post['id']}").json()["image_url"] == upload["file_url"]
+
+    client.delete(f"/api/posts/{post['id']}", params={"user_id": user["id"]})
+
+
+def test_external_urls_are_ignored(client, make_user):
+    user = make_user()
+    post = client.post("/api/posts/", json={"content": "a", "user_id": user["id"], "image_url": "https://example.com/a.jpg"})
+    assert post.status_code == 201
+    assert client.delete(f"/api/posts/{post.json()['id']}", params={"user_id": user["id"]}).status_code == 204
@@ -5,7 +5,7 @@ import { useRouter, useParams } from "next/navigation";
 import { Card } from "@/shared/components/ui/card";
 import { Button } from "@/shared/components/ui/button";
 import { Loader2, ArrowLeft } from "lucide-react";
-import { getUser, getUserFriends, addFriend, removeFriend, UserResponse } from "@/shared/lib/api/";
+import { getUsers, getUserFriends, addFriend, removeFriend, UserResponse } from "@/shared/lib/api/";
 import { useAppSelector } from "@/shared/store/hooks";
 import { ProfileTabs, PostsTab, OtherUserHeader, OtherUserFriends } from "@/features/profile";
 
@@ -36,12 +36,17 @@ export default function UserProfilePage() {
     const fetchData = async () => {
       setIsLoading(true);
       try {
-        const [userRes, friendsRes, currentFriendsRes, currentUserRes] = await Promise.all([
-          getUser(userId),
+        // Both profiles in one request
+        const [users, friendsRes, currentFriendsRes] = await Promise.all([
+          getUsers(currentUserId ? [userId, currentUserId] : [userId]),
           getUserFriends(userId),
           currentUserId ? getUserFriends(currentUserId) : Promise.resolve([]),
-          currentUserId ? getUser(currentUserId) : Promise.resolve(null),
         ]);
+        const userRes = users.find(user => user.id === userId);
+        if (!userRes) {
+          throw new Error(`User with id ${userId} not found`);
+        }
+        const currentUserRes = users.find(user => user.id === currentUserId) || null;
         setUserData(userRes);
         setFriends(friendsRes);
         setCurrentUserFriends(currentFriendsRes);
@@ -8,7 +8,7 @@ export async function handleProfilePictureUpload(
 ) {
   try {
     const result = await uploadProfilePicture(file);
-    await updateUser(userId, { profile_picture: result.file_url });
+    await updateUser(userId, { profile_picture: result.variants.feed });
     await onSuccess();
   } catch (err) {
     onError(err instanceof Error ? err.message : "Failed to upload profile picture");
@@ -4,7 +4,7 @@ import { useEffect, useState } from "react";
 import { useRouter } from "next/navigation";
 import { Card } from "@/shared/components/ui/card";
 import { Loader2 } from "lucide-react";
-import { UserResponse } from "@/shared/lib/api/";
+import { Page, UserResponse } from "@/shared/lib/api/";
 import { BACKEND_URL } from "@/shared/lib/api/config";
 
 interface UserSearchProps {
@@ -43,7 +43,8 @@ export function UserSearch({ query }: UserSearchProps) {
         throw new Error("Failed to search users");
       }
       
-      const allUsers: UserResponse[] = await response.json();
+      const page: Page<UserResponse> = await response.json();
+      const allUsers = page.items;
       const filteredUsers = allUsers.filter((user) =>
         user.username.toLowerCase().includes(query.toLowerCase())
       );
@@ -56,7 +56,7 @@ export function CreatePostDialog({ onPostCreated }: CreatePostDialogProps) {
 
       if (imageFile) {
         const uploadResult = await uploadPostImage(imageFile);
-        imageUrl = uploadResult.file_url;
+        imageUrl = uploadResult.variants.full;
       }
 
       await createPost({
@@ -1,5 +1,5 @@
 import { API_BASE_URL } from "./config";
-import { UserResponse } from "./types";
+import { AuthorSummary, Page } from "./types";
 
 export interface CommentResponse {
   id: number;
@@ -7,7 +7,7 @@ export interface CommentResponse {
   user_id: number;
   post_id: number;
   created_at: string;
-  author: UserResponse;
+  author: AuthorSummary;
 }
 
 export interface CreateCommentRequest {
@@ -27,7 +27,8 @@ export async function getPostComments(postId: number): Promise<CommentResponse[]
     throw new Error(error.detail || "Failed to fetch comments");
   }
 
-  return response.json();
+  const page: Page<CommentResponse> = await response.json();
+  return page.items;
 }
 
 /**
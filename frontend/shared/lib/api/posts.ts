@@ -1,14 +1,15 @@
 import { API_BASE_URL } from "./config";
-import { UserResponse } from "./types";
+import { AuthorSummary, MultiGet, Page } from "./types";
 
 export interface PostResponse {
   id: number;
   content: string;
   image_url?: string;
   user_id: number;
+  comment_count: number;
   created_at: string;
   updated_at: string;
-  author: UserResponse;
+  author: AuthorSummary;
 }
 
 export interface CreatePostRequest {
@@ -33,7 +34,8 @@ export async function getAllPosts(skip: number = 0, limit: number = 100): Promis
     throw new Error(error.detail || "Failed to fetch posts");
   }
 
-  return response.json();
+  const page: Page<PostResponse> = await response.json();
+  return page.items;
 }
 
 /**
@@ -50,6 +52,21 @@ export async function getPost(postId: number): Promise<PostResponse> {
   return response.json();
 }
 
+/**
+ * Get several posts in one request; ids that don't exist are skipped
+ */
+export async function getPosts(postIds: number[]): Promise<PostResponse[]> {
+  const response = await fetch(`${API_BASE_URL}/posts/?ids=${postIds.join(",")}`);
+
+  if (!response.ok) {
+    const error = await response.json();
+    throw new Error(error.detail || "Failed to fetch posts");
+  }
+
+  const result: MultiGet<PostResponse> = await response.json();
+  return result.items;
+}
+
 /**
  * Get posts by a specific user
  */
@@ -61,7 +78,8 @@ export async function getUserPosts(userId: number, skip: number = 0, limit: numb
     throw new Error(error.detail || "Failed to fetch user posts");
   }
 
-  return response.json();
+  const page: Page<PostResponse> = await response.json();
+  return page.items;
 }
 
 /**
@@ -14,6 +14,28 @@ export interface UpdateUserRequest {
   bio?: string;
 }
 
+export interface Page<T> {
+  items: T[];
+  count: number;
+  next_cursor: string | null;
+}
+
+export interface MultiGet<T> {
+  items: T[];
+  count: number;
+  missing: number[];
+}
+
+export interface UploadResponse {
+  filename: string;
+  file_url: string;
+  variants: {
+    thumb: string;
+    feed: string;
+    full: string;
+  };
+}
+
 export interface UserResponse {
   id: number;
   username: string;
@@ -21,6 +43,15 @@ export interface UserResponse {
   full_name: string;
   bio?: string;
   profile_picture?: string;
+  post_count: number;
+  friend_count: number;
   created_at: string;
   is_admin: boolean;
 }
+
+export interface AuthorSummary {
+  id: number;
+  username: string;
+  full_name: string;
+  profile_picture?: string;
+}
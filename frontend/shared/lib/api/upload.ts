@@ -1,6 +1,7 @@
 import { API_BASE_URL } from "./config";
+import { UploadResponse } from "./types";
 
-export async function uploadProfilePicture(file: File): Promise<{ file_url: string }> {
+export async function uploadProfilePicture(file: File): Promise<UploadResponse> {
   const formData = new FormData();
   formData.append("file", file);
 
@@ -17,7 +18,7 @@ export async function uploadProfilePicture(file: File): Promise<{ file_url: stri
   return response.json();
 }
 
-export async function uploadPostImage(file: File): Promise<{ file_url: string }> {
+export async function uploadPostImage(file: File): Promise<UploadResponse> {
   const formData = new FormData();
   formData.append("file", file);
 
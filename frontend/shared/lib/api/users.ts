@@ -1,5 +1,5 @@
 import { API_BASE_URL } from "./config";
-import { CreateUserRequest, UpdateUserRequest, UserResponse } from "./types";
+import { CreateUserRequest, MultiGet, Page, UpdateUserRequest, UserResponse } from "./types";
 
 export async function createUser(data: CreateUserRequest): Promise<UserResponse> {
   const response = await fetch(`${API_BASE_URL}/users`, {
@@ -29,6 +29,21 @@ export async function getUser(userId: number): Promise<UserResponse> {
   return response.json();
 }
 
+/**
+ * Get several users in one request; ids that don't exist are skipped
+ */
+export async function getUsers(userIds: number[]): Promise<UserResponse[]> {
+  const response = await fetch(`${API_BASE_URL}/users/?ids=${userIds.join(",")}`);
+
+  if (!response.ok) {
+    const errorData = await response.json();
+    throw new Error(errorData.detail || "Failed to fetch users");
+  }
+
+  const result: MultiGet<UserResponse> = await response.json();
+  return result.items;
+}
+
 export async function getAllUsers(): Promise<UserResponse[]> {
   const response = await fetch(`${API_BASE_URL}/users`);
 
@@ -37,7 +52,8 @@ export async function getAllUsers(): Promise<UserResponse[]> {
     throw new Error(errorData.detail || "Failed to fetch users");
   }
 
-  return response.json();
+  const page: Page<UserResponse> = await response.json();
+  return page.items;
 }
 
 export async function getUserByUsername(username: string): Promise<UserResponse | null> {